@@ -0,0 +1,301 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Analytics (Cryptopia)
+
+This module gives a portfolio view of the orders out of the pipeline (stage
+"bak"). The audits of the orders are loaded once in NumPy columns (pair,
+dates, buy, sell, fees...) kept in a cache file next to the orders, so a new
+report only loads the orders done since the previous one. The figures are
+computed on the columns, without a loop on the orders:
+- aggregate profit, win rate, fee drag,
+- breakdowns by pair and by period (day, week, month),
+- drawdown of the cumulated net profit.
+
+Usage :
+
+    python analytics.py [--period day|week|month] [--data data]
+                        [--sqlite data/orders.db]
+
+Classes:
+
+    Portfolio : Audits of the orders as columns
+        parameters :
+            order_store (req) : store of the orders
+            cache_path (opt) : path of the cache file (.npz) - default : None
+
+Methods :
+
+    summary (columns) : Aggregate profit, win rate and fee drag
+
+    by_pair (columns) : Figures by pair
+
+    by_period (columns, period) : Figures by period of the sell date
+
+    drawdown (columns) : Maximum drawdown of the cumulated net profit
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import sys
+import argparse
+
+import numpy as np
+
+import store
+
+# cache of the columns, in the data folder
+CACHE_FILE = "analytics.npz"
+# columns of the audits: name -> dtype
+COLUMNS = (("id", "U64"), ("pair", "U32"), ("indate", "datetime64[us]"),
+           ("outdate", "datetime64[us]"), ("amount", "f8"), ("buy", "f8"),
+           ("sell", "f8"), ("fees", "f8"))
+# numpy units of the periods
+PERIODS = {"day": "D", "week": "W", "month": "M"}
+# days from the start of the periods to the start of the numpy periods (the
+# numpy weeks start on Thursday, the day of the epoch, the weeks on Monday)
+SHIFTS = {"week": 3}
+
+def _date(value):
+    """Return a datetime64 of a date of the orders ("NaT" if missing)"""
+    if not value:
+        return np.datetime64("NaT", "us")
+    return np.datetime64(value.replace(" ", "T"), "us")
+
+def _empty():
+    return dict((name, np.empty(0, dtype)) for name, dtype in COLUMNS)
+
+class Portfolio(object):
+    """Audits of the orders out of the pipeline, as NumPy columns.
+    Arguments:
+        order_store: store of the orders (store.OrderStore)
+        cache_path: path of the cache file of the columns (.npz), no cache
+                    if None
+    """
+    def __init__(self, order_store, cache_path=None):
+        self.order_store = order_store
+        self.cache_path = cache_path
+        self.columns = _empty()
+        # ids of the orders without audit (not in the columns)
+        self.skipped = np.empty(0, "U64")
+        if cache_path is not None and os.path.exists(cache_path):
+            self.load()
+
+    def __len__(self):
+        return len(self.columns["id"])
+
+    def load(self):
+        """Read the columns of the cache file"""
+        try:
+            with np.load(self.cache_path) as data:
+                columns = dict((name, data[name].astype(dtype))
+                               for name, dtype in COLUMNS)
+                skipped = np.empty(0, "U64")
+                if "skipped" in data.files:
+                    skipped = data["skipped"].astype("U64")
+        except (OSError, KeyError, ValueError):
+            return
+        self.columns = columns
+        self.skipped = skipped
+
+    def save(self):
+        """Write the columns in the cache file"""
+        if self.cache_path is None:
+            return
+        temp_path = self.cache_path + ".tmp.npz"
+        np.savez(temp_path, skipped=self.skipped, **self.columns)
+        os.replace(temp_path, self.cache_path)
+
+    def refresh(self):
+        """Add the columns of the orders done since the last refresh (orders
+        of the "bak" stage not in the columns yet). The orders without audit
+        are remembered too, so they are read once. Return the number of
+        orders added"""
+        known = set(self.columns["id"].tolist())
+        known.update(self.skipped.tolist())
+        rows = []
+        skipped = []
+        for order_id in self.order_store.list("bak"):
+            if order_id in known:
+                continue
+            root = self.order_store.load(order_id)
+            header = root.find("header")
+            action = root.find("action")
+            audit = root.find("audit")
+            if audit is None or audit.get("Buy") is None:
+                # no audit (no trade), nothing to report
+                skipped.append(order_id)
+                continue
+            rows.append((order_id, header.get("pair"),
+                         header.get("date"), action.get("date"),
+                         float(header.get("amount") or 0.0),
+                         float(audit.get("Buy")), float(audit.get("Sell")),
+                         float(audit.get("Fees"))))
+        if rows:
+            values = list(zip(*rows))
+            for index, (name, dtype) in enumerate(COLUMNS):
+                if dtype.startswith("datetime"):
+                    column = np.array([_date(value)
+                                       for value in values[index]])
+                else:
+                    column = np.array(values[index], dtype)
+                self.columns[name] = np.concatenate([self.columns[name],
+                                                     column])
+        if skipped:
+            self.skipped = np.concatenate([self.skipped,
+                                           np.array(skipped, "U64")])
+        if rows or skipped:
+            self.save()
+        return len(rows)
+
+def summary(columns):
+    """Return the aggregate figures of the columns as a dictionnary: orders,
+    traded (orders with a buy), buy, sell, fees, raw and net profit, net
+    performance, win rate (share of the traded orders with a net profit),
+    fee drag (fees / buy, the performance lost in fees) and average net
+    performance
+    Arguments:
+        columns: columns of a Portfolio
+    """
+    buy = columns["buy"]
+    sell = columns["sell"]
+    fees = columns["fees"]
+    net = sell - buy - fees
+    traded = buy > 0
+    total_buy = buy.sum()
+    raw_profit = sell.sum() - total_buy
+    net_profit = net.sum()
+    count = int(traded.sum())
+    perf = np.divide(net, buy, out=np.zeros_like(net), where=traded)
+    return {"orders": len(buy),
+            "traded": count,
+            "buy": float(total_buy),
+            "sell": float(sell.sum()),
+            "fees": float(fees.sum()),
+            "raw_profit": float(raw_profit),
+            "net_profit": float(net_profit),
+            "net_perf": float(net_profit/total_buy) if total_buy else 0.0,
+            "win_rate": float((net[traded] > 0).sum()/count)
+                        if count else 0.0,
+            "fee_drag": float(fees.sum()/total_buy) if total_buy else 0.0,
+            "average_perf": float(perf[traded].mean()) if count else 0.0}
+
+def _group(keys, columns):
+    """Return the figures of the columns grouped by keys as a dictionnary
+    key -> {orders, buy, sell, fees, net_profit, net_perf, win_rate}"""
+    if len(keys) == 0:
+        return {}
+    labels, inverse = np.unique(keys, return_inverse=True)
+    buy = columns["buy"]
+    net = columns["sell"] - buy - columns["fees"]
+    sums = {}
+    for name, values in (("buy", buy), ("sell", columns["sell"]),
+                         ("fees", columns["fees"]), ("net_profit", net)):
+        sums[name] = np.bincount(inverse, weights=values,
+                                 minlength=len(labels))
+    orders = np.bincount(inverse, minlength=len(labels))
+    traded = np.bincount(inverse, weights=buy > 0, minlength=len(labels))
+    wins = np.bincount(inverse, weights=(buy > 0) & (net > 0),
+                       minlength=len(labels))
+    result = {}
+    for index, label in enumerate(labels.tolist()):
+        total_buy = sums["buy"][index]
+        result[label] = {
+                "orders": int(orders[index]),
+                "buy": float(total_buy),
+                "sell": float(sums["sell"][index]),
+                "fees": float(sums["fees"][index]),
+                "net_profit": float(sums["net_profit"][index]),
+                "net_perf": float(sums["net_profit"][index]/total_buy)
+                            if total_buy else 0.0,
+                "win_rate": float(wins[index]/traded[index])
+                            if traded[index] else 0.0}
+    return result
+
+def by_pair(columns):
+    """Return the figures by pair (see _group)
+    Arguments:
+        columns: columns of a Portfolio
+    """
+    return _group(columns["pair"], columns)
+
+def by_period(columns, period="day"):
+    """Return the figures by period of the sell date (see _group), the keys
+    are the first days of the periods ("2018-12-03", the weeks start on 
+    Monday)
+    Arguments:
+        columns: columns of a Portfolio
+        period: "day", "week" or "month"
+    """
+    dated = ~np.isnat(columns["outdate"])
+    shift = np.timedelta64(SHIFTS.get(period, 0), "D")
+    days = columns["outdate"][dated].astype("datetime64[D]") + shift
+    periods = days.astype("datetime64[" + PERIODS[period] + "]")
+    keys = np.datetime_as_string(periods.astype("datetime64[D]") - shift)
+    return _group(keys, dict((name, column[dated])
+                             for name, column in columns.items()))
+
+def drawdown(columns):
+    """Return the maximum drawdown of the net profit cumulated in the order
+    of the sell dates, as a dictionnary: drawdown, peak and trough dates
+    Arguments:
+        columns: columns of a Portfolio
+    """
+    dated = ~np.isnat(columns["outdate"])
+    order = np.argsort(columns["outdate"][dated], kind="stable")
+    dates = columns["outdate"][dated][order]
+    net = (columns["sell"] - columns["buy"] - columns["fees"])[dated][order]
+    if len(net) == 0:
+        return {"drawdown": 0.0, "peak": None, "trough": None}
+    cumulated = np.cumsum(net)
+    peaks = np.maximum.accumulate(np.maximum(cumulated, 0.0))
+    drops = peaks - cumulated
+    trough = int(np.argmax(drops))
+    if drops[trough] <= 0:
+        return {"drawdown": 0.0, "peak": None, "trough": None}
+    peak = int(np.argmax(cumulated[:trough+1] >= peaks[trough])
+               if peaks[trough] > 0 else -1)
+    return {"drawdown": float(drops[trough]),
+            "peak": str(dates[peak]) if peak >= 0 else None,
+            "trough": str(dates[trough])}
+
+def Main(argv=None):
+    """
+    Method to print the report of the orders from the command line (see the
+    module help)
+    """
+    parser = argparse.ArgumentParser(description="Report of the orders")
+    parser.add_argument("--period", choices=sorted(PERIODS), default="day")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--sqlite", default=None)
+    args = parser.parse_args(argv)
+    if args.sqlite:
+        order_store = store.SqliteOrderStore(args.sqlite)
+    else:
+        order_store = store.XmlOrderStore(args.data)
+    portfolio = Portfolio(order_store, os.path.join(args.data, CACHE_FILE))
+    print("new orders : " + str(portfolio.refresh()))
+    columns = portfolio.columns
+    for name, value in summary(columns).items():
+        print('{:<14s} {}'.format(name, value))
+    print("drawdown : " + str(drawdown(columns)))
+    for title, figures in (("pair", by_pair(columns)),
+                           (args.period, by_period(columns, args.period))):
+        print("-- by " + title)
+        for key, values in figures.items():
+            print('{:<12s} {:>5d} orders net {:.8f} ({:+.2%}) win {:.0%}'
+                  .format(key, values["orders"], values["net_profit"],
+                          values["net_perf"], values["win_rate"]))
+
+if __name__ == "__main__":
+    Main(sys.argv[1:])
+
+# #######################################################79####################
@@ -9,6 +9,20 @@ So I can't say who was the author.
 It was written for Python 2.7, I've made the adaption to Python 3.
 Some change ti implement the "UTF-8" compliance.
 
+Classes:
+    Client (key, secret, config_path, transport, limiter) :
+        Client of the api, built once per process by get_client. The
+        credentials are read at the first private call (given, environment
+        or config file), the secret is decoded once.
+        Arguments:
+            key, secret (opt): API key and secret (base64)
+                               default value = None (read later)
+            config_path (opt): path of the config file
+                               default value = config.xml next to api.py
+            transport (opt): transport of the calls
+                             default value = pooled Transport (first call)
+            limiter (opt): limiter of the calls - default value = LIMITER
+
 Methods:
     query (method, req) : 
         Call a method of the api with the parameters specified. 
@@ -18,8 +32,52 @@ Methods:
             req (opt): list (public) or dictionnary (private) of parameters
                        default value = None
 
-Config file:
-    The API needs a key and a secret that are to be sotred in a xml config file
+    aquery (method, req) : 
+        Coroutine version of query, the call runs in a pool of threads 
+        (POOL_SIZE) so that several calls can wait on the exchange at once.
+        Same arguments and response as query
+
+    get_client / set_client (client) :
+        Client used by query, created at the first call / replaced
+
+    load_config (file_path) :
+        Read the API key and secret from the xml config file. Done at the 
+        first call of the private api if the credentials are not set
+        Arguments:
+            file_path (opt): path of the config file 
+                             default value = config.xml next to api.py
+
+    set_credentials (key, secret) :
+        Set the API key and secret instead of reading the config file
+
+    set_transport (transport) :
+        Replace the transport used by query (ie: a stub for the tests)
+        Arguments:
+            transport (req): object with the get and post methods of the
+                             Transport class, None to restore the default
+
+Transport:
+    The calls share a pooled, keep-alive requests.Session so that the 
+    TCP/TLS handshake is not paid on each call. The pool size, the timeout
+    and the retries (with backoff) on connection resets are set with the 
+    POOL_SIZE, TIMEOUT, RETRIES and BACKOFF constants. The requests package
+    is imported when the first transport is created (a short run or a
+    worker process doesn't pay for it before its first call).
+
+Rate limits:
+    The calls wait for a token of the public or private bucket of the 
+    limiter (see ratelimit.py), the trade methods first. A call refused for
+    too many calls (HTTP 429 or error message) slows the bucket down and is
+    sent again, at most RATE_RETRIES times.
+
+Metrics:
+    The latency of each call and the calls failed or answered with 
+    Success=false are counted by method (see metrics.py).
+
+Credentials:
+    The API needs a key and a secret, looked for at the first private call:
+    given to the client (set_credentials), in the environment variables
+    CRYPTOPIA_API_KEY and CRYPTOPIA_API_SECRET, or in a xml config file
     -----------
     config.xml
     -----------
@@ -35,90 +93,376 @@ __author__ = "?"                       # Found on Cryptopia Forum (closed now)
 __contact__ = "bYhO-bOwA-dIcA"         #
 __date__ = "tIfY-mArI-kA"              # Mon Nov 26 16:26:55 2018
 __email__ = "j.t[4t]free.fr"           #
-__version__ = "2.2.1"                  #
+__version__ = "2.5.0"                  #
 #                                      #
 # ##################################79#########################################
 
 import os
 import time
-import hmac
-import urllib
-import urllib.parse
-import requests
-import hashlib
-import base64
 import json
+import hashlib
 from random import randint
-import xml.etree.ElementTree as etree
 
-# Get the API key and secret from the xml file
-api_file_path = os.path.realpath(__file__)
-api_folder_path = os.path.dirname(api_file_path)
-tree = etree.parse(os.path.join(api_folder_path,"config.xml"))
-root = tree.getroot()
-API_KEY = root.findall("API_KEY")[0].text
-API_SECRET = root.findall("API_SECRET")[0].text
+import logger
+import metrics
+import ratelimit
+from ratelimit import RateLimitError
 
-def query( method, req = None ):
-    """Call a method of the api with the parameters specified. 
-    Return a JSON object with the response
+# methods covered: method -> True if in the private api
+METHODS = dict([(method, False) for method in (
+                    "GetCurrencies", "GetTradePairs", "GetMarkets",
+                    "GetMarket", "GetMarketHistory", "GetMarketOrders")] +
+               [(method, True) for method in (
+                    "GetBalance", "GetDepositAddress", "GetOpenOrders",
+                    "GetTradeHistory", "GetTransactions", "SubmitTrade",
+                    "CancelTrade", "SubmitTip")])
+
+# environment variables of the API key and secret
+ENV_KEY = "CRYPTOPIA_API_KEY"
+ENV_SECRET = "CRYPTOPIA_API_SECRET"
+
+BASE_URL = "https://www.cryptopia.co.nz/api/"
+# number of keep-alive connections kept in the pool
+POOL_SIZE = 10
+# seconds to wait for the exchange (connect, read)
+TIMEOUT = (5, 30)
+# retries on a connection reset and base delay (seconds) of the backoff
+RETRIES = 3
+BACKOFF = 0.5
+# new attempts of a call refused for too many calls
+RATE_RETRIES = 4
+# shared limiter of the calls (public and private buckets)
+LIMITER = ratelimit.Limiter()
+
+# client used by query, created at the first call
+CLIENT = None
+# threads running the calls of aquery, created at the first call
+EXECUTOR = None
+
+class Transport(object):
+    """Connection-pooled HTTP transport for the api calls. 
+    A transport returns the JSON response of the exchange. Any object with
+    the same get/post methods and a base_url attribute can replace it.
     Arguments:
-        method: method of the public or private api
-        req: list (public) or dictionnary (private) of parameters
-    """    
-    base_url = "https://www.cryptopia.co.nz/api/" 
-    url = base_url + method
-    if not req:
-        req = {}
-    # list of the methods covered 
-    public_set = set(["GetCurrencies", "GetTradePairs", "GetMarkets", 
-                      "GetMarket", "GetMarketHistory", "GetMarketOrders" ])
-    private_set = set(["GetBalance", "GetDepositAddress", "GetOpenOrders", 
-                       "GetTradeHistory", "GetTransactions", "SubmitTrade", 
-                       "CancelTrade", "SubmitTip"])
-    if method in public_set:
-        if req:
-            for param in req:
-                url += '/' + str( param )
-        r = requests.get( url )
-    elif method in private_set:
-        # preparing the headers for authorization to access the private api 
+        base_url: root url of the api (default BASE_URL)
+        pool_size: number of keep-alive connections (default POOL_SIZE)
+        timeout: (connect, read) timeout in seconds (default TIMEOUT)
+        retries: retries on a connection reset (default RETRIES)
+        backoff: base delay of the exponential backoff (default BACKOFF)
+    """
+    def __init__(self, base_url=None, pool_size=None, timeout=None, 
+                 retries=None, backoff=None):
+        import requests
+        self.requests = requests
+        self.base_url = base_url or BASE_URL
+        self.timeout = timeout or TIMEOUT
+        self.retries = RETRIES if retries is None else retries
+        self.backoff = BACKOFF if backoff is None else backoff
+        pool_size = pool_size or POOL_SIZE
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, 
+                                                pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url):
+        """GET call, return the JSON response"""
+        return self._send(self.session.get, url)
+
+    def post(self, url, data, headers):
+        """POST call, return the JSON response"""
+        # the nonce is part of the headers: a POST replayed after a reset 
+        # that reached the exchange is refused instead of being executed
+        # twice
+        return self._send(self.session.post, url, 
+                          data=data, headers=headers)
+
+    def close(self):
+        """Close the connections of the pool"""
+        self.session.close()
+
+    def _send(self, call, url, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                r = call(url, timeout=self.timeout, **kwargs)
+                if r.status_code in (429, 503):
+                    raise RateLimitError(url + " : " + str(r.status_code))
+                return r.json()
+            except self.requests.exceptions.ConnectionError:
+                if attempt >= self.retries:
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+class Client(object):
+    """Client of the public and private api. The credentials are read at the
+    first private call: given (key, secret), environment (ENV_KEY and
+    ENV_SECRET) or xml config file. The secret is decoded once, the quoted
+    url of each private method is computed once.
+    Arguments:
+        key, secret: API key and secret (base64), None to read them later
+        config_path: path of the config file (default config.xml next to
+                     api.py)
+        transport: transport of the calls (default a pooled Transport,
+                   created at the first call)
+        limiter: limiter of the calls (default LIMITER)
+    """
+    def __init__(self, key=None, secret=None, config_path=None,
+                 transport=None, limiter=None):
+        self.key = None
+        self.hmac_key = None
+        self.config_path = config_path
+        self.transport = transport
+        self.limiter = limiter or LIMITER
+        self.signed_urls = {}
+        if key is not None:
+            self.set_credentials(key, secret)
+
+    def set_credentials(self, key, secret):
+        """Set the API key and secret (instead of the config file)
+        Arguments:
+            key: API key
+            secret: API secret (base64)
+        """
+        import base64
+        self.hmac_key = base64.b64decode(secret)
+        self.key = key
+
+    def load_config(self, file_path=None):
+        """Get the API key and secret from the xml config file
+        Arguments:
+            file_path: path of the config file (default config_path, or
+                       config.xml next to api.py)
+        """
+        import xml.etree.ElementTree as etree
+        file_path = file_path or self.config_path
+        if file_path is None:
+            api_file_path = os.path.realpath(__file__)
+            api_folder_path = os.path.dirname(api_file_path)
+            file_path = os.path.join(api_folder_path,"config.xml")
+        tree = etree.parse(file_path)
+        root = tree.getroot()
+        self.set_credentials(root.findall("API_KEY")[0].text,
+                             root.findall("API_SECRET")[0].text)
+
+    def load_credentials(self):
+        """Get the API key and secret from the environment, or else from the
+        config file"""
+        key = os.environ.get(ENV_KEY)
+        secret = os.environ.get(ENV_SECRET)
+        if key and secret:
+            self.set_credentials(key, secret)
+        else:
+            self.load_config()
+
+    def has_credentials(self):
+        """Tell if the API key and secret are known. They are read (see
+        load_credentials) if they are not loaded yet"""
+        if self.key is None:
+            try:
+                self.load_credentials()
+            except (OSError, SyntaxError, IndexError, TypeError, 
+                    ValueError):
+                return False
+        return bool(self.key) and bool(self.hmac_key)
+
+    def get_transport(self):
+        """Return the transport of the calls, create it if needed"""
+        if self.transport is None:
+            self.transport = Transport()
+        return self.transport
+
+    def set_transport(self, transport=None):
+        """Replace the transport of the calls, None restores the default
+        pooled transport at the next call
+        Arguments:
+            transport: object with the get/post methods and base_url
+                       attribute
+        """
+        if self.transport is not None and self.transport is not transport:
+            if hasattr(self.transport, "close"):
+                self.transport.close()
+        self.transport = transport
+        self.signed_urls = {}
+
+    def query(self, method, req=None):
+        """Call a method of the api with the parameters specified.
+        Return a JSON object with the response, None if the method is not
+        covered (see METHODS)
+        Arguments:
+            method: method of the public or private api
+            req: list (public) or dictionnary (private) of parameters
+        """
+        private = METHODS.get(method)
+        if private is None:
+            return None
+        start = time.perf_counter()
+        response = None
+        try:
+            with logger.Span("api." + method):
+                response = self.call(method, req, private)
+            return response
+        finally:
+            metrics.API_LATENCY.observe(time.perf_counter() - start, method)
+            if not response or not response.get("Success"):
+                metrics.API_ERRORS.inc(method)
+
+    def call(self, method, req, private):
+        """Call a method of the api, wait for the rate limiter and send the
+        call again if it is refused for too many calls (see query)
+        Arguments:
+            method: method of the public or private api
+            req: list (public) or dictionnary (private) of parameters
+            private: True if the method is in the private api
+        """
+        limiter = self.limiter
+        attempt = 0
+        while True:
+            limiter.acquire(method, private)
+            try:
+                response = self.send(method, req, private)
+            except RateLimitError:
+                if attempt >= RATE_RETRIES:
+                    limiter.refused(private)
+                    raise
+                response = None
+            if response is not None and not ratelimit.is_refused(response):
+                limiter.accepted(private)
+                return response
+            limiter.refused(private)
+            if attempt >= RATE_RETRIES:
+                return response
+            attempt += 1
+
+    def send(self, method, req, private):
+        """Send a single call to the api through the transport.
+        Return a JSON object with the response
+        Arguments:
+            method: method of the public or private api
+            req: list (public) or dictionnary (private) of parameters
+            private: True if the method is in the private api
+        """
+        transport = self.get_transport()
+        url = transport.base_url + method
+        if not req:
+            req = {}
+        if not private:
+            if req:
+                for param in req:
+                    url += '/' + str( param )
+            return transport.get( url )
+        post_data = json.dumps( req )
+        # call the api
+        headers = { 'Authorization': self.sign(url, post_data),
+                   'Content-Type':'application/json; charset=utf-8' }
+        return transport.post( url, post_data, headers )
+
+    def sign(self, url, post_data):
+        """Return the authorization header of a call of the private api
+        Arguments:
+            url: url of the method
+            post_data: JSON parameters of the call
+        """
+        import hmac
+        import base64
+        if self.key is None:
+            self.load_credentials()
+        signed_url = self.signed_urls.get(url)
+        if signed_url is None:
+            import urllib.parse
+            signed_url = urllib.parse.quote_plus( url ).lower()
+            self.signed_urls[url] = signed_url
         nonce = str(int(time.time()))+str((randint(100, 999)))
-        post_data = json.dumps( req );
-        m = hashlib.md5()
-        m.update(post_data.encode("UTF-8"))
         requestContentBase64String = base64.b64encode(
-                m.digest()).decode("UTF-8")
-        signature = API_KEY + "POST" 
-        signature += urllib.parse.quote_plus( url ).lower() + nonce 
+                hashlib.md5(post_data.encode("UTF-8")).digest()
+                ).decode("UTF-8")
+        signature = self.key + "POST" + signed_url + nonce
         signature += requestContentBase64String
         hmacsignature = base64.b64encode(
-                hmac.new(base64.b64decode( API_SECRET ), 
-                        signature.encode("UTF-8"), 
-                        hashlib.sha256).digest()).decode("UTF-8")
-        header_value = "amx " + API_KEY + ":" + hmacsignature 
-        header_value += ":" + nonce
-        # call the api 
-        headers = { 'Authorization': header_value, 
-                   'Content-Type':'application/json; charset=utf-8' }
-        r = requests.post( url, data = post_data, headers = headers)
-    else:
-        return None
-    response = r.json()
-    return response
+                hmac.new(self.hmac_key, signature.encode("UTF-8"),
+                         hashlib.sha256).digest()).decode("UTF-8")
+        return "amx " + self.key + ":" + hmacsignature + ":" + nonce
+
+def get_client():
+    """Return the client used by query, create it if needed"""
+    global CLIENT
+    if CLIENT is None:
+        CLIENT = Client()
+    return CLIENT
+
+def set_client(client=None):
+    """Replace the client used by query (ie: in a worker process). None
+    creates a new default client at the next call
+    Arguments:
+        client: Client object
+    """
+    global CLIENT
+    CLIENT = client
+
+def load_config(file_path=None):
+    """Get the API key and secret of the client from the xml config file
+    Arguments:
+        file_path: path of the config file (default config.xml next to api.py)
+    """
+    get_client().load_config(file_path)
+
+def set_credentials(key, secret):
+    """Set the API key and secret of the client (instead of the config file)
+    Arguments:
+        key: API key
+        secret: API secret (base64)
+    """
+    get_client().set_credentials(key, secret)
+
+def get_transport():
+    """Return the transport used by query, create it if needed"""
+    return get_client().get_transport()
+
+def set_transport(transport=None):
+    """Replace the transport used by query (ie: a stub for the tests). 
+    None restores the default pooled transport at the next call.
+    Arguments:
+        transport: object with the get/post methods and base_url attribute
+    """
+    get_client().set_transport(transport)
+
+def query( method, req = None ):
+    """Call a method of the api with the parameters specified (see
+    Client.query). Return a JSON object with the response
+    Arguments:
+        method: method of the public or private api
+        req: list (public) or dictionnary (private) of parameters
+    """    
+    return (CLIENT or get_client()).query(method, req)
+
+async def aquery( method, req = None ):
+    """Coroutine version of query. The call is run in a thread of the 
+    executor, the event loop stays free for the other calls meanwhile.
+    Arguments:
+        method: method of the public or private api
+        req: list (public) or dictionnary (private) of parameters
+    """
+    import asyncio
+    import concurrent.futures
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+                max_workers=POOL_SIZE, thread_name_prefix="aquery")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, query, method, req)
 
 # #################################################################79##########
 # local unit tests
 
 if __name__ == "__main__":
     
-    if  API_KEY == "":
-        print("API_KEY is missing in config")
-    if  API_SECRET == "":
-        print("API_SECRET is missing in config")
+    client = get_client()
+    if  not client.has_credentials():
+        print("API_KEY or API_SECRET is missing in config")
 
     print (query("GetMarket", ["XMR_BTC"]))
     print (query("GetBalance", {"Currency":"BTC"}))
     print (query("Unknown"))
 
-# #######################################################79####################
\ No newline at end of file
+# #######################################################79####################
@@ -0,0 +1,325 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Backtest (Cryptopia)
+
+This module replays the strategy of the pipeline (Execute_Entry and
+Execute_Action) over price bars, to choose the target, stoploss, countdown
+and PHI of the orders. Each combination of the parameters is a lane of NumPy
+arrays: all the combinations of a grid go through the bars together, one
+pass per bar, so thousands of combinations cost about the same as one.
+A bar is a tick of the pipeline, for each lane:
+- entry : the coins are bought at the ask price (filled at once, as on the
+  exchange), unless the amount is under the minimum trade (PHI),
+- action init : the target and stoploss prices are set, the sell order at
+  the target rests in the order book,
+- active : the sell order is filled when the high of a bar reaches the
+  target; a close at or under the stoploss starts the countdown, the coins
+  are sold at the bid price when it reaches zero; a close over the stoploss
+  stops it,
+- a new order is created GAP bars after the end of the previous one.
+The bars (time, open, high, low, close) are kept as .npy files, read with
+memory mapping, built from GetMarketHistory trades or from price series.
+The sweeps run on a pool of processes, one task per pair and chunk of the
+grid.
+
+Usage :
+
+    python backtest.py bars/XMR_BTC.npy ... [--targets 0.05 0.1]
+                       [--stoplosses 0.0618 0.1] [--countdowns 3 7]
+                       [--phis 1.38] [--processes 4] [--top 10]
+
+Methods :
+
+    Run_Backtest : Replay the strategy for a grid of parameters
+        parameters :
+            bars (req) : array of bars (time, open, high, low, close)
+            grid (req) : dictionnary of parameter arrays (see Grid)
+
+    Run_Sweep : Run the backtest of several pairs on a pool of processes
+        parameters :
+            file_paths (req) : .npy files of the bars, one per pair
+            grid (req) : dictionnary of parameter arrays (see Grid)
+            processes (opt) : number of processes - default : PROCESSES
+
+    Grid : All the combinations of lists of parameters
+
+    Save_Bars / Load_Bars : Write / read (memory mapped) bars
+
+    Bars_From_History : Bars of the trades of GetMarketHistory
+
+    Bars_From_Prices : Bars of a price series (simulator.load_series)
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import sys
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+import operation
+import simulator
+
+# columns of the bars
+TIME, OPEN, HIGH, LOW, CLOSE = range(5)
+# stages of the lanes
+ENTRY, ACTION_INIT, ACTIVE, IDLE, DISABLED = range(5)
+# bars between the end of an order and the next one
+GAP = 1
+# amount (base currency) of each order and minimum trade of the exchange
+AMOUNT = 0.001
+MINIMUM = simulator.MINIMUM_BASE_TRADE
+# number of processes and combinations per task of the sweeps
+PROCESSES = 4
+CHUNK = 4096
+# result columns of the lanes
+RESULTS = ("equity", "trades", "wins", "targets", "stoplosses",
+           "drawdown")
+
+def Save_Bars(file_path, bars):
+    """
+    Method to write bars in a .npy file. Parameters :
+    file_path (req) - Path of the file
+    bars      (req) - Array (n, 5): time, open, high, low, close
+    """
+    np.save(file_path, np.ascontiguousarray(bars, dtype=np.float64))
+
+def Load_Bars(file_path, mmap=True):
+    """
+    Method to read the bars of a .npy file, memory mapped (the pages are read
+    when used, large histories are not loaded at once). Parameters :
+    file_path (req) - Path of the file
+    mmap      (opt) - Memory mapping (default=True)
+    """
+    return np.load(file_path, mmap_mode="r" if mmap else None)
+
+def Bars_From_History(data, seconds=60):
+    """
+    Method to build the bars of the trades of a market. Parameters :
+    data     (req) - "Data" of GetMarketHistory (Timestamp, Price...)
+    seconds  (opt) - Duration of a bar, ie: period of the pipeline
+    """
+    if not data:
+        return np.empty((0, 5))
+    stamps = np.array([item["Timestamp"] for item in data], dtype=float)
+    prices = np.array([item["Price"] for item in data], dtype=float)
+    order = np.argsort(stamps, kind="stable")
+    stamps = stamps[order]
+    prices = prices[order]
+    buckets = np.floor(stamps/seconds)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(prices)] - 1
+    bars = np.empty((len(starts), 5))
+    bars[:, TIME] = buckets[starts]*seconds
+    bars[:, OPEN] = prices[starts]
+    bars[:, HIGH] = np.maximum.reduceat(prices, starts)
+    bars[:, LOW] = np.minimum.reduceat(prices, starts)
+    bars[:, CLOSE] = prices[ends]
+    return bars
+
+def Bars_From_Prices(prices, seconds=60):
+    """
+    Method to build the bars of a price series (one price per tick, ie: from
+    simulator.load_series). Parameters :
+    prices   (req) - List of prices
+    seconds  (opt) - Duration of a tick
+    """
+    prices = np.asarray(prices, dtype=float)
+    bars = np.empty((len(prices), 5))
+    bars[:, TIME] = np.arange(len(prices))*seconds
+    for column in (OPEN, HIGH, LOW, CLOSE):
+        bars[:, column] = prices
+    return bars
+
+def Grid(targets, stoplosses, countdowns=None, phis=None):
+    """
+    Method to build all the combinations of lists of parameters, as a
+    dictionnary of arrays (one item per combination). Parameters :
+    targets    (req) - Ratios of the targets (ie: [0.05, 0.1])
+    stoplosses (req) - Ratios of the stoplosses
+    countdowns (opt) - Countdowns (default=[DEFAULT_COUNTDOWN])
+    phis       (opt) - Security coeffs of the minimum (default=[PHI])
+    """
+    countdowns = countdowns or [operation.DEFAULT_COUNTDOWN]
+    phis = phis or [operation.PHI]
+    mesh = np.meshgrid(np.asarray(targets, dtype=float),
+                       np.asarray(stoplosses, dtype=float),
+                       np.asarray(countdowns, dtype=np.int64),
+                       np.asarray(phis, dtype=float), indexing="ij")
+    return dict((name, values.ravel()) for name, values
+                in zip(("target", "stoploss", "countdown", "phi"), mesh))
+
+def Run_Backtest(bars, grid, amount=AMOUNT, minimum=MINIMUM, fee=None,
+                 spread=None, gap=GAP):
+    """
+    Method to replay the strategy over bars for all the combinations of a
+    grid. It returns a dictionnary of arrays (one item per combination):
+    equity (final value of 1 invested, the last order valued at the bid),
+    trades, wins, targets, stoplosses (exits) and drawdown (maximum, of the
+    equity after each trade). Parameters :
+    bars     (req) - Array (n, 5): time, open, high, low, close
+    grid     (req) - Dictionnary of parameter arrays (see Grid)
+    amount   (opt) - Amount of each order (base currency)
+    minimum  (opt) - Minimum trade of the exchange (base currency)
+    fee      (opt) - Fee ratio of the trades (default=simulator.FEE)
+    spread   (opt) - Spread ratio between bid and ask (simulator.SPREAD)
+    gap      (opt) - Bars between the end of an order and the next one
+    """
+    fee = simulator.FEE if fee is None else fee
+    spread = simulator.SPREAD if spread is None else spread
+    target = grid["target"]
+    stoploss = grid["stoploss"]
+    countdown = grid["countdown"].astype(np.int64)
+    phi = grid["phi"]
+    lanes = len(target)
+    # amount too small (see Execute_Entry): the lane never trades
+    tradable = amount >= (minimum*phi+0.00000001)*(1-stoploss)
+    stage = np.where(tradable, ENTRY, DISABLED)
+    wait = np.zeros(lanes, np.int64)
+    buy = np.zeros(lanes)
+    target_price = np.zeros(lanes)
+    stoploss_price = np.zeros(lanes)
+    counter = np.full(lanes, -1, np.int64)
+    equity = np.ones(lanes)
+    peak = np.ones(lanes)
+    drawdown = np.zeros(lanes)
+    trades = np.zeros(lanes, np.int64)
+    wins = np.zeros(lanes, np.int64)
+    targets = np.zeros(lanes, np.int64)
+    stoplosses = np.zeros(lanes, np.int64)
+    bid = 0.0
+    for high, close in np.asarray(bars[:, [HIGH, CLOSE]]).tolist():
+        bid = close*(1-spread/2)
+        ask = close*(1+spread/2)
+        idle = stage == IDLE
+        entry = stage == ENTRY
+        init = stage == ACTION_INIT
+        active = stage == ACTIVE
+        # idle: next order created after the gap
+        wait[idle] -= 1
+        stage[idle & (wait <= 0)] = ENTRY
+        # entry: buy at the ask price
+        buy[entry] = ask
+        stage[entry] = ACTION_INIT
+        # action init: target and stoploss prices, the target sell is sent
+        target_price[init] = buy[init]*(1+target[init])+0.00000001
+        stoploss_price[init] = buy[init]*(1-stoploss[init])+0.00000001
+        stage[init] = ACTIVE
+        # active (and init, same call): target filled during the bar
+        sold = active & (high >= target_price)
+        watched = (active | init) & ~sold
+        below = watched & (close <= stoploss_price)
+        start = below & (counter < 0)
+        counter[start] = countdown[start]
+        stopped = below & (counter <= 0)
+        counter[below & ~stopped] -= 1
+        counter[watched & ~below] = -1
+        done = sold | stopped
+        if done.any():
+            price = np.where(sold, target_price, bid)[done]
+            perf = price*(1-fee)/(buy[done]*(1+fee))
+            equity[done] *= perf
+            trades[done] += 1
+            wins[done] += perf > 1
+            targets[sold] += 1
+            stoplosses[stopped] += 1
+            peak[done] = np.maximum(peak[done], equity[done])
+            drawdown[done] = np.maximum(drawdown[done],
+                                        1-equity[done]/peak[done])
+            counter[done] = -1
+            stage[done] = IDLE
+            wait[done] = gap
+    # the orders still open are valued at the last bid
+    held = (stage == ACTIVE) | (stage == ACTION_INIT)
+    value = equity.copy()
+    value[held] *= bid*(1-fee)/(buy[held]*(1+fee))
+    return {"equity": value, "trades": trades, "wins": wins,
+            "targets": targets, "stoplosses": stoplosses,
+            "drawdown": drawdown}
+
+def Run_Task(file_path, grid, options):
+    """
+    Method run by the processes of the sweeps: backtest of a chunk of the
+    grid over the bars of a file. Parameters :
+    file_path (req) - .npy file of the bars
+    grid      (req) - Dictionnary of parameter arrays
+    options   (req) - Other arguments of Run_Backtest
+    """
+    return Run_Backtest(Load_Bars(file_path), grid, **options)
+
+def Run_Sweep(file_paths, grid, processes=None, **options):
+    """
+    Method to run the backtest of several pairs on a pool of processes. It
+    returns a dictionnary file path -> results (see Run_Backtest), the grid
+    is split in chunks of CHUNK combinations. Parameters :
+    file_paths (req) - .npy files of the bars, one per pair
+    grid       (req) - Dictionnary of parameter arrays (see Grid)
+    processes  (opt) - Number of processes (default=PROCESSES)
+    options    (opt) - Other arguments of Run_Backtest (amount, fee...)
+    """
+    size = len(grid["target"])
+    chunks = [dict((name, values[start:start+CHUNK])
+                   for name, values in grid.items())
+              for start in range(0, size, CHUNK)]
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes or PROCESSES) as pool:
+        futures = dict((pool.submit(Run_Task, file_path, chunk, options),
+                        file_path)
+                       for file_path in file_paths for chunk in chunks)
+        # the chunks of a pair are put back in the order of the grid
+        parts = dict((file_path, []) for file_path in file_paths)
+        for future, file_path in futures.items():
+            parts[file_path].append(future.result())
+    for file_path, items in parts.items():
+        results[file_path] = dict((name, np.concatenate([item[name]
+                                                         for item in items]))
+                                  for name in RESULTS)
+    return results
+
+def Main(argv=None):
+    """
+    Method to run a sweep from the command line (see the module help)
+    """
+    parser = argparse.ArgumentParser(description="Backtest of the strategy")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--targets", type=float, nargs="+",
+                        default=[0.02, 0.05, 0.1, 0.15, 0.2])
+    parser.add_argument("--stoplosses", type=float, nargs="+",
+                        default=[0.02, 0.0382, 0.0618, 0.1, 0.15])
+    parser.add_argument("--countdowns", type=int, nargs="+",
+                        default=[0, 3, 7, 15])
+    parser.add_argument("--phis", type=float, nargs="+",
+                        default=[operation.PHI])
+    parser.add_argument("--processes", type=int, default=PROCESSES)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+    grid = Grid(args.targets, args.stoplosses, args.countdowns, args.phis)
+    results = Run_Sweep(args.files, grid, args.processes)
+    for file_path, result in results.items():
+        print("-- " + os.path.basename(file_path))
+        for index in np.argsort(-result["equity"])[:args.top]:
+            print('target {:.4f} stoploss {:.4f} countdown {:>3d} '
+                  'phi {:.2f} : equity {:.4f} trades {:>5d} win {:.0%} '
+                  'drawdown {:.2%}'.format(
+                          grid["target"][index], grid["stoploss"][index],
+                          grid["countdown"][index], grid["phi"][index],
+                          result["equity"][index], result["trades"][index],
+                          result["wins"][index]/max(1,
+                                                    result["trades"][index]),
+                          result["drawdown"][index]))
+
+if __name__ == "__main__":
+    Main(sys.argv[1:])
+
+# #######################################################79####################
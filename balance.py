@@ -0,0 +1,119 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Balance (Cryptopia)
+
+This module keeps a book of the balances of the account. All the balances
+are loaded with a single GetBalance call (no currency filter), then served
+from the book. A trade resting in the order book only moves funds from
+Available to HeldForTrades, this is done locally. A trade filled (even
+partly) or cancelled changes the totals: the book is loaded again at the
+next read.
+
+Classes:
+
+    BalanceBook : Balances of the account by currency symbol
+        parameters :
+            query (opt) : method calling the api - default : api.query
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import threading
+
+import api
+
+class BalanceBook(object):
+    """Balances of the account by currency symbol.
+    Arguments:
+        query: method calling the api (default api.query)
+    """
+    def __init__(self, query=None):
+        self.query = query or api.query
+        self.balances = {}
+        self.stale = True
+        self.loads = 0
+        self.lock = threading.RLock()
+
+    def invalidate(self):
+        """Load the balances again at the next read"""
+        with self.lock:
+            self.stale = True
+
+    def load(self):
+        """Load all the balances with one GetBalance call. Return False if
+        the api call failed"""
+        Output = self.query("GetBalance", {})
+        if not Output or not Output.get("Success") or Output["Data"] is None:
+            return False
+        balances = {}
+        for data in Output["Data"]:
+            balances[data["Symbol"]] = dict(data)
+        with self.lock:
+            self.balances = balances
+            self.stale = False
+            self.loads += 1
+        return True
+
+    def get(self, currency):
+        """Return the balance of a currency (same fields as the GetBalance
+        "Data" items, zeros if the account never had the currency), None if
+        the balances can't be loaded.
+        Arguments:
+            currency: currency symbol ("XMR")
+        """
+        with self.lock:
+            if self.stale and not self.load():
+                return None
+            data = self.balances.get(currency)
+            if data is None:
+                data = {"Symbol": currency, "Total": 0.0, "Available": 0.0,
+                        "HeldForTrades": 0.0}
+            return dict(data)
+
+    def trade_sent(self, symbol, base_symbol, tradetype, rate, amount,
+                   Output):
+        """Update the book after a SubmitTrade call
+        Arguments:
+            symbol: currency traded ("XMR")
+            base_symbol: currency of the market ("BTC")
+            tradetype: "Buy" or "Sell"
+            rate: price of the trade
+            amount: amount of the trade (in symbol)
+            Output: response of the SubmitTrade call
+        """
+        with self.lock:
+            if (not Output or not Output.get("Success") or self.stale or
+                    (Output.get("Data") or {}).get("FilledOrders")):
+                self.stale = True
+                return
+            if tradetype == "Buy":
+                self._hold(base_symbol, float(rate)*float(amount))
+            else:
+                self._hold(symbol, float(amount))
+
+    def trade_cancelled(self, Output):
+        """Update the book after a CancelTrade call
+        Arguments:
+            Output: response of the CancelTrade call
+        """
+        with self.lock:
+            if not Output or not Output.get("Success") or Output.get("Data"):
+                self.stale = True
+
+    def _hold(self, currency, amount):
+        data = self.balances.get(currency)
+        if data is None:
+            self.stale = True
+            return
+        data["Available"] = float(data["Available"]) - amount
+        data["HeldForTrades"] = float(data.get("HeldForTrades") or 0) + amount
+
+# #######################################################79####################
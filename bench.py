@@ -0,0 +1,364 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Bench (Cryptopia)
+
+This module measures the cost of a tick of the pipeline. Synthetic
+portfolios (10 to 10000 orders by default) spread over the entry, action and
+audit stages are executed by Execute_Pipeline against the simulated exchange
+(simulator.py), without waits nor rate limits. For each tick it reports:
+- the wall time of the tick,
+- the api calls per order, by method,
+- the time spent loading/saving/syncing the orders in the store (xml
+  parse/write, fsync),
+- the peak memory allocated (tracemalloc).
+The results are saved as json, to be compared between versions (--compare).
+
+Usage :
+
+    python bench.py [--sizes 10 100 1000] [--ticks 3] [--store xml|sqlite]
+                    [--output bench_results.json] [--compare old.json]
+
+Methods :
+
+    Run_Bench : Benchmark a portfolio
+        parameters :
+            size (req) : number of orders
+            ticks (opt) : number of ticks - default : TICKS
+            store_type (opt) : "xml" or "sqlite" - default : "xml"
+
+    Compare : Print the ratios between two results files
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+import contextlib
+import xml.etree.ElementTree as etree
+
+import api
+import balance
+import cache
+import market
+import operation
+import ratelimit
+import simulator
+import store
+
+SIZES = [10, 100, 1000, 10000]
+TICKS = 3
+# number of markets of the synthetic portfolios
+PAIRS = 50
+# stages of the synthetic orders, spread evenly
+STATES = ("entry:init", "entry:sent", "action:active", "audit:init")
+# globals of operation replaced during a benchmark (restored after)
+OPERATION_GLOBALS = ("DATA_PATH", "WAIT_FACTOR", "LOGS_ENABLED", "CACHE",
+                     "MARKETS", "BALANCES", "PAIRS", "LEDGER", "JOURNAL",
+                     "STORE", "ACTIVE", "UNRESOLVED")
+
+class TimedStore(store.OrderStore):
+    """Store measuring the time spent to load, save and sync the orders"""
+    def __init__(self, order_store):
+        self.order_store = order_store
+        self.load_time = 0.0
+        self.save_time = 0.0
+        self.sync_time = 0.0
+
+    def create(self, root):
+        return self.order_store.create(root)
+
+    def create_many(self, roots):
+        return self.order_store.create_many(roots)
+
+    def list(self, stage):
+        return self.order_store.list(stage)
+
+    def load(self, order_id):
+        start = time.perf_counter()
+        try:
+            return self.order_store.load(order_id)
+        finally:
+            self.load_time += time.perf_counter() - start
+
+    def save(self, order_id, root, stage=None):
+        start = time.perf_counter()
+        try:
+            return self.order_store.save(order_id, root, stage)
+        finally:
+            self.save_time += time.perf_counter() - start
+
+    def move(self, order_id, stage):
+        return self.order_store.move(order_id, stage)
+
+    def feed(self, order_id):
+        return self.order_store.feed(order_id)
+
+    def feed_batches(self):
+        return self.order_store.feed_batches()
+
+    def get_pair(self, order_id):
+        return self.order_store.get_pair(order_id)
+
+    def find(self, stage=None, status=None, pair=None):
+        return self.order_store.find(stage, status, pair)
+
+    def sync(self):
+        start = time.perf_counter()
+        try:
+            return self.order_store.sync()
+        finally:
+            self.sync_time += time.perf_counter() - start
+
+    def close(self):
+        return self.order_store.close()
+
+def Synthetic_Order(pair, price, state, rand):
+    """
+    Method to build the xml root of an order in a given state. Parameters :
+    pair     (req) - Market pair ("C000_BTC")
+    price    (req) - Current price of the market
+    state    (req) - One of STATES
+    rand     (req) - random.Random object
+    """
+    now = datetime.datetime.now()
+    root = etree.Element("order")
+    etree.SubElement(root, "header", date=str(now - datetime.timedelta(
+                     hours=3)), pair=pair, amount='{:.8f}'.format(0.001),
+                     target='{:.8f}'.format(0.1),
+                     stoploss='{:.8f}'.format(0.0618), status="ready")
+    entry = etree.SubElement(root, "entry")
+    action = etree.SubElement(root, "action",
+                              countdown=str(operation.DEFAULT_COUNTDOWN))
+    audit = etree.SubElement(root, "audit")
+    buy = price*rand.uniform(0.95, 1.05)
+    if state == "entry:sent":
+        entry.attrib.update(status="sent", price='{:.8f}'.format(buy),
+                            countdown=str(operation.DEFAULT_COUNTDOWN))
+    elif state in ("action:active", "audit:init"):
+        entry.attrib.update(status="ready", price='{:.8f}'.format(buy))
+        action.attrib.update(status="active",
+                             target='{:.8f}'.format(buy*1.1),
+                             stoploss='{:.8f}'.format(buy*(1-0.0618)))
+        del action.attrib["countdown"]
+        if state == "audit:init":
+            action.set("status", "ready")
+            action.set("date", str(now - datetime.timedelta(hours=2)))
+    return root
+
+def Reset_Operation(data_path, order_store):
+    """
+    Method to give operation a fresh state for a benchmark. Parameters :
+    data_path   (req) - Folder of the data of the benchmark
+    order_store (req) - Store of the orders
+    """
+    operation.DATA_PATH = data_path
+    operation.WAIT_FACTOR = 0
+    operation.LOGS_ENABLED = False
+    operation.CACHE = cache.Cache()
+    operation.MARKETS = market.MarketSnapshot()
+    operation.BALANCES = balance.BalanceBook()
+    operation.PAIRS = None
+    operation.LEDGER = None
+    operation.JOURNAL = None
+    operation.UNRESOLVED = set()
+    operation.Set_Store(order_store)
+    if operation.ACTIVE is not None:
+        operation.ACTIVE = operation.evaluator.ActiveOrders()
+    api.get_client().limiter = ratelimit.Limiter(1e9, 1e9)
+
+def Save_Operation():
+    """
+    Method to save the globals of operation and the state of the api client
+    replaced by a benchmark (see Reset_Operation). It returns a dictionnary
+    for Restore_Operation. No parameters.
+    """
+    client = api.get_client()
+    state = dict((name, getattr(operation, name))
+                 for name in OPERATION_GLOBALS)
+    state["client"] = (client.limiter, client.transport, client.key,
+                       client.hmac_key)
+    return state
+
+def Restore_Operation(state):
+    """
+    Method to restore the globals of operation and the state of the api 
+    client saved before a benchmark. Parameters :
+    state    (req) - Dictionnary returned by Save_Operation
+    """
+    state = dict(state)
+    client = api.get_client()
+    client.limiter, transport, client.key, client.hmac_key = \
+            state.pop("client")
+    client.set_transport(transport)
+    for name, value in state.items():
+        setattr(operation, name, value)
+
+def Run_Bench(size, ticks=TICKS, store_type="xml", seed=1):
+    """
+    Method to benchmark a portfolio. It returns a dictionnary with the
+    measures of each tick. The globals of operation and the api client are
+    restored after the benchmark. Parameters :
+    size       (req) - Number of orders
+    ticks      (opt) - Number of ticks (default=TICKS)
+    store_type (opt) - "xml" or "sqlite" (default="xml")
+    seed       (opt) - Seed of the random generators
+    """
+    rand = random.Random(seed)
+    prices = {}
+    for index in range(PAIRS):
+        price = rand.uniform(0.0001, 0.01)
+        prices["C" + '{:03d}'.format(index) + "_BTC"] = [
+                price*(1+rand.uniform(-0.1, 0.1)) for i in range(ticks+1)]
+    balances = {"BTC": size}
+    with tempfile.TemporaryDirectory() as data_path:
+        for folder in ("in", "work", "bak", "logs"):
+            os.mkdir(os.path.join(data_path, folder))
+        if store_type == "sqlite":
+            base_store = store.SqliteOrderStore(
+                    os.path.join(data_path, "orders.db"))
+        else:
+            base_store = store.XmlOrderStore(data_path)
+        order_store = TimedStore(base_store)
+        pairs = sorted(prices)
+        for index in range(size):
+            pair = pairs[index % PAIRS]
+            state = STATES[index % len(STATES)]
+            root = Synthetic_Order(pair, prices[pair][0], state, rand)
+            symbol = pair.split("_")[0]
+            balances[symbol] = balances.get(symbol, 0.0) + 0.001/prices[
+                    pair][0]
+            base_store.feed(base_store.create(root))
+        sim = simulator.SimulatedExchange(prices, balances, seed=seed)
+        saved = Save_Operation()
+        try:
+            sim.install()
+            Reset_Operation(data_path, order_store)
+            result = Run_Ticks(sim, order_store, size, store_type, ticks)
+        finally:
+            base_store.close()
+            Restore_Operation(saved)
+    return result
+
+def Run_Ticks(sim, order_store, size, store_type, ticks):
+    """
+    Method to run and measure the ticks of a benchmark (see Run_Bench). It
+    returns the dictionnary of the measures. Parameters :
+    sim         (req) - Simulated exchange installed
+    order_store (req) - Timed store of the orders
+    size        (req) - Number of orders
+    store_type  (req) - "xml" or "sqlite"
+    ticks       (req) - Number of ticks
+    """
+    result = {"orders": size, "store": store_type, "ticks": []}
+    for tick in range(ticks):
+        sim.calls.clear()
+        order_store.load_time = 0.0
+        order_store.save_time = 0.0
+        order_store.sync_time = 0.0
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            operation.Execute_Pipeline()
+        wall = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        calls = dict(sim.calls)
+        result["ticks"].append({
+                "wall": wall,
+                "wall_per_order": wall/size,
+                "calls": calls,
+                "calls_per_order": dict((method, float(count)/size)
+                                        for method, count
+                                        in calls.items()),
+                "total_calls_per_order": float(sum(calls.values()))/size,
+                "store_load": order_store.load_time,
+                "store_save": order_store.save_time,
+                "store_sync": order_store.sync_time,
+                "peak_memory": peak})
+        sim.tick()
+    return result
+
+def Compare(old_path, new_path):
+    """
+    Method to print the ratios new/old of the measures of two results files.
+    Parameters :
+    old_path (req) - Results of the reference version
+    new_path (req) - Results of the version to check
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_results = dict(((item["orders"], item["store"]), item)
+                       for item in old["results"])
+    for item in new["results"]:
+        reference = old_results.get((item["orders"], item["store"]))
+        if reference is None:
+            continue
+        line = '{:>6d} {:<6s}'.format(item["orders"], item["store"])
+        for measure in ("wall", "total_calls_per_order", "store_load",
+                        "store_save", "store_sync", "peak_memory"):
+            before = Average(reference, measure)
+            after = Average(item, measure)
+            ratio = after/before if before else 0.0
+            line += " " + measure + ":" + '{:.2f}'.format(ratio)
+        print(line)
+
+def Average(result, measure):
+    """
+    Method to get the average of a measure over the ticks of a result.
+    """
+    # 0 for a measure missing in the results of an older version
+    values = [tick.get(measure, 0.0) for tick in result["ticks"]]
+    return sum(values)/len(values) if values else 0.0
+
+def Main(argv=None):
+    """
+    Method to run the benchmark from the command line (see the module help)
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of the pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    parser.add_argument("--store", choices=("xml", "sqlite"), default="xml")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None)
+    args = parser.parse_args(argv)
+    results = {"version": operation.__version__,
+               "date": str(datetime.datetime.now()),
+               "results": []}
+    for size in args.sizes:
+        result = Run_Bench(size, args.ticks, args.store)
+        results["results"].append(result)
+        print('{:>6d} orders : '.format(size) +
+              '{:.3f}s/tick '.format(Average(result, "wall")) +
+              '{:.2f} calls/order '.format(
+                      Average(result, "total_calls_per_order")) +
+              'store {:.3f}s/'.format(Average(result, "store_load")) +
+              '{:.3f}s/'.format(Average(result, "store_save")) +
+              '{:.3f}s '.format(Average(result, "store_sync")) +
+              'peak {:.1f}MB'.format(Average(result, "peak_memory")/1e6))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.compare:
+        Compare(args.compare, args.output)
+
+if __name__ == "__main__":
+    Main(sys.argv[1:])
+
+# #######################################################79####################
@@ -0,0 +1,152 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Cache (Cryptopia)
+
+This module keeps the responses of the api for a time depending on the
+method called: hours for the reference data (GetCurrencies, GetTradePairs),
+seconds for the prices (GetMarket...), never for the private api. The cache
+is bounded, the least recently used entries are evicted first. It can be
+saved on disk so that a cold start doesn't call the heavy reference methods
+again.
+
+Classes:
+
+    Cache : TTL cache with LRU eviction
+        parameters :
+            ttl (opt) : dictionnary method -> time to live (seconds)
+                        default : TTL
+            size (opt) : maximum number of entries - default : SIZE
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import time
+import json
+import threading
+import collections
+
+# time to live (seconds) of the responses by method, 0 = never cached
+TTL = {"GetCurrencies": 6*3600,
+       "GetTradePairs": 3600,
+       "GetMarkets": 10,
+       "GetMarket": 10,
+       "GetMarketHistory": 60,
+       "GetMarketOrders": 5}
+# maximum number of entries in the cache
+SIZE = 1024
+
+class Cache(object):
+    """TTL cache with LRU eviction and hit/miss counters.
+    Arguments:
+        ttl: dictionnary method -> time to live in seconds (default TTL)
+        size: maximum number of entries (default SIZE)
+    """
+    def __init__(self, ttl=None, size=None):
+        self.ttl = dict(TTL if ttl is None else ttl)
+        self.size = size or SIZE
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, method, req=None):
+        """Return the key of a call in the cache"""
+        data = method
+        if req:
+            for param in req:
+                data += '|' + str(param)
+        return data
+
+    def get(self, method, req=None):
+        """Return the response in cache for a call, None if missing/expired
+        Arguments:
+            method: api method called
+            req: List or dictionnary of parameters passed to the api
+        """
+        key = self.key(method, req)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, method, req, response):
+        """Store the response of a call (if the method can be cached)
+        Arguments:
+            method: api method called
+            req: List or dictionnary of parameters passed to the api
+            response: JSON response of the api
+        """
+        ttl = self.ttl.get(method, 0)
+        if ttl <= 0 or not response or not response.get("Success", True):
+            return
+        key = self.key(method, req)
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all the entries"""
+        with self.lock:
+            self.entries.clear()
+
+    def ratio(self):
+        """Return the ratio of calls served from the cache"""
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def save(self, file_path, min_ttl=60):
+        """Save on disk the entries living longer than min_ttl seconds
+        Arguments:
+            file_path: path of the json snapshot
+            min_ttl: only the methods with a longer ttl are saved
+        """
+        now = time.time()
+        with self.lock:
+            data = [[key, expiry, response]
+                    for key, (expiry, response) in self.entries.items()
+                    if expiry > now and
+                    self.ttl.get(key.split('|')[0], 0) >= min_ttl]
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, file_path)
+
+    def load(self, file_path):
+        """Load the entries of a snapshot saved on disk (if any)
+        Arguments:
+            file_path: path of the json snapshot
+        """
+        if not os.path.exists(file_path):
+            return 0
+        try:
+            with open(file_path) as f:
+                data = json.load(f)
+        except ValueError:
+            return 0
+        now = time.time()
+        count = 0
+        with self.lock:
+            for key, expiry, response in data:
+                if expiry > now and key not in self.entries:
+                    self.entries[key] = (expiry, response)
+                    count += 1
+        return count
+
+# #######################################################79####################
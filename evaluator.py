@@ -0,0 +1,260 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Evaluator (Cryptopia)
+
+This module checks all the active orders (action "active") at once. The buy
+price, target, stoploss and countdown of the orders are kept in NumPy
+arrays, compared with the prices of a market snapshot in a single pass.
+Only the orders with something to do are returned:
+- the price is at or under the stoploss (countdown, stoploss process),
+- a countdown is running (the price may be back over the stoploss),
+- the currency of the order is sold (total balance at zero),
+- the price or the balance is unknown.
+The other orders are quiet: nothing to load, to save nor to call for them.
+The orders of a pair can also be checked against each new price of a price
+feed (see feed.py): only the stoploss or the target crossed since the last
+price wake them up (a running countdown is paced by the scheduler).
+
+Classes:
+
+    ActiveOrders : Active orders as arrays
+        parameters : none
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import threading
+
+import numpy as np
+
+# rows allocated at once when the arrays are full
+CHUNK = 256
+# float columns of the orders, countdown is -1 when not running
+COLUMNS = ("buy", "target", "stoploss")
+
+def _currency(pair):
+    return pair[:pair.index("_")] if "_" in pair else pair
+
+class ActiveOrders(object):
+    """Active orders of the pipeline as arrays, indexed by order id. The
+    pairs and currencies are coded as integers, so the prices and balances
+    are read once per pair and currency. The orders can be updated from
+    several threads.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        self.index = {}
+        self.ids = []
+        self.pairs = []
+        self.pair_codes = {}
+        self.currencies = []
+        self.currency_codes = {}
+        self.size = 0
+        self.pair = np.empty(0, np.int32)
+        self.currency = np.empty(0, np.int32)
+        self.countdown = np.empty(0, np.int32)
+        self.values = dict((name, np.empty(0)) for name in COLUMNS)
+        # pair code -> last price checked by crossed
+        self.last = {}
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, order_id):
+        return order_id in self.index
+
+    def code(self, codes, names, name):
+        """Return the integer code of a pair or a currency"""
+        value = codes.get(name)
+        if value is None:
+            value = codes[name] = len(names)
+            names.append(name)
+        return value
+
+    def grow(self):
+        """Allocate CHUNK more rows"""
+        self.pair = np.concatenate([self.pair, np.zeros(CHUNK, np.int32)])
+        self.currency = np.concatenate([self.currency,
+                                        np.zeros(CHUNK, np.int32)])
+        self.countdown = np.concatenate([self.countdown,
+                                         np.zeros(CHUNK, np.int32)])
+        for name in COLUMNS:
+            self.values[name] = np.concatenate([self.values[name],
+                                                np.zeros(CHUNK)])
+
+    def set(self, order_id, pair, buy, target, stoploss, countdown=None,
+            currency=None):
+        """Add or update an active order
+        Arguments:
+            order_id: id of the order
+            pair: market pair ("XMR_BTC")
+            buy, target, stoploss: prices of the order
+            countdown: stoploss countdown (None if not running)
+            currency: currency traded (default: first symbol of the pair)
+        """
+        with self.lock:
+            row = self.index.get(order_id)
+            if row is None:
+                if self.size == len(self.pair):
+                    self.grow()
+                row = self.index[order_id] = self.size
+                self.ids.append(order_id)
+                self.size += 1
+            self.pair[row] = self.code(self.pair_codes, self.pairs, pair)
+            self.currency[row] = self.code(self.currency_codes,
+                                           self.currencies,
+                                           currency or _currency(pair))
+            self.countdown[row] = -1 if countdown is None else int(countdown)
+            self.values["buy"][row] = buy
+            self.values["target"][row] = target
+            self.values["stoploss"][row] = stoploss
+
+    def update(self, order_id, root, currency=None):
+        """Add, update or remove an order from its xml root: kept only if its
+        action is "active"
+        Arguments:
+            order_id: id of the order
+            root: xml root element of the order
+            currency: currency traded (default: first symbol of the pair)
+        """
+        entry = root.find("entry")
+        action = root.find("action")
+        if (entry is None or action is None or
+                entry.get("status") != "ready" or
+                action.get("status") != "active"):
+            self.remove(order_id)
+            return
+        try:
+            self.set(order_id, root.find("header").get("pair"),
+                     float(entry.get("price")), float(action.get("target")),
+                     float(action.get("stoploss")), action.get("countdown"),
+                     currency)
+        except (TypeError, ValueError):
+            self.remove(order_id)
+
+    def remove(self, order_id):
+        """Remove an order (the last row takes its place)"""
+        with self.lock:
+            row = self.index.pop(order_id, None)
+            if row is None:
+                return
+            last = self.size - 1
+            if row != last:
+                moved = self.ids[last]
+                self.ids[row] = moved
+                self.index[moved] = row
+                for array in (self.pair, self.currency, self.countdown):
+                    array[row] = array[last]
+                for array in self.values.values():
+                    array[row] = array[last]
+            self.ids.pop()
+            self.size = last
+
+    def keep(self, order_ids):
+        """Remove the orders not in the given ids (ie: out of the pipeline)"""
+        with self.lock:
+            kept = set(order_ids)
+            for order_id in [item for item in self.ids if item not in kept]:
+                self.remove(order_id)
+
+    def clear(self):
+        with self.lock:
+            self.reset()
+
+    def evaluate(self, price, total):
+        """Return the ids of the orders with something to do (see the module
+        help). The functions are called once per pair and currency
+        Arguments:
+            price: function pair -> last price (None or nan if unknown)
+            total: function currency -> total balance (None or nan if
+                   unknown)
+        """
+        with self.lock:
+            if not self.size:
+                return []
+            prices = np.array([price(pair) for pair in self.pairs],
+                              dtype=float)
+            totals = np.array([total(currency)
+                               for currency in self.currencies], dtype=float)
+            size = self.size
+            last = prices[self.pair[:size]]
+            # the comparisons with nan (unknown) are False: the order is due
+            due = ~(last > self.values["stoploss"][:size])
+            due |= self.countdown[:size] >= 0
+            due |= ~(totals[self.currency[:size]] > 0)
+            return [self.ids[row] for row in np.flatnonzero(due)]
+
+    def crossed(self, pair, price):
+        """Return the ids of the orders of a pair with a threshold crossed by
+        a new price since the last price checked (see feed.py): down to the
+        stoploss (no countdown running yet) or up to the target. The first
+        price of a pair crosses the thresholds already reached
+        Arguments:
+            pair: market pair ("XMR_BTC")
+            price: last price of the market
+        """
+        with self.lock:
+            code = self.pair_codes.get(pair)
+            if code is None or not self.size:
+                return []
+            last = self.last.get(code, np.nan)
+            self.last[code] = price
+            size = self.size
+            stoploss = self.values["stoploss"][:size]
+            target = self.values["target"][:size]
+            # the comparisons with nan (no last price) are False
+            due = ~(price > stoploss) & ~(last <= stoploss)
+            due &= self.countdown[:size] < 0
+            due |= ~(price < target) & ~(last >= target)
+            due &= self.pair[:size] == code
+            return [self.ids[row] for row in np.flatnonzero(due)]
+
+    def save(self, file_path):
+        """Write the orders in a file (.npz)"""
+        with self.lock:
+            temp_path = file_path + ".tmp.npz"
+            size = self.size
+            np.savez(temp_path, ids=np.array(self.ids, dtype=str),
+                     pairs=np.array([self.pairs[code]
+                                     for code in self.pair[:size]], dtype=str),
+                     currencies=np.array([self.currencies[code]
+                                          for code in self.currency[:size]],
+                                         dtype=str),
+                     countdown=self.countdown[:size],
+                     **dict((name, array[:size])
+                            for name, array in self.values.items()))
+            os.replace(temp_path, file_path)
+
+    def load(self, file_path):
+        """Read the orders of a file written by save. Return the number of
+        orders read"""
+        self.clear()
+        try:
+            with np.load(file_path) as data:
+                columns = dict((name, data[name].tolist())
+                               for name in ("ids", "pairs", "currencies",
+                                            "countdown") + COLUMNS)
+        except (OSError, KeyError, ValueError):
+            return 0
+        for row, order_id in enumerate(columns["ids"]):
+            countdown = columns["countdown"][row]
+            self.set(order_id, columns["pairs"][row],
+                     columns["buy"][row], columns["target"][row],
+                     columns["stoploss"][row],
+                     None if countdown < 0 else countdown,
+                     columns["currencies"][row])
+        return self.size
+
+# #######################################################79####################
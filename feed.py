@@ -0,0 +1,318 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Feed (Cryptopia)
+
+This module streams the prices of the markets to the orders instead of
+waiting for the next run of the pipeline. A feed produces snapshots of the
+markets (the "Data" of GetMarkets) and pushes the market data of each pair
+to the subscriptions asking for it, as an async stream (asyncio queues). A
+subscriber only keeps the last updates when it is slow to read them.
+The polling feed calls GetMarkets on a tight loop through a market snapshot
+(see market.py), so the pipeline reads the same prices without calling the
+api again, and the rate limits of the api client apply. The replay feed
+reads the snapshots of a json lines file, a list or the market recorder
+(see recorder.py), for the tests.
+The watch coroutine checks the active orders (see evaluator.py) against each
+update and calls back only with the orders crossing their stoploss or their
+target.
+
+Classes:
+
+    Subscription : Async stream of the market data of some pairs
+        parameters :
+            pairs (opt) : market pairs ("XMR_BTC") - default : None (all)
+            size (opt) : updates kept in the queue - default : QUEUE_SIZE
+
+    PriceFeed : Markets pushed to the subscriptions (base class)
+        parameters : none
+
+    PollingFeed : Markets polled with GetMarkets
+        parameters :
+            markets (opt) : market snapshot refreshed (see market.py) -
+                            default : a new MarketSnapshot
+            period (opt) : delay (seconds) between two polls - default :
+                           POLL_PERIOD
+
+    ReplayFeed : Markets read from a file or a list
+        parameters :
+            source (req) : json lines file (a snapshot per line) or list of
+                           snapshots
+            delay (opt) : delay (seconds) between two snapshots - default :
+                          0.0
+
+Methods :
+
+    watch (feed, orders, trigger, stop) : Check the active orders against
+        the updates of a feed, call trigger with the orders to execute
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import json
+import asyncio
+import threading
+
+import logger
+import market
+
+# delay (seconds) between two polls of GetMarkets
+POLL_PERIOD = 5.0
+# longest delay (seconds) between two polls when GetMarkets fails
+MAX_PERIOD = 60.0
+# updates kept by a subscription (the oldest are dropped)
+QUEUE_SIZE = 1024
+# longest wait (seconds) of an update, to stay responsive to the stop event
+WAIT = 1.0
+
+def _pair(label):
+    return label.replace("/", "_")
+
+class Subscription(object):
+    """Async stream of the market data of some pairs (None for all the
+    pairs), read with "async for" or get.
+    Arguments:
+        pairs: market pairs in format XXX_YYY ("XMR_BTC") or labels
+        size: updates kept in the queue (the oldest are dropped)
+    """
+    def __init__(self, pairs=None, size=None):
+        self.queue = asyncio.Queue(QUEUE_SIZE if size is None else size)
+        self.dropped = 0
+        self.set_pairs(pairs)
+
+    def set_pairs(self, pairs):
+        """Change the pairs of the subscription (None for all the pairs)"""
+        self.labels = None if pairs is None else \
+                      frozenset(market.label(pair) for pair in pairs)
+
+    def wants(self, label):
+        """Tell if the subscription asks for the market of a label"""
+        return self.labels is None or label in self.labels
+
+    def put(self, data):
+        """Add the market data of a pair (the oldest update is dropped when
+        the queue is full)"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def get(self):
+        """Return the next update (market data of a pair)"""
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+class PriceFeed(object):
+    """Markets pushed to the subscriptions. The subclasses produce the
+    snapshots of the markets (snapshots coroutine), run pushes them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.updates = 0
+
+    def subscribe(self, pairs=None, size=None):
+        """Return a new subscription (see Subscription)
+        Arguments:
+            pairs: market pairs ("XMR_BTC"), None for all the pairs
+            size: updates kept in the queue (default QUEUE_SIZE)
+        """
+        subscription = Subscription(pairs, size)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop pushing the updates to a subscription"""
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def publish(self, data):
+        """Push a snapshot of markets to the subscriptions. Return the number
+        of updates pushed
+        Arguments:
+            data: list of market data ("Data" of GetMarkets)
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        count = 0
+        for item in data or []:
+            label = item.get("Label")
+            for subscription in subscriptions:
+                if subscription.wants(label):
+                    subscription.put(item)
+                    count += 1
+        self.updates += count
+        return count
+
+    async def snapshots(self):
+        """Produce the snapshots of the markets (async generator)"""
+        raise NotImplementedError
+        yield
+
+    async def run(self, stop=None):
+        """Push the snapshots to the subscriptions until the end of the
+        snapshots or the stop event is set
+        Arguments:
+            stop: threading.Event stopping the feed
+        """
+        async for data in self.snapshots():
+            self.publish(data)
+            if stop is not None and stop.is_set():
+                break
+
+class PollingFeed(PriceFeed):
+    """Markets polled with GetMarkets every period. The market snapshot is
+    refreshed in a thread of the executor, the event loop stays free.
+    Arguments:
+        markets: market snapshot refreshed (see market.py), shared with the
+                 pipeline (ie: operation.MARKETS)
+        period: delay in seconds between two polls (default POLL_PERIOD)
+    """
+    def __init__(self, markets=None, period=None):
+        PriceFeed.__init__(self)
+        self.markets = market.MarketSnapshot() if markets is None else markets
+        self.period = POLL_PERIOD if period is None else period
+
+    def poll(self):
+        """Refresh the market snapshot. Return the markets (None if
+        GetMarkets has failed)"""
+        with self.markets.refresh_lock:
+            count = self.markets.refresh()
+        if not count:
+            return None
+        with self.markets.lock:
+            return list(self.markets.by_id.values())
+
+    async def snapshots(self):
+        loop = asyncio.get_running_loop()
+        delay = self.period
+        while True:
+            start = loop.time()
+            try:
+                data = await loop.run_in_executor(None, self.poll)
+            except Exception as e:
+                logger.LOGGER.error("ERROR Feed : %s", e)
+                data = None
+            if data:
+                delay = self.period
+                yield data
+            else:
+                # slower while GetMarkets fails (ie: rate limit)
+                delay = min(MAX_PERIOD, max(delay, self.period)*2)
+            await asyncio.sleep(max(0.0, delay - (loop.time() - start)))
+
+class ReplayFeed(PriceFeed):
+    """Markets read from a json lines file (a list of market data or a
+    GetMarkets response per line) or from a list of snapshots.
+    Arguments:
+        source: path of the file or list of snapshots
+        delay: delay in seconds between two snapshots (default 0)
+    """
+    def __init__(self, source, delay=0.0):
+        PriceFeed.__init__(self)
+        self.source = source
+        self.delay = delay
+
+    @classmethod
+    def from_recorder(cls, recorder, start, end, labels, delay=0.0):
+        """Return a feed replaying the market data recorded between two
+        times (see recorder.py)
+        Arguments:
+            recorder: market recorder
+            start, end: times (time.time())
+            labels: dictionnary TradePairId -> label ("XMR/BTC")
+            delay: delay in seconds between two snapshots
+        """
+        columns = recorder.query(start, end)
+        snapshots = []
+        stamp = None
+        for row in range(len(columns["time"])):
+            label = labels.get(int(columns["pairid"][row]))
+            if label is None:
+                continue
+            if columns["time"][row] != stamp:
+                stamp = columns["time"][row]
+                snapshots.append([])
+            snapshots[-1].append({
+                    "TradePairId": int(columns["pairid"][row]),
+                    "Label": label,
+                    "BidPrice": float(columns["bid"][row]),
+                    "AskPrice": float(columns["ask"][row]),
+                    "LastPrice": float(columns["last"][row]),
+                    "Volume": float(columns["volume"][row])})
+        return cls(snapshots, delay)
+
+    def read(self):
+        """Return the snapshots of the source (generator)"""
+        if not isinstance(self.source, str):
+            for data in self.source:
+                yield data
+            return
+        with open(self.source, "r", encoding="UTF-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if isinstance(data, dict):
+                    data = data.get("Data")
+                yield data
+
+    async def snapshots(self):
+        for data in self.read():
+            yield data
+            await asyncio.sleep(self.delay)
+
+async def watch(feed, orders, trigger, stop=None):
+    """Check the active orders against the updates of a feed until the stop
+    event is set: trigger is called with the ids of the orders of a pair
+    whose price crosses their stoploss or their target (see
+    evaluator.ActiveOrders.crossed). The pairs of the subscription follow
+    the orders
+    Arguments:
+        feed: price feed (see PriceFeed)
+        orders: active orders (see evaluator.ActiveOrders), updated by the
+                caller
+        trigger: function called with a list of order ids (from the thread
+                 of the event loop)
+        stop: threading.Event stopping the watch
+    """
+    subscription = feed.subscribe(list(orders.pairs))
+    runner = asyncio.ensure_future(feed.run(stop))
+    try:
+        while stop is None or not stop.is_set():
+            subscription.set_pairs(list(orders.pairs))
+            try:
+                data = await asyncio.wait_for(subscription.get(), WAIT)
+            except asyncio.TimeoutError:
+                if runner.done():
+                    # end of the snapshots (replay) or error of the feed
+                    if runner.exception() is not None:
+                        raise runner.exception()
+                    return
+                continue
+            try:
+                price = float(data["LastPrice"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            order_ids = orders.crossed(_pair(data["Label"]), price)
+            if order_ids:
+                trigger(order_ids)
+    finally:
+        runner.cancel()
+        feed.unsubscribe(subscription)
+
+# #######################################################79####################
@@ -0,0 +1,212 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Journal (Cryptopia)
+
+This module is the write-ahead journal of the calls of the pipeline with a
+side effect on the exchange (SubmitTrade, CancelTrade). The state of an
+order is saved after its step, so a crash between a call and the save of
+the order leaves the order behind the exchange, and the next tick may send
+the same trade again. Each call is written in the journal (and synced to
+the disk) before it is sent:
+- "intent" : the call, with the order, its step and status, and the state
+  of the step once the call has reached the exchange,
+- "sent" : the response of the call,
+- "done" : the order was saved after the call (written once per tick, when
+  the orders saved are synced),
+- "recovered" / "aborted" : the call was settled by the recovery pass.
+The journal is a file of JSON lines, each record is appended with a single
+write (the processes of the pipeline can share it). The calls without
+"done" are given by pending, to be checked against the open orders of the
+exchange (see operation.Recover_Journal).
+
+Classes:
+
+    Journal : Journal of the calls to the exchange
+        parameters :
+            file_path (req) : path of the journal file
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import json
+import time
+import uuid
+import threading
+
+# events settling a call
+SETTLED = ("done", "recovered", "aborted")
+# size (bytes) of the journal over which the settled calls are removed
+COMPACT_SIZE = 1024*1024
+
+class Journal(object):
+    """Journal of the calls to the exchange (JSON lines, append only).
+    Arguments:
+        file_path: path of the journal file
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+        # calls of this process not settled yet: id -> order id
+        self.calls = {}
+        # orders saved since the last commit
+        self.saved = set()
+        # the journal file was checked by a recovery pass
+        self.checked = False
+
+    def write(self, record, sync=False):
+        """Append a record to the journal (a single write)
+        Arguments:
+            record: dictionnary of the record
+            sync: sync the file to the disk once written
+        """
+        line = (json.dumps(record, sort_keys=True) + "\n").encode("UTF-8")
+        with self.lock:
+            if self.fd is None or self.pid != os.getpid():
+                self.fd = os.open(self.file_path,
+                                  os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                                  0o644)
+                self.pid = os.getpid()
+            os.write(self.fd, line)
+            if sync:
+                os.fsync(self.fd)
+
+    def intent(self, method, params, order_id=None, stage=None,
+               status=None, state=None):
+        """Write a call before it is sent, synced to the disk. Return the id
+        of the call
+        Arguments:
+            method: api method ("SubmitTrade")
+            params: parameters of the call
+            order_id: id of the order making the call
+            stage, status: step of the order and its status before the step
+                           (as in store.order_status)
+            state: attributes of the step element once the call has reached
+                   the exchange (None if the step can simply run again)
+        """
+        call_id = uuid.uuid4().hex
+        self.write({"id": call_id, "event": "intent", "time": time.time(),
+                    "method": method, "params": params, "order": order_id,
+                    "stage": stage, "status": status, "state": state},
+                   sync=True)
+        with self.lock:
+            self.calls[call_id] = order_id
+        return call_id
+
+    def sent(self, call_id, output):
+        """Write the response of a call
+        Arguments:
+            call_id: id of the call (see intent)
+            output: response of the api
+        """
+        self.write({"id": call_id, "event": "sent", "output": output})
+
+    def order_saved(self, order_id):
+        """Note an order saved, its calls are done at the next commit"""
+        with self.lock:
+            self.saved.add(order_id)
+
+    def commit(self):
+        """Write "done" for the calls of the orders saved (call it once the
+        orders are synced to the disk) and sync the journal. Return the
+        number of calls done"""
+        with self.lock:
+            done = [call_id for call_id, order_id in self.calls.items()
+                    if order_id in self.saved]
+            self.saved.clear()
+        for call_id in done:
+            self.settle(call_id, "done")
+        if done:
+            self.sync()
+        return len(done)
+
+    def settle(self, call_id, event):
+        """Write the event settling a call ("done", "recovered", "aborted")
+        """
+        self.write({"id": call_id, "event": event})
+        with self.lock:
+            self.calls.pop(call_id, None)
+
+    def sync(self):
+        """Sync the journal to the disk"""
+        with self.lock:
+            if self.fd is not None and self.pid == os.getpid():
+                os.fsync(self.fd)
+
+    def size(self):
+        """Return the size of the journal file (bytes)"""
+        if not os.path.exists(self.file_path):
+            return 0
+        return os.path.getsize(self.file_path)
+
+    def unsettled(self):
+        """Return the number of calls of this process not settled"""
+        with self.lock:
+            return len(self.calls)
+
+    def read(self):
+        """Return the calls of the journal file as dictionnaries (the intent
+        record, with the output of the "sent" record and the last event)"""
+        calls = {}
+        if not os.path.exists(self.file_path):
+            return calls
+        with open(self.file_path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode("UTF-8"))
+                except ValueError:
+                    # last line cut by a crash
+                    continue
+                call = calls.setdefault(record["id"], {"id": record["id"]})
+                if record["event"] == "intent":
+                    call.update(record)
+                else:
+                    call["event"] = record["event"]
+                    if "output" in record:
+                        call["output"] = record["output"]
+        return calls
+
+    def pending(self):
+        """Return the calls not settled (intent or sent), oldest first"""
+        calls = [call for call in self.read().values()
+                 if "method" in call and call["event"] not in SETTLED]
+        return sorted(calls, key=lambda call: call["time"])
+
+    def compact(self):
+        """Write the journal again with the calls not settled only (temp file
+        synced then renamed). Run it when no other process writes in the
+        journal. Return the number of calls kept"""
+        calls = self.pending()
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for call in calls:
+                intent = dict((key, value) for key, value in call.items()
+                              if key not in ("event", "output"))
+                intent["event"] = "intent"
+                f.write((json.dumps(intent, sort_keys=True) +
+                         "\n").encode("UTF-8"))
+                if call["event"] == "sent":
+                    f.write((json.dumps({"id": call["id"], "event": "sent",
+                                         "output": call.get("output")},
+                                        sort_keys=True) +
+                             "\n").encode("UTF-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            if self.fd is not None and self.pid == os.getpid():
+                os.close(self.fd)
+            self.fd = None
+            os.replace(temp_path, self.file_path)
+        return len(calls)
+
+# #######################################################79####################
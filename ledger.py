@@ -0,0 +1,197 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Ledger (Cryptopia)
+
+This module keeps a local ledger of the trades of the account in a SQLite
+database. The history is synced incrementally: GetTradeHistory is called for
+all the markets with a small Count, doubled until the trades already known
+(TradeId) are reached, and only the new trades are added. The trades are
+indexed by market and time, so the audit of an order is a range query
+whatever the depth of the history (no more 25 trades limit by pair).
+The timestamps of the exchange are kept as sortable strings
+"YYYY-MM-DD HH:MM:SS.ffffff" (clock of the exchange).
+
+Classes:
+
+    TradeLedger : Trades of the account
+        parameters :
+            file_path (req) : path of the database file
+            query (opt) : method calling the api - default : api.query
+            min_interval (opt) : seconds between two syncs - default :
+                                 SYNC_INTERVAL
+
+Methods :
+
+    stamp (value) : Sortable string of a TimeStamp of the exchange or of a
+                    datetime
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import time
+import sqlite3
+import datetime
+import threading
+
+import api
+import market
+
+# trades asked at the first sync (empty ledger) and at the next ones
+FIRST_COUNT = 1000
+SYNC_COUNT = 50
+# largest Count asked while looking for the known trades
+MAX_COUNT = 10000
+# seconds between two syncs (the trades of a tick are synced once)
+SYNC_INTERVAL = 30
+
+def stamp(value):
+    """Return the sortable string "YYYY-MM-DD HH:MM:SS.ffffff" of a TimeStamp
+    of the exchange ("2018-12-07T20:04:05.3947572") or of a datetime
+    Arguments:
+        value: TimeStamp string or datetime
+    """
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    text = str(value).replace("T", " ").rstrip("Z")
+    seconds, _, fraction = text.partition(".")
+    return seconds + "." + (fraction + "000000")[:6]
+
+class TradeLedger(object):
+    """Trades of the account in a SQLite database, synced incrementally.
+    Each thread (and process) uses its own connection.
+    Arguments:
+        file_path: path of the database file
+        query: method calling the api (default api.query)
+        min_interval: seconds between two syncs (default SYNC_INTERVAL)
+    """
+    def __init__(self, file_path, query=None, min_interval=None):
+        self.file_path = file_path
+        self.query = query or api.query
+        self.min_interval = (SYNC_INTERVAL if min_interval is None
+                             else min_interval)
+        self.synced = 0.0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def connect(self):
+        """Return the connection of the current thread, open it if needed"""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and self.local.pid == os.getpid():
+            return connection
+        connection = sqlite3.connect(self.file_path, timeout=30,
+                                     isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS trades (
+                id INTEGER PRIMARY KEY, pairid INTEGER, market TEXT,
+                type TEXT, rate REAL, amount REAL, total REAL, fee REAL,
+                time TEXT)""")
+        connection.execute("""CREATE INDEX IF NOT EXISTS trades_market
+                ON trades (market, time)""")
+        self.local.connection = connection
+        self.local.pid = os.getpid()
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def last_id(self):
+        """Return the TradeId of the last trade of the ledger (0 if empty)"""
+        row = self.connect().execute("SELECT MAX(id) FROM trades").fetchone()
+        return row[0] or 0
+
+    def sync(self, force=False):
+        """Add the new trades of the account to the ledger. Return the number
+        of trades added, None if the api call failed. Nothing is done if the
+        last sync is more recent than min_interval (unless force)
+        Arguments:
+            force: sync even if the last sync is recent
+        """
+        with self.lock:
+            if not force and time.time() - self.synced < self.min_interval:
+                return 0
+            last = self.last_id()
+            count = SYNC_COUNT if last else FIRST_COUNT
+            while True:
+                Output = self.query("GetTradeHistory", {"Count": count})
+                if not Output or not Output.get("Success"):
+                    return None
+                data = Output["Data"] or []
+                # all the new trades are there once a known one is reached
+                if (len(data) < count or count >= MAX_COUNT or
+                        min(line["TradeId"] for line in data) <= last):
+                    break
+                count = min(count*2, MAX_COUNT)
+            rows = [(line["TradeId"], line.get("TradePairId"),
+                     line["Market"], line["Type"], line["Rate"],
+                     line["Amount"], line["Total"], line["Fee"],
+                     stamp(line["TimeStamp"]))
+                    for line in data if line["TradeId"] > last]
+            connection = self.connect()
+            connection.execute("BEGIN")
+            connection.executemany(
+                    """INSERT OR IGNORE INTO trades (id, pairid, market,
+                    type, rate, amount, total, fee, time)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+            connection.execute("COMMIT")
+            self.synced = time.time()
+            return len(rows)
+
+    def count(self, pair):
+        """Return the number of trades of a market in the ledger
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+        """
+        row = self.connect().execute(
+                "SELECT COUNT(*) FROM trades WHERE market = ?",
+                (market.label(pair),)).fetchone()
+        return row[0]
+
+    def trades(self, pair, start, end):
+        """Return the trades of a market between two times (excluded) as
+        dictionnaries (same fields as the GetTradeHistory "Data" items)
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+            start, end: datetimes or TimeStamps (clock of the exchange)
+        """
+        cursor = self.connect().execute(
+                """SELECT id, pairid, market, type, rate, amount, total, fee,
+                time FROM trades WHERE market = ? AND time > ? AND time < ?
+                ORDER BY time""",
+                (market.label(pair), stamp(start), stamp(end)))
+        return [{"TradeId": row[0], "TradePairId": row[1], "Market": row[2],
+                 "Type": row[3], "Rate": row[4], "Amount": row[5],
+                 "Total": row[6], "Fee": row[7], "TimeStamp": row[8]}
+                for row in cursor]
+
+    def totals(self, pair, start, end):
+        """Return the totals of the trades of a market between two times
+        (excluded) as a dictionnary: Buy, Sell and Fees
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+            start, end: datetimes or TimeStamps (clock of the exchange)
+        """
+        result = {"Buy": 0.0, "Sell": 0.0, "Fees": 0.0}
+        cursor = self.connect().execute(
+                """SELECT type, SUM(total), SUM(fee) FROM trades
+                WHERE market = ? AND time > ? AND time < ? GROUP BY type""",
+                (market.label(pair), stamp(start), stamp(end)))
+        for tradetype, total, fee in cursor:
+            if tradetype in ("Buy", "Sell"):
+                result[tradetype] += total
+                result["Fees"] += fee
+        return result
+
+# #######################################################79####################
@@ -0,0 +1,223 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Logger (Cryptopia)
+
+This module is the logging of the pipeline, built on the logging package:
+- the records carry the context of the order (order_id, pair, stage,
+  status), set with Context,
+- the records go to the console, to a ring buffer of the recent events
+  (Recent) and, once Setup is called, to a buffered, size-rotated file in
+  the logs folder,
+- the messages are formatted only if a handler writes them
+  (ie: Log("price %.8f", price)),
+- Span measures the time of a block of code (the steps of the orders, the
+  api calls...), the totals are given by Span_Report.
+
+Methods :
+
+    Setup : Add the rotating file (in the logs folder) to the handlers
+        parameters :
+            folder (req) : folder of the log files
+
+    Context : Context manager setting fields of the records
+              ie: with Context(order_id=..., pair=...):
+
+    Span : Context manager measuring the time of a block
+           ie: with Span("entry", stage="entry"):
+
+    Span_Report : Count, total and max time of the spans
+
+    Recent : Recent events of the ring buffer
+
+    Flush : Write the buffered records in the file
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import sys
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+import collections
+import logging.handlers
+
+# name of the log file, size (bytes) before rotation and files kept
+LOG_FILE = "pipeline.log"
+LOG_SIZE = 5*1024*1024
+LOG_BACKUPS = 5
+# records buffered before a write in the file (errors are written at once)
+BUFFER = 200
+# events kept in the ring buffer
+RING = 1000
+# fields of the context of the records
+FIELDS = ("order_id", "pair", "stage", "status")
+FILE_FORMAT = ("%(asctime)s %(levelname)s [%(order_id)s|%(pair)s|"
+               "%(stage)s|%(status)s] %(message)s")
+
+LOGGER = logging.getLogger("cryptopia")
+CONTEXT = contextvars.ContextVar("context", default={})
+# name of the span -> [count, total time, max time]
+SPANS = {}
+SPANS_LOCK = threading.Lock()
+
+class ContextFilter(logging.Filter):
+    """Add the fields of the context to the records"""
+    def filter(self, record):
+        context = CONTEXT.get()
+        for field in FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, context.get(field, "-"))
+        return True
+
+class ConsoleHandler(logging.StreamHandler):
+    """Handler writing the messages in the current sys.stdout (it can be
+    redirected, ie: by the worker processes of shard.py)"""
+    def __init__(self):
+        logging.StreamHandler.__init__(self, sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+class RingHandler(logging.Handler):
+    """Handler keeping the recent records in memory"""
+    def __init__(self, size=RING):
+        logging.Handler.__init__(self)
+        self.records = collections.deque(maxlen=size)
+
+    def emit(self, record):
+        self.records.append(record)
+
+CONSOLE = ConsoleHandler()
+RING_HANDLER = RingHandler()
+FILE_HANDLER = None
+LOGGER.addFilter(ContextFilter())
+LOGGER.addHandler(CONSOLE)
+LOGGER.addHandler(RING_HANDLER)
+LOGGER.setLevel(logging.INFO)
+LOGGER.propagate = False
+
+def Setup(folder, level=None):
+    """
+    Method to add the buffered, size-rotated file of the folder to the
+    handlers (done once). Parameters :
+    folder   (req) - Folder of the log files
+    level    (opt) - Level of the logger (ie: logging.DEBUG for the spans)
+    """
+    global FILE_HANDLER
+    if level is not None:
+        LOGGER.setLevel(level)
+    if FILE_HANDLER is not None:
+        return
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    target = logging.handlers.RotatingFileHandler(
+            os.path.join(folder, LOG_FILE), maxBytes=LOG_SIZE,
+            backupCount=LOG_BACKUPS)
+    target.setFormatter(logging.Formatter(FILE_FORMAT))
+    FILE_HANDLER = logging.handlers.MemoryHandler(
+            BUFFER, flushLevel=logging.ERROR, target=target)
+    LOGGER.addHandler(FILE_HANDLER)
+
+def Reset():
+    """
+    Method to remove the file of the handlers, without writing the buffered
+    records (ie: in a forked worker process)
+    """
+    global FILE_HANDLER
+    if FILE_HANDLER is not None:
+        LOGGER.removeHandler(FILE_HANDLER)
+        FILE_HANDLER.buffer = []
+        FILE_HANDLER = None
+
+def Flush():
+    """
+    Method to write the buffered records in the file
+    """
+    if FILE_HANDLER is not None:
+        FILE_HANDLER.flush()
+
+@contextlib.contextmanager
+def Context(**fields):
+    """
+    Context manager setting fields of the records logged in the block
+    (order_id, pair, stage, status)
+    """
+    context = dict(CONTEXT.get())
+    context.update(fields)
+    token = CONTEXT.set(context)
+    try:
+        yield context
+    finally:
+        CONTEXT.reset(token)
+
+@contextlib.contextmanager
+def Span(name, **fields):
+    """
+    Context manager measuring the time of a block. The time is logged (at
+    DEBUG level) and added to the totals of Span_Report. The fields are set
+    in the context of the block.
+    """
+    start = time.perf_counter()
+    try:
+        if fields:
+            with Context(**fields):
+                yield
+        else:
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with SPANS_LOCK:
+            stats = SPANS.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+        LOGGER.debug("span %s %.6fs", name, elapsed)
+
+def Span_Report(reset=False):
+    """
+    Method returning the spans as a list of (name, count, total, max),
+    the longest total first. Parameters :
+    reset    (opt) - Clear the totals after the report
+    """
+    with SPANS_LOCK:
+        report = [(name, stats[0], stats[1], stats[2])
+                  for name, stats in SPANS.items()]
+        if reset:
+            SPANS.clear()
+    return sorted(report, key=lambda item: -item[2])
+
+def Recent(count=None):
+    """
+    Method returning the recent events of the ring buffer as dictionnaries.
+    Parameters :
+    count    (opt) - Number of events (default all)
+    """
+    records = list(RING_HANDLER.records)
+    if count is not None:
+        records = records[-count:]
+    events = []
+    for record in records:
+        event = {"time": record.created, "level": record.levelname,
+                 "message": record.getMessage()}
+        for field in FIELDS:
+            event[field] = getattr(record, field, "-")
+        events.append(event)
+    return events
+
+# #######################################################79####################
@@ -0,0 +1,262 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Market (Cryptopia)
+
+This module keeps a snapshot of all the markets of the exchange. The markets
+are fetched with a single GetMarkets call and indexed by label ("XMR/BTC")
+and by TradePairId, so the prices needed by all the orders of a tick cost
+one public call instead of one GetMarket call per order.
+The trade pairs (GetTradePairs) are indexed the same way in a registry, with
+the minimum trade amounts computed once.
+
+Classes:
+
+    TradePair : Compact record of a trade pair (GetTradePairs)
+
+    TradePairRegistry : Trade pairs indexed by label, id and currency symbol
+        parameters :
+            data (req) : "Data" of the GetTradePairs response
+            phi (opt) : security coeff applied to the minimum trade amounts
+                        default : 1.0
+
+    MarketSnapshot : Markets of the exchange indexed by label and id
+        parameters :
+            max_age (opt) : age (seconds) after which the snapshot is
+                            fetched again - default : MAX_AGE
+            query (opt) : method calling the api - default : api.query
+            recorder (opt) : recorder of the market data fetched (see
+                             recorder.py) - default : None
+
+Methods :
+
+    label (pair) : Convert a pair "XMR_BTC" to a market label "XMR/BTC"
+
+    entry_plan (asks, base_amount, max_slippage) : Limit price, amount and
+        average price of a buy walking the sell side of the order book
+        (GetMarketOrders), within a maximum slippage
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import time
+import threading
+
+import api
+import logger
+
+# age (seconds) after which the snapshot is fetched again
+MAX_AGE = 30
+# minimum base trade of a pair unknown by the exchange
+DEFAULT_MINIMUM = 0.0005
+# highest price of an entry over the best ask (ratio), the rest of the
+# amount is bought in a next slice
+MAX_SLIPPAGE = 0.01
+
+def label(pair):
+    """Convert a pair "XMR_BTC" to a market label "XMR/BTC" """
+    return pair.replace("_", "/")
+
+def entry_plan(asks, base_amount, max_slippage=MAX_SLIPPAGE):
+    """Return the buy needed to spend a base amount on the sell side of an
+    order book, as a dictionnary: price (limit price, the last level
+    reached), amount (coins), vwap (average price of the fill), base (base
+    amount spent) and remaining (base amount left for a next slice when the
+    depth under price*(1+max_slippage) is too thin). None if no sell order.
+    Arguments:
+        asks: "Sell" orders of GetMarketOrders (Price, Volume), best first
+        base_amount: amount to spend (base currency, ie in BTC)
+        max_slippage: highest price over the best ask (ratio)
+    """
+    levels = sorted((float(item["Price"]), float(item["Volume"]))
+                    for item in asks or [] if float(item["Volume"]) > 0)
+    if not levels or base_amount <= 0:
+        return None
+    highest = levels[0][0]*(1+max_slippage)
+    price = levels[0][0]
+    amount = 0.0
+    base = 0.0
+    for level_price, volume in levels:
+        if level_price > highest or base >= base_amount:
+            break
+        price = level_price
+        take = min(volume, (base_amount - base)/level_price)
+        amount += take
+        base += take*level_price
+    return {"price": price, "amount": amount, "vwap": base/amount,
+            "base": base, "remaining": max(0.0, base_amount - base)}
+
+class MarketSnapshot(object):
+    """Markets of the exchange, fetched at once with GetMarkets.
+    Arguments:
+        max_age: age in seconds after which the snapshot is fetched again
+                 (default MAX_AGE)
+        query: method calling the api (default api.query)
+        recorder: object keeping the market data fetched (record method,
+                  see recorder.py), None to throw it away
+    """
+    def __init__(self, max_age=None, query=None, recorder=None):
+        self.max_age = MAX_AGE if max_age is None else max_age
+        self.query = query or api.query
+        self.recorder = recorder
+        self.by_label = {}
+        self.by_id = {}
+        self.stamp = 0.0
+        # time of the last call of GetMarkets (failed or not)
+        self.attempt = 0.0
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Fetch all the markets again. Return the number of markets"""
+        self.attempt = time.time()
+        Output = self.query("GetMarkets")
+        if not Output or not Output.get("Success") or not Output["Data"]:
+            # the snapshot stays stale: the markets are fetched one by one
+            # (see get) until a refresh succeeds
+            return 0
+        self.save(Output["Data"])
+        by_label = {}
+        by_id = {}
+        for data in Output["Data"]:
+            by_label[data["Label"]] = data
+            by_id[data["TradePairId"]] = data
+        with self.lock:
+            self.by_label = by_label
+            self.by_id = by_id
+            self.stamp = time.time()
+        return len(by_label)
+
+    def save(self, data):
+        """Give the market data fetched to the recorder (if any). A failure
+        of the recorder doesn't stop the pipeline"""
+        if self.recorder is None:
+            return
+        try:
+            self.recorder.record(data)
+        except Exception as e:
+            logger.LOGGER.error("ERROR Recorder : %s", e)
+
+    def is_stale(self):
+        """Tell if the snapshot is older than max_age"""
+        return time.time() - self.stamp > self.max_age
+
+    def must_refresh(self):
+        """Tell if the snapshot is stale and GetMarkets has not been called
+        (ie: failed) during the last max_age seconds"""
+        return self.is_stale() and time.time() - self.attempt > self.max_age
+
+    def check(self):
+        """Fetch the snapshot again if it is stale. One thread does the call,
+        the other ones wait for it"""
+        if self.must_refresh():
+            with self.refresh_lock:
+                if self.must_refresh():
+                    self.refresh()
+
+    def get(self, pair):
+        """Return the market data (same as GetMarket "Data") of a pair. The
+        snapshot is fetched again if it is stale, a market missing in the
+        snapshot (or all of them while GetMarkets fails) is fetched alone
+        with GetMarket.
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+        """
+        self.check()
+        data = None
+        if not self.is_stale():
+            data = self.by_label.get(label(pair))
+        if data is None:
+            Output = self.query("GetMarket", [pair])
+            if not Output or not Output.get("Success") or not Output["Data"]:
+                raise Exception("GetMarket " + pair + " : " + 
+                                str(Output and Output.get("Error")))
+            data = Output["Data"]
+            self.save([data])
+            with self.lock:
+                self.by_label[data["Label"]] = data
+                self.by_id[data["TradePairId"]] = data
+        return data
+
+    def get_by_id(self, pairid):
+        """Return the market data of a TradePairId (None if unknown or
+        stale)"""
+        self.check()
+        if self.is_stale():
+            return None
+        return self.by_id.get(pairid)
+
+class TradePair(object):
+    """Compact record of a trade pair (GetTradePairs)"""
+    __slots__ = ("pairid", "label", "symbol", "base_symbol", "status",
+                 "trade_fee", "minimum_base_trade", "minimum")
+
+    def __init__(self, data, phi=1.0):
+        self.pairid = data["Id"]
+        self.label = data["Label"]
+        self.symbol = data["Symbol"]
+        self.base_symbol = data["BaseSymbol"]
+        self.status = data.get("Status")
+        self.trade_fee = float(data.get("TradeFee") or 0.0)
+        self.minimum_base_trade = float(data["MinimumBaseTrade"])
+        # minimum with the security coeff, to stay over the exchange minimum
+        self.minimum = self.minimum_base_trade*phi+0.00000001
+
+    def __repr__(self):
+        return "TradePair(" + str(self.pairid) + ", " + self.label + ")"
+
+class TradePairRegistry(object):
+    """Trade pairs indexed by label, TradePairId and currency symbol.
+    Arguments:
+        data: "Data" of the GetTradePairs response
+        phi: security coeff applied to the minimum trade amounts (default 1)
+    """
+    def __init__(self, data, phi=1.0):
+        self.phi = phi
+        # response the registry was built from (to detect a new one)
+        self.source = None
+        self.by_label = {}
+        self.by_id = {}
+        self.by_symbol = {}
+        for item in data or []:
+            pair = TradePair(item, phi)
+            self.by_label[pair.label] = pair
+            self.by_id[pair.pairid] = pair
+            self.by_symbol.setdefault(pair.symbol, []).append(pair)
+
+    def __len__(self):
+        return len(self.by_label)
+
+    def get(self, pair):
+        """Return the TradePair of a pair (None if unknown)
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+        """
+        return self.by_label.get(label(pair))
+
+    def get_by_id(self, pairid):
+        """Return the TradePair of a TradePairId (None if unknown)"""
+        return self.by_id.get(pairid)
+
+    def get_by_symbol(self, symbol):
+        """Return the list of the TradePair trading a currency symbol"""
+        return self.by_symbol.get(symbol, [])
+
+    def minimum(self, pair):
+        """Return the minimum base amount (with phi) to trade on a pair
+        Arguments:
+            pair: market pair in format XXX_YYY ("XMR_BTC") or label
+        """
+        item = self.by_label.get(label(pair))
+        if item is None:
+            return DEFAULT_MINIMUM*self.phi+0.00000001
+        return item.minimum
+
+# #######################################################79####################
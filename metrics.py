@@ -0,0 +1,221 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Metrics (Cryptopia)
+
+This module keeps the metrics of the api and of the pipeline, and exposes
+them in the Prometheus text format through a small local HTTP endpoint:
+- cryptopia_api_latency_seconds : latency histogram of the calls by method
+- cryptopia_api_errors_total : calls answered with Success=false (or
+  failed) by method
+- cryptopia_cache_hits / cryptopia_cache_misses / cryptopia_cache_hit_ratio
+  : effectiveness of the cache (Get_Cache), registered by operation.py
+- cryptopia_pipeline_orders : orders of the last tick by stage
+- cryptopia_tick_seconds : duration histogram of the ticks
+With shard.py, the api metrics stay in the worker processes, the
+coordinator publishes the ticks only.
+The updates are a lock and a few additions, cheap enough for the hot path.
+
+Classes:
+
+    Counter, Gauge, Histogram : Metrics with labels
+
+    Registry : Metrics exposed by the endpoint
+
+Methods :
+
+    render (registry) : Metrics in the Prometheus text format
+
+    start_server (port, host) : Serve the metrics on http://host:port/metrics
+                                in a background thread
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import bisect
+import threading
+import http.server
+
+# port of the endpoint
+PORT = 9108
+# buckets (seconds) of the latency and tick histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TICK_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(name + '="' + str(value) + '"'
+                          for name, value in zip(names, values)) + "}"
+
+class Metric(object):
+    """Base of the metrics: name, help and labels"""
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        """Return the list of (name, labels, value) of the metric"""
+        with self.lock:
+            return [(self.name, _labels(self.labels, key), value)
+                    for key, value in sorted(self.values.items())]
+
+class Counter(Metric):
+    """Counter, only goes up"""
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    """Gauge, set to a value (or computed by a function at each render)"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        Metric.__init__(self, name, documentation, labels)
+        self.function = function
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, "", self.function())]
+        return Metric.samples(self)
+
+class Histogram(Metric):
+    """Histogram with fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(labels)
+            if data is None:
+                data = self.values[labels] = [[0]*(len(self.buckets)+1),
+                                              0.0, 0]
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    def samples(self):
+        result = []
+        with self.lock:
+            items = sorted((key, [list(data[0]), data[1], data[2]])
+                           for key, data in self.values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",),
+                                           counts):
+                cumulative += bucket_count
+                result.append((self.name + "_bucket",
+                               _labels(self.labels + ("le",),
+                                       key + (bound,)),
+                               cumulative))
+            labels = _labels(self.labels, key)
+            result.append((self.name + "_sum", labels, total))
+            result.append((self.name + "_count", labels, count))
+        return result
+
+class Registry(object):
+    """Metrics exposed by the endpoint"""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels,
+                                       buckets))
+
+REGISTRY = Registry()
+API_LATENCY = REGISTRY.histogram("cryptopia_api_latency_seconds",
+                                 "Latency of the api calls", ["method"])
+API_ERRORS = REGISTRY.counter("cryptopia_api_errors_total",
+                              "Api calls failed or answered with "
+                              "Success=false", ["method"])
+PIPELINE_ORDERS = REGISTRY.gauge("cryptopia_pipeline_orders",
+                                 "Orders of the last tick by stage",
+                                 ["stage"])
+TICK_SECONDS = REGISTRY.histogram("cryptopia_tick_seconds",
+                                  "Duration of the ticks of the pipeline",
+                                  buckets=TICK_BUCKETS)
+
+def render(registry=None):
+    """Return the metrics in the Prometheus text format
+    Arguments:
+        registry: metrics to render (default REGISTRY)
+    """
+    lines = []
+    for metric in (registry or REGISTRY).metrics:
+        lines.append("# HELP " + metric.name + " " + metric.documentation)
+        lines.append("# TYPE " + metric.name + " " + metric.kind)
+        for name, labels, value in metric.samples():
+            if not isinstance(value, int):
+                value = float(value)
+            lines.append(name + labels + " " + repr(value))
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Answer GET /metrics with the metrics of REGISTRY"""
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("UTF-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=None, host="127.0.0.1"):
+    """Serve the metrics on http://host:port/metrics in a background thread.
+    Return the server (server.shutdown() to stop it)
+    Arguments:
+        port: port of the endpoint (default PORT)
+        host: interface listened (default local only)
+    """
+    server = http.server.ThreadingHTTPServer((host, port or PORT),
+                                             MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="metrics", daemon=True)
+    thread.start()
+    return server
+
+# #######################################################79####################
@@ -0,0 +1,219 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Netting (Cryptopia)
+
+This module nets the trades of the orders of a tick by market (TradePairId).
+The orders on the same market share the balance of the currency on the
+exchange: instead of a trade per order, the trades at the market price of
+a tick (the entry buys, the stoploss exits) are collected, the buys and the
+sells of a market are crossed between the orders (no trade on the exchange
+for the crossed amount), and a single trade is sent for the net amount.
+The crossed amount and the part of the net trade filled are allocated back
+to the orders in proportion of their trades (shares of the net trade).
+The cancels of a market (CancelTrade by TradePair cancels the open trades
+of all the orders of the market) are sent once per tick, with the open
+orders of the market read just before (the amounts filled by the trades
+cancelled, the trades sent after the cancel are noted apart), the open
+orders of a market are read once per tick.
+
+Classes:
+
+    NettingDesk : Trades of the orders of a tick, by market
+        parameters : none
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import threading
+
+class NettingDesk(object):
+    """Trades of the orders of a tick, by TradePairId. The orders can add
+    their trades from several threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Forget the trades, cancels and open orders of the tick"""
+        # TradePairId -> list of (order_id, type, rate, amount)
+        self.trades = {}
+        # TradePairId -> response of the cancel of the tick
+        self.cancels = {}
+        # TradePairId -> open orders just before the cancel (None: unknown)
+        self.snapshots = {}
+        # TradePairId -> OrderId of the trades sent after the cancel
+        self.after_cancel = {}
+        # TradePairId -> open orders of the tick
+        self.open_orders = {}
+
+    def add(self, order_id, pairid, tradetype, rate, amount):
+        """Add the trade of an order, sent at the end of the tick
+        Arguments:
+            order_id: id of the order
+            pairid: TradePairId of the market
+            tradetype: "Buy" or "Sell"
+            rate: limit price of the trade
+            amount: amount to trade (currency of the market)
+        """
+        with self.lock:
+            self.trades.setdefault(pairid, []).append(
+                    (order_id, tradetype, float(rate), float(amount)))
+
+    def pairs(self):
+        """Return the TradePairId with trades in the tick"""
+        with self.lock:
+            return list(self.trades)
+
+    def net(self, pairid):
+        """Return the net trade of a market as a dictionnary: buy and sell
+        (amounts asked), crossed (amount traded between the orders), type,
+        rate and amount of the trade to send (type None if nothing to send).
+        The rate is the highest of the buys or the lowest of the sells, so
+        the limit covers all the trades of the side.
+        Arguments:
+            pairid: TradePairId of the market
+        """
+        with self.lock:
+            trades = list(self.trades.get(pairid, []))
+        buy = sum(amount for _, tradetype, _, amount in trades
+                  if tradetype == "Buy")
+        sell = sum(amount for _, tradetype, _, amount in trades
+                   if tradetype == "Sell")
+        result = {"buy": buy, "sell": sell, "crossed": min(buy, sell),
+                  "type": None, "rate": 0.0, "amount": abs(buy - sell)}
+        if buy > sell:
+            result["type"] = "Buy"
+            result["rate"] = max(rate for _, tradetype, rate, _ in trades
+                                 if tradetype == "Buy")
+        elif sell > buy:
+            result["type"] = "Sell"
+            result["rate"] = min(rate for _, tradetype, rate, _ in trades
+                                 if tradetype == "Sell")
+        return result
+
+    def allocate(self, pairid, filled):
+        """Return the amounts allocated to the orders of a market as a
+        dictionnary order_id -> amount (positive bought, negative sold): the
+        crossed amount to the two sides, the amount filled on the exchange to
+        the side of the net trade, in proportion of the amounts asked
+        Arguments:
+            pairid: TradePairId of the market
+            filled: amount of the net trade filled (or accepted) by the
+                    exchange
+        """
+        with self.lock:
+            trades = list(self.trades.get(pairid, []))
+        net = self.net(pairid)
+        allocation = {}
+        for order_id, tradetype, _, amount in trades:
+            total = net["buy"] if tradetype == "Buy" else net["sell"]
+            share = net["crossed"]
+            if tradetype == net["type"]:
+                share += filled
+            quantity = share*amount/total if total > 0 else 0.0
+            if tradetype == "Sell":
+                quantity = -quantity
+            allocation[order_id] = allocation.get(order_id, 0.0) + quantity
+        return allocation
+
+    def shares(self, pairid):
+        """Return the shares of the orders in the net trade of a market as a
+        dictionnary order_id -> ratio (positive buy, negative sell), the
+        orders of the other side have no share
+        Arguments:
+            pairid: TradePairId of the market
+        """
+        with self.lock:
+            trades = list(self.trades.get(pairid, []))
+        net = self.net(pairid)
+        total = net["buy"] if net["type"] == "Buy" else net["sell"]
+        shares = {}
+        for order_id, tradetype, _, amount in trades:
+            if tradetype != net["type"] or total <= 0:
+                continue
+            share = amount/total if tradetype == "Buy" else -amount/total
+            shares[order_id] = shares.get(order_id, 0.0) + share
+        return shares
+
+    def cancel(self, pairid, send, fetch=None):
+        """Cancel the open trades of a market once per tick. Return the
+        response of the cancel (the one of the first call of the tick)
+        Arguments:
+            pairid: TradePairId of the market
+            send: function sending the cancel, returns the response
+            fetch: function reading the open orders of the market, kept
+                   before the cancel (see snapshot)
+        """
+        with self.lock:
+            if pairid in self.cancels:
+                return self.cancels[pairid]
+        orders = None
+        if fetch is not None:
+            try:
+                orders = fetch()
+            except Exception:
+                orders = None
+        Output = send()
+        with self.lock:
+            self.cancels[pairid] = Output
+            self.snapshots[pairid] = orders
+        self.changed(pairid)
+        return Output
+
+    def placed(self, pairid, orderid):
+        """Note a trade sent on a market, kept if the market has been
+        cancelled (the trade is not in the snapshot)
+        Arguments:
+            pairid: TradePairId of the market
+            orderid: OrderId of the trade (None if filled at once)
+        """
+        with self.lock:
+            if pairid in self.cancels and orderid is not None:
+                self.after_cancel.setdefault(pairid, set()).add(str(orderid))
+
+    def sent_after_cancel(self, pairid):
+        """Return the OrderId of the trades sent on a market after its
+        cancel"""
+        with self.lock:
+            return set(self.after_cancel.get(pairid, ()))
+
+    def changed(self, pairid):
+        """Forget the open orders of a market (a trade was sent)"""
+        with self.lock:
+            self.open_orders.pop(pairid, None)
+
+    def cancelled(self):
+        """Return the TradePairId cancelled in the tick"""
+        with self.lock:
+            return list(self.cancels)
+
+    def snapshot(self, pairid):
+        """Return the open orders of a market read just before its cancel
+        (None if unknown)"""
+        with self.lock:
+            return self.snapshots.get(pairid)
+
+    def get_open_orders(self, pairid, fetch):
+        """Return the open orders of a market, read once per tick
+        Arguments:
+            pairid: TradePairId of the market
+            fetch: function reading the open orders (list)
+        """
+        with self.lock:
+            if pairid in self.open_orders:
+                return self.open_orders[pairid]
+        orders = fetch()
+        with self.lock:
+            self.open_orders[pairid] = orders
+        return orders
+
+# #######################################################79####################
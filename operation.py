@@ -6,7 +6,8 @@
 This module aim to manage orders on the Cryptopia Exchange. 
 The principle is to use the Create_Order method to create an order.
 Then the Execute_Pipeline is run on a regulare basis (ie: every minute)
-to take care of the orders. A sell order is created a the start. 
+to take care of the orders (or scheduler.py runs as a long running 
+process). A sell order is created a the start. 
 If the price stay under the stoploss several times (DEFAULT COUNTDOWN), 
 the sellorder at the target price is canceled 
 and an order at the market price is created instead.
@@ -22,8 +23,29 @@ Methods :
             target (opt) : ratio of the sell target - default : 0.1 (+10%)
             stoploss (opt) : ratio of the stoploss - default : 0.0618 (-6.18%)
 
+    Create_Orders : Validate and add a batch of orders in the pipeline, by
+                    chunks written at once
+        parameters : 
+            orders (req) : iterable of dictionnaries (pair, amount, target,
+                           stoploss), ie: rows of a csv file
+            batch_size (opt) : orders written at once - default : BATCH_SIZE
+
+    Import_Orders : Create_Orders from a csv, json or json lines file
+        parameters : 
+            file_path (req) : path of the file
+
     Execute_Pipeline : Execute all orders in the pipeline
 
+    Execute_Pipeline_Async : Execute all orders in the pipeline concurrently
+        parameters : 
+            concurrency (opt) : maximum orders in progress at the same time
+                                default : CONCURRENCY
+
+    Recover_Journal : Settle the trades sent without the order saved after
+                      (crash), against the open orders of the exchange
+
+    Flush_Trades : Send the trades of the tick netted by market (if NETTING)
+
 """
 # #############79##############################################################
 #                                      #
@@ -31,28 +53,107 @@ __author__ = "jxtrbtk"                 #
 __contact__ = "bYhO-bOwA-dIcA"         #
 __date__ = "cYfE-rIrI-kA"              # Mon Dec  3 21:47:41 2018
 __email__ = "j.t[4t]free.fr"           #
-__version__ = "2.0.1"                  #
+__version__ = "2.5.0"                  #
 #                                      #
 # ##################################79#########################################
 
 import os
+import csv
+import json
+import math
 import platform
 import datetime
 import time
-import uuid
+import asyncio
+import concurrent.futures
 import xml.etree.ElementTree as etree
 
 import api
+import balance
+import cache
+import journal
+import ledger
+import logger
+import market
+import metrics
+import netting
+import store
+try:
+    import evaluator
+    import recorder
+except ImportError:
+    # no NumPy: the active orders are checked one by one, no recorder
+    evaluator = None
+    recorder = None
 
 DATA_PATH = "data"
 LOGS_ENABLED = True
 
 DEFAULT_COUNTDOWN = 7
+# maximum orders executed at the same time by Execute_Pipeline_Async
+# (keep it low enough for the rate limits of the exchange)
+CONCURRENCY = 8
+# factor of the waits for the exchange (0 with a simulated exchange)
+WAIT_FACTOR = 1.0
 # security coeff to avoid to trade under the minimum trade amount
 PHI = 1.38
+# orders written at once by Create_Orders
+BATCH_SIZE = 1000
+# levels of the order book read for the entries, highest price of an entry
+# over the best ask (ratio), the rest is bought in a next slice
+ORDER_BOOK_DEPTH = 50
+MAX_SLIPPAGE = market.MAX_SLIPPAGE
 
 # cache for api data, to avoid errors caused by too many api calls
-CACHE = {}
+CACHE = cache.Cache()
+metrics.REGISTRY.gauge("cryptopia_cache_hits", "Calls served from the cache",
+                       function=lambda: CACHE.hits)
+metrics.REGISTRY.gauge("cryptopia_cache_misses", "Calls sent to the api",
+                       function=lambda: CACHE.misses)
+metrics.REGISTRY.gauge("cryptopia_cache_hit_ratio",
+                       "Ratio of calls served from the cache",
+                       function=lambda: CACHE.ratio())
+# snapshot of the cache (in DATA_PATH) kept from a run to the next one
+CACHE_FILE = "cache.json"
+# prices of all the markets, fetched once per tick (GetMarkets)
+MARKETS = market.MarketSnapshot()
+# record the market data fetched in DATA_PATH/RECORD_FOLDER (see 
+# recorder.py), the days older than RECORD_DAYS are downsampled to one row
+# per pair every RECORD_PERIOD seconds
+RECORD_MARKETS = False
+RECORD_FOLDER = "market"
+RECORD_DAYS = 7
+RECORD_PERIOD = 300
+# trade pairs indexed by label/id/symbol, built from GetTradePairs
+PAIRS = None
+# balances of the account, loaded once per tick (GetBalance)
+BALANCES = balance.BalanceBook()
+# store of the orders (see Set_Store), xml files in DATA_PATH by default
+STORE = None
+# ledger of the trades of the account (see Get_Ledger), in DATA_PATH
+LEDGER = None
+LEDGER_FILE = "trades.db"
+# active orders checked at once against the market snapshot (see
+# evaluator.py), kept in DATA_PATH from a run to the next one
+ACTIVE = evaluator.ActiveOrders() if evaluator is not None else None
+ACTIVE_FILE = "active.npz"
+# write-ahead journal of the trades sent (see journal.py)
+JOURNAL = None
+JOURNAL_FILE = "journal.log"
+# trades of the history read to check a trade sent before a crash
+RECOVERY_HISTORY = 100
+# orders with a trade of the journal the recovery could not settle (they are
+# not executed until it is settled, see Recover_Journal)
+UNRESOLVED = set()
+
+# the orders on the same market share a position (see netting.py): the 
+# entries and the stoploss exits of a tick are sent as a single trade per
+# market, the share of each order is kept in its entry ("quantity")
+NETTING = False
+DESK = netting.NettingDesk()
+
+# steps of the orders counted in the metrics of a tick
+STAGES = ("entry", "action", "audit", "done", "error")
 
 def Main():
     Initialisation()
@@ -71,8 +172,15 @@ def Create_Order(pair, amount, target=0.1, stoploss=0.0618):
     target   (opt) - Target to sell with a benefit (ratio, default=0.1)
     stoploss (opt) - Target to sell if market drops (ratio, default=0.0618)
     """
-    file_name = str(uuid.uuid4())+".xml"
-    file_path = os.path.join("data","in", file_name)
+    order_id = Get_Store().create(Build_Order(pair, amount, target, stoploss))
+    Log("Order %s created", order_id)
+    return order_id
+
+def Build_Order(pair, amount, target=0.1, stoploss=0.0618):
+    """
+    Method to build the xml tree of a new order (see Create_Order for the 
+    parameters). It returns the XML root object.
+    """
     root = etree.Element("order")    
     etree.SubElement(root, "header", 
                      date=str(datetime.datetime.now()), pair=pair, 
@@ -82,81 +190,414 @@ def Create_Order(pair, amount, target=0.1, stoploss=0.0618):
     etree.SubElement(root, "entry")
     etree.SubElement(root, "action", countdown=str(DEFAULT_COUNTDOWN)) 
     etree.SubElement(root, "audit")
-    tree = etree.ElementTree(root)
-    tree.write(file_path)
-    Log("Order "+file_name+" created")
+    return root
+
+def Create_Orders(orders, batch_size=None):
+    """
+    Method to create a batch of orders. The orders are validated against the
+    trade pairs of the exchange (known pair, open market, amount over the 
+    minimum trade with the stoploss), the valid ones are written by chunks 
+    of [batch_size] orders at once (see store.OrderStore.create_many). The
+    orders are read one chunk at a time, a generator is never held in 
+    memory. It returns a dictionnary: "created" (number of orders created) 
+    and "rejected" (list of (position, reason) of the invalid orders).
+    Parameters:
+    orders     (req) - Iterable of dictionnaries with the pair, amount and 
+                       optionally the target and stoploss (ratios)
+    batch_size (opt) - Orders written at once (default=BATCH_SIZE)
+    """
+    order_store = Get_Store()
+    registry = Get_Trade_Pairs()
+    batch_size = batch_size or BATCH_SIZE
+    result = {"created": 0, "rejected": []}
+    roots = []
+    for position, order in enumerate(orders):
+        try:
+            root = Check_Order(registry, order)
+        except (KeyError, TypeError, ValueError) as e:
+            result["rejected"].append((position, str(e)))
+            continue
+        roots.append(root)
+        if len(roots) >= batch_size:
+            result["created"] += len(order_store.create_many(roots))
+            roots = []
+    if roots:
+        result["created"] += len(order_store.create_many(roots))
+    Log("Orders created : %s, rejected : %s", 
+        result["created"], len(result["rejected"]))
+    return result
+
+def Check_Order(registry, order):
+    """
+    Method to validate an order of a batch (see Create_Orders). It returns 
+    the XML root object of the order, raises a ValueError if it is invalid.
+    Parameters:
+    registry (req) - Registry of the trade pairs (see Get_Trade_Pairs)
+    order    (req) - Dictionnary with the pair, amount, target and stoploss
+    """
+    pair = str(order["pair"]).strip().replace("/", "_")
+    amount = float(order["amount"])
+    target = float(order.get("target") or 0.1)
+    stoploss = float(order.get("stoploss") or 0.0618)
+    item = registry.get(pair)
+    if item is None:
+        raise ValueError("unknown pair " + pair)
+    if item.status not in (None, "OK"):
+        raise ValueError("market " + pair + " is " + str(item.status))
+    if not all(math.isfinite(value) for value in (amount, target, stoploss)):
+        raise ValueError("amount, target and stoploss must be finite")
+    if target <= 0 or not 0 < stoploss < 1:
+        raise ValueError("invalid target or stoploss")
+    # the entry buys at least the minimum trade less the stoploss
+    if amount*(1-stoploss) < item.minimum:
+        raise ValueError('amount {:.8f} under the minimum {:.8f}'.format(
+                amount, item.minimum/(1-stoploss)))
+    return Build_Order(pair, amount, target, stoploss)
+
+def Read_Orders(file_path):
+    """
+    Method to read the orders of a file, one at a time (generator of 
+    dictionnaries): csv with a header line (pair,amount,target,stoploss),
+    json list of objects, or json lines (.jsonl, one object per line).
+    Parameters:
+    file_path (req) - Path of the file
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    with open(file_path, newline="") as f:
+        if extension == ".json":
+            for order in json.load(f):
+                yield order
+        elif extension == ".jsonl":
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for order in csv.DictReader(f):
+                yield order
+
+def Import_Orders(file_path, batch_size=None):
+    """
+    Method to create the orders of a file (see Read_Orders and 
+    Create_Orders). Parameters:
+    file_path  (req) - Path of the csv, json or json lines file
+    batch_size (opt) - Orders written at once (default=BATCH_SIZE)
+    """
+    return Create_Orders(Read_Orders(file_path), batch_size)
 
 def Execute_Pipeline():
     """
     Method to execute all orders in the pipline. 
     No parameters 
     """
-    global CACHE
-    CACHE = {}
+    Setup_Logs()
+    Setup_Recorder()
+    Load_Cache()
     machine_name = platform.node()
     Log(machine_name)
     Log(str(datetime.datetime.now()))
     Log("-----------------------------")
     Feed_Pipeline()
-    for name in os.listdir(os.path.join("data","work")):
-        Log("Order " + name )
+    start = time.perf_counter()
+    Log("markets : %s", MARKETS.refresh())
+    BALANCES.invalidate()
+    Recover_Journal()
+    names = Get_Store().list("work")
+    quiet = Get_Quiet_Orders(names)
+    steps = ["action"]*len(quiet)
+    for name in names:
+        if name in quiet:
+            continue
+        Log("Order %s", name)
         Log("-----------------------------start")
         try:
-            Execute_Order(name)
+            steps.append(Execute_Tracked_Order(name) or "done")
         except Exception as e:
-            Log("ERROR Pipline : "+str(e)+"")
+            steps.append("error")
+            Log_Error("Pipline : %s", e)
         Log("-----------------------------done")
+    Flush_Trades()
+    Sync_State()
+    Publish_Metrics(steps, time.perf_counter() - start)
+    Save_Active_Orders()
+    Save_Cache()
+    Log_Spans()
     Log(str(datetime.datetime.now()))
+    logger.Flush()
+
+def Execute_Pipeline_Async(concurrency=None):
+    """
+    Method to execute all orders in the pipline concurrently. Each order runs
+    in its own thread, so the waits of an order (Wait) don't block the other
+    ones and a tick lasts about as long as the slowest order. Orders on the 
+    same pair are executed one after the other. Parameters :
+    concurrency (opt) - Maximum orders in progress (default=CONCURRENCY)
+    """
+    Setup_Logs()
+    Setup_Recorder()
+    Load_Cache()
+    machine_name = platform.node()
+    Log(machine_name)
+    Log(str(datetime.datetime.now()))
+    Log("-----------------------------")
+    Feed_Pipeline()
+    start = time.perf_counter()
+    Log("markets : %s", MARKETS.refresh())
+    BALANCES.invalidate()
+    Recover_Journal()
+    names = Get_Store().list("work")
+    quiet = Get_Quiet_Orders(names)
+    names = [name for name in names if name not in quiet]
+    steps = asyncio.run(Run_Orders_Async(names, concurrency or CONCURRENCY))
+    Flush_Trades()
+    Sync_State()
+    Publish_Metrics(steps + ["action"]*len(quiet), 
+                    time.perf_counter() - start)
+    Save_Active_Orders()
+    Save_Cache()
+    Log_Spans()
+    Log(str(datetime.datetime.now()))
+    logger.Flush()
+
+async def Run_Orders_Async(names, concurrency):
+    """
+    Coroutine running the given orders, at most [concurrency] at a time. It
+    returns the steps executed (see Execute_Order, "done" when the order has
+    left the pipeline, "error" when it failed).
+    names       (req) - Ids of the orders
+    concurrency (req) - Maximum orders in progress
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    locks = {}
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency) as executor:
+        async def run(name):
+            try:
+                pair = Get_Order_Pair(name)
+            except Exception as e:
+                Log_Error("Pipline : %s", e)
+                return "error"
+            lock = locks.setdefault(pair, asyncio.Lock())
+            async with lock, semaphore:
+                Log("Order %s -----------------------------start", name)
+                try:
+                    step = await loop.run_in_executor(
+                            executor, Execute_Tracked_Order, name)
+                    step = step or "done"
+                except Exception as e:
+                    step = "error"
+                    Log_Error("Pipline : %s", e)
+                Log("Order %s -----------------------------done", name)
+                return step
+        return await asyncio.gather(*[run(name) for name in names])
+
+def Get_Order_Pair(order_id):
+    """
+    Method to read the pair of an order in the pipeline. Parameters:
+    order_id (req) - Id of the order in the store
+    """
+    return Get_Store().get_pair(order_id)
 
 def Feed_Pipeline():
     """
     Method to add a created order to the pipline. 
     No parameters 
     """
-    for name in os.listdir(os.path.join(DATA_PATH, "in")):
-        source_file_path = os.path.join(DATA_PATH, "in", name)
-        destination_file_name = str(uuid.uuid4()) + ".xml"
-        destination_file_path = os.path.join(DATA_PATH, "work", 
-                                             destination_file_name)
-        os.rename(source_file_path, destination_file_path)
-        Log("new order " + destination_file_name)
-        Log(" from file : " + name)
+    order_store = Get_Store()
+    order_ids = order_store.feed_batches()
+    if order_ids:
+        Log("new orders %s (batches)", len(order_ids))
+    for name in order_store.list("in"):
+        order_id = order_store.feed(name)
+        Log("new order %s", order_id)
+        Log(" from : %s", name)
 
-def Execute_Order(filename):
+def Execute_Order(order_id, root=None):
     """
-    Method to execute a give order. The parameter are:
-    filename (req) - Name of the xml file containing the order parameters
+    Method to execute a give order. It returns the step executed ("entry", 
+    "action", "audit") or None when the order leaves the pipeline. 
+    The parameter are:
+    order_id (req) - Id of the order in the store
+    root     (opt) - XML root object of the order if already loaded
     """
-    file_path = os.path.join(DATA_PATH, "work",filename)
-    tree = etree.parse(file_path)
-    root = tree.getroot()
+    if order_id in UNRESOLVED:
+        raise Exception("trade of the journal not settled")
+    order_store = Get_Store()
+    if root is None:
+        root = order_store.load(order_id)
     header = Get_Child_By_Name(root, "header")
-    Log("pair : " + header.get("pair"))
+    with logger.Context(order_id=order_id, pair=header.get("pair")):
+        return Execute_Steps(order_store, order_id, root, header)
+
+def Execute_Tracked_Order(order_id):
+    """
+    Method to execute an order (see Execute_Order) and keep the active orders
+    (ACTIVE) up to date with its new state. Parameters:
+    order_id (req) - Id of the order in the store
+    """
+    if ACTIVE is None:
+        return Execute_Order(order_id)
+    root = Get_Store().load(order_id)
+    try:
+        step = Execute_Order(order_id, root)
+    except Exception:
+        # checked again at the next tick, from the store
+        ACTIVE.remove(order_id)
+        raise
+    ACTIVE.update(order_id, root)
+    return step
+
+def Get_Quiet_Orders(names):
+    """
+    Method to get the active orders with nothing to do at this tick: price 
+    over the stoploss, no countdown, currency not sold yet. All the active 
+    orders are checked at once against the market snapshot and the balance 
+    book (see evaluator.py). With NETTING, the currency is shared by the 
+    orders of the market: all the orders are checked (target sells filled).
+    Parameters:
+    names    (req) - Ids of the orders in the pipeline
+    """
+    if ACTIVE is None or NETTING:
+        return set()
+    Load_Active_Orders()
+    ACTIVE.keep(names)
+    def price(pair):
+        try:
+            return float(Get_Market(pair)["LastPrice"])
+        except Exception:
+            return None
+    def total(currency):
+        Balance = BALANCES.get(currency)
+        return float(Balance["Total"]) if Balance is not None else None
+    due = ACTIVE.evaluate(price, total)
+    quiet = set(ACTIVE.ids) - set(due)
+    Log("active orders : %s quiet / %s due", len(quiet), len(due))
+    return quiet
+
+def Load_Active_Orders():
+    """
+    Method to load the active orders saved by the previous run (if none are
+    known yet). No parameters.
+    """
+    if ACTIVE is not None and not len(ACTIVE):
+        ACTIVE.load(os.path.join(DATA_PATH, ACTIVE_FILE))
+
+def Save_Active_Orders():
+    """
+    Method to save the active orders for the next run. No parameters.
+    """
+    if ACTIVE is None:
+        return
+    try:
+        ACTIVE.save(os.path.join(DATA_PATH, ACTIVE_FILE))
+    except OSError as e:
+        Log_Error("Active orders : %s", e)
+
+def Clear_Active_Orders():
+    """
+    Method to forget the active orders (ie: the orders are executed by the 
+    scheduler or the worker processes, which don't keep them). No parameters.
+    """
+    if ACTIVE is None:
+        return
+    ACTIVE.clear()
+    file_path = os.path.join(DATA_PATH, ACTIVE_FILE)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+def Execute_Steps(order_store, order_id, root, header):
+    """
+    Method to execute the current step of an order (see Execute_Order). The
+    parameter are:
+    order_store (req) - Store of the orders
+    order_id    (req) - Id of the order in the store
+    root        (req) - XML root object of the order
+    header      (req) - Header xml object of the order
+    """
+    Log("pair : %s", header.get("pair"))
     if header.get("status") in (None, "", "init") :
         header.set("status", "ready")
     entry = Get_Child_By_Name(root, "entry")
     if (entry.get("status") != "ready"):
         Log("step - entry")
-        Execute_Entry(header, entry)
-        tree.write(file_path)
+        with logger.Span("entry", stage="entry", 
+                         status=entry.get("status") or "init"):
+            Execute_Entry(header, entry)
+        Save_Order(order_store, order_id, root)
         return "entry"
     action = Get_Child_By_Name(root, "action")
     if (action.get("status") != "ready"):
         Log("step - action")
-        Execute_Action(header, entry, action)
-        tree.write(file_path)
+        with logger.Span("action", stage="action", 
+                         status=action.get("status") or "init"):
+            Execute_Action(header, entry, action)
+        Save_Order(order_store, order_id, root)
         return "action"
     audit = Get_Child_By_Name(root, "audit")
     if (audit.get("status") != "ready"):
         Log("step - audit")
-        Execute_Audit(header, entry, action, audit)
-        tree.write(file_path)
+        with logger.Span("audit", stage="audit", 
+                         status=audit.get("status") or "init"):
+            Execute_Audit(header, entry, action, audit)
+        Save_Order(order_store, order_id, root)
         return "audit"
     ## Pipeline completed = order backed up
-    os.rename(os.path.join("data","work",filename), 
-              os.path.join("data","bak", filename))
+    Save_Order(order_store, order_id, root, "bak")
     Log(" has been sent out of pipeline")
 
+def Save_Order(order_store, order_id, root, stage=None):
+    """
+    Method to save an order after a step. The trades sent during the step are
+    done in the journal once the orders saved are synced (see Sync_State).
+    The parameter are:
+    order_store (req) - Store of the orders
+    order_id    (req) - Id of the order in the store
+    root        (req) - XML root object of the order
+    stage       (opt) - Stage the order is moved to
+    """
+    order_store.save(order_id, root, stage)
+    Get_Journal().order_saved(order_id)
+
+def Get_Store():
+    """
+    Method to get the store of the orders. By default the orders are xml 
+    files in the DATA_PATH folders. No parameters.
+    """
+    global STORE
+    if STORE is None:
+        STORE = store.XmlOrderStore(DATA_PATH)
+    return STORE
+
+def Get_Ledger():
+    """
+    Method to get the ledger of the trades of the account (see ledger.py),
+    a SQLite database in the DATA_PATH folder. No parameters.
+    """
+    global LEDGER
+    if LEDGER is None:
+        LEDGER = ledger.TradeLedger(os.path.join(DATA_PATH, LEDGER_FILE))
+    return LEDGER
+
+def Get_Journal():
+    """
+    Method to get the write-ahead journal of the trades sent (see journal.py),
+    a file in the DATA_PATH folder. No parameters.
+    """
+    global JOURNAL
+    if JOURNAL is None:
+        JOURNAL = journal.Journal(os.path.join(DATA_PATH, JOURNAL_FILE))
+    return JOURNAL
+
+def Set_Store(order_store):
+    """
+    Method to change the store of the orders, ie: 
+    Set_Store(store.SqliteOrderStore(os.path.join(DATA_PATH, "orders.db")))
+    Existing xml orders can be copied with store.import_xml. Parameters:
+    order_store (req) - store.OrderStore object, None for the default one
+    """
+    global STORE
+    STORE = order_store
+
 def Get_Minimum_Trade_Amount(pair):
     """
     Method to calculate The minimum amount for an order of a given trade pair.
@@ -164,25 +605,632 @@ def Get_Minimum_Trade_Amount(pair):
     Parameters :
     pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
     """
-    minimumtradepair = 0.0005000
-    Output = Get_Cache("GetTradePairs", "")
-    for data in Output["Data"]:
-        if data["Label"]==pair.replace("_", "/"):
-            minimumtradepair = float(data["MinimumBaseTrade"])
-    minimumtradepair = minimumtradepair*(PHI)+0.00000001
-    Log("minimumtradepair: "+'{:.8f}'.format(minimumtradepair))
+    minimumtradepair = Get_Trade_Pairs().minimum(pair)
+    Log("minimumtradepair: %.8f", minimumtradepair)
     return minimumtradepair
 
+def Get_Trade_Pairs():
+    """
+    Method to get the registry of the trade pairs of the exchange. It is built
+    again only when the GetTradePairs data in cache changes. No parameters.
+    """
+    global PAIRS
+    Output = Get_Cache("GetTradePairs", "")
+    if PAIRS is None or PAIRS.source is not Output:
+        registry = market.TradePairRegistry(Output["Data"], PHI)
+        registry.source = Output
+        PAIRS = registry
+    return PAIRS
+
+def Get_Pair_Id(pair):
+    """
+    Method to get the TradePairId of a pair. Parameters:
+    pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
+    """
+    item = Get_Trade_Pairs().get(pair)
+    if item is None:
+        return Get_Market(pair)["TradePairId"]
+    return item.pairid
+
+def Get_Currency(pair):
+    """
+    Method to get the currency traded on a pair ("XMR" for "XMR_BTC"). 
+    Parameters:
+    pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
+    """
+    item = Get_Trade_Pairs().get(pair)
+    if item is None:
+        return pair[:pair.index('_')]
+    return item.symbol
+
+def Get_Balance(currency):
+    """
+    Method to get the balance of a currency from the balance book (loaded 
+    once per tick with a single GetBalance call). Parameters:
+    currency (req) - Currency symbol ("XMR")
+    """
+    Balance = BALANCES.get(currency)
+    if Balance is None:
+        raise Exception("balances not available")
+    return Balance
+
+def Submit_Trade(pairid, tradetype, rate, amount, state=None, 
+                 netted=False):
+    """
+    Method to submit a trade and report it to the balance book. Parameters:
+    pairid    (req) - TradePairId of the market
+    tradetype (req) - "Buy" or "Sell"
+    rate      (req) - Price of the trade
+    amount    (req) - Amount to trade
+    state     (opt) - Attributes of the step of the order once the trade is
+                      sent, restored by Recover_Journal after a crash
+    netted    (opt) - Trade at the market price of the order, sent with the
+                      trades of the market at the end of the tick if NETTING
+                      (see Flush_Trades)
+    """
+    if netted and NETTING:
+        DESK.add(logger.CONTEXT.get().get("order_id"), pairid, tradetype, 
+                 rate, amount)
+        return {"Success": True, "Error": None, "Netted": True,
+                "Data": {"OrderId": None, "FilledOrders": []}}
+    Output = Journal_Query("SubmitTrade", {'TradePairId':pairid, 
+                                           'Type':tradetype, 
+                                           'Rate':rate, 'Amount':amount},
+                           state)
+    Report_Trade(pairid, tradetype, rate, amount, Output)
+    return Output
+
+def Report_Trade(pairid, tradetype, rate, amount, Output):
+    """
+    Method to report a trade sent to the balance book (see Submit_Trade for
+    the parameters, Output is the response of the api).
+    """
+    if NETTING:
+        DESK.changed(pairid)
+        if Output and Output.get("Success"):
+            DESK.placed(pairid, (Output.get("Data") or {}).get("OrderId"))
+    item = Get_Trade_Pairs().get_by_id(pairid)
+    if item is None:
+        BALANCES.invalidate()
+    else:
+        BALANCES.trade_sent(item.symbol, item.base_symbol, tradetype, 
+                            rate, amount, Output)
+
+def Cancel_Trade(pairid):
+    """
+    Method to cancel the trades of a market and report it to the balance book.
+    With NETTING, the market is cancelled once per tick (the cancel removes
+    the trades of all its orders, settled with the open orders read before
+    the cancel, see Check_Trades and Flush_Trades). Parameters:
+    pairid    (req) - TradePairId of the market
+    """
+    def send():
+        Output = Journal_Query("CancelTrade", {'Type':'TradePair', 
+                                               'TradePairId':pairid})
+        BALANCES.trade_cancelled(Output)
+        return Output
+    if NETTING:
+        return DESK.cancel(pairid, send, lambda: Get_Open_Orders(pairid))
+    return send()
+
+def Get_Open_Orders(pairid):
+    """
+    Method to get the open orders of a market (read once per tick with 
+    NETTING). Parameters:
+    pairid    (req) - TradePairId of the market
+    """
+    def fetch():
+        Output = api.query("GetOpenOrders", {'TradePairId':pairid})
+        return Output["Data"]
+    if NETTING:
+        return DESK.get_open_orders(pairid, fetch)
+    return fetch()
+
+def Get_Holding(currency, entry, field="Total"):
+    """
+    Method to get the amount of currency held for an order: the balance of 
+    the currency, or the share of the order (entry "quantity") with NETTING.
+    Parameters:
+    currency (req) - Currency symbol ("XMR")
+    entry    (req) - Entry xml object of the order
+    field    (opt) - Field of the balance ("Total" or "Available")
+    """
+    amount = float(Get_Balance(currency)[field])
+    if NETTING:
+        return min(amount, float(entry.get("quantity") or 0.0))
+    return amount
+
+def Journal_Query(method, req, state=None):
+    """
+    Method to call the api for a trade (a side effect on the exchange). The
+    call is written in the journal before it is sent, then its response.
+    Parameters:
+    method   (req) - api method called ("SubmitTrade", "CancelTrade")
+    req      (req) - Dictionnary of parameters to pass to the api
+    state    (opt) - Attributes of the step of the order once the call has
+                     reached the exchange (None if the step can run again)
+    """
+    context = logger.CONTEXT.get()
+    trade_journal = Get_Journal()
+    call_id = trade_journal.intent(method, req, context.get("order_id"), 
+                                   context.get("stage"), 
+                                   context.get("status"), state)
+    Output = api.query(method, req)
+    trade_journal.sent(call_id, Output)
+    return Output
+
+def Recover_Journal():
+    """
+    Method to settle the trades of the journal sent without the order saved
+    after (ie: crash during a step). A trade without response is checked 
+    against the open orders of the exchange (GetOpenOrders). When the trade
+    has reached the exchange and the order is still at the step of the trade,
+    the step is moved to the state it has once the trade sent, so the trade 
+    is not sent twice. A trade the recovery cannot settle (exchange not 
+    available, trade history ambiguous) stays pending and its order is not
+    executed (UNRESOLVED). The journal is read at the first call, then only 
+    if some trades are not settled (and written again without the trades 
+    settled when it grows over journal.COMPACT_SIZE). No parameters.
+    """
+    trade_journal = Get_Journal()
+    if trade_journal.checked and not trade_journal.unsettled() and \
+            not UNRESOLVED:
+        if trade_journal.size() > journal.COMPACT_SIZE:
+            trade_journal.compact()
+        return 0
+    try:
+        calls = trade_journal.pending()
+    except OSError as e:
+        Log_Error("Journal : %s", e)
+        return 0
+    order_store = Get_Store()
+    exchange = {}
+    unresolved = set()
+    for call in calls:
+        try:
+            event = Recover_Call(order_store, call, exchange)
+        except Exception as e:
+            # checked again at the next recovery
+            Log_Error("Journal : %s %s", call["id"], e)
+            if call.get("order") is not None:
+                unresolved.add(call["order"])
+            continue
+        trade_journal.settle(call["id"], event)
+    UNRESOLVED.clear()
+    UNRESOLVED.update(unresolved)
+    trade_journal.sync()
+    trade_journal.compact()
+    trade_journal.checked = True
+    return len(calls)
+
+def Recover_Call(order_store, call, exchange):
+    """
+    Method to settle a trade of the journal (see Recover_Journal). It returns
+    the event settling the trade: "recovered" (the trade has reached the 
+    exchange) or "aborted". Parameters:
+    order_store (req) - Store of the orders
+    call        (req) - Call of the journal (see journal.Journal.read)
+    exchange    (req) - Dictionnary (method, TradePairId) -> "Data" of the
+                        open orders and trade history, ("claimed", 
+                        TradePairId) -> ids of the open orders and trades 
+                        matched by a call, filled here
+    """
+    req = call["params"]
+    orderid = None
+    if call["event"] == "sent":
+        Output = call.get("output")
+        sent = bool(Output) and bool(Output.get("Success"))
+        if sent:
+            orderid = (Output.get("Data") or {}).get("OrderId")
+    elif call["method"] == "SubmitTrade":
+        pairid = req["TradePairId"]
+        claimed = exchange.setdefault(("claimed", pairid), set())
+        open_orders = Recovery_Query(exchange, "GetOpenOrders", 
+                                     {'TradePairId':pairid})
+        item = Find_Open_Trade(req, open_orders, claimed)
+        sent = item is not None
+        if sent:
+            orderid = item.get("OrderId")
+        else:
+            # a trade filled at once has left the open orders
+            history = Recovery_Query(exchange, "GetTradeHistory", 
+                                     {'TradePairId':pairid, 
+                                      'Count':RECOVERY_HISTORY})
+            sent = Find_Trade(req, call["time"], history, claimed)
+    else:
+        # a cancel can be sent again
+        sent = False
+    Log("journal : %s %s %s", call["method"], call.get("order"), 
+        "sent" if sent else "not sent")
+    state = call.get("state") or {}
+    if call.get("order") is None and "shares" in state:
+        # netted trade (see Flush_Pair): the crossed amounts are allocated 
+        # to the orders even if the trade has not reached the exchange
+        net_trade = None
+        if sent:
+            open_orders = []
+            if orderid is not None:
+                # the rest of the trade is in the order book
+                open_orders = Recovery_Query(exchange, "GetOpenOrders", 
+                                        {'TradePairId':req["TradePairId"]})
+            net_trade = Get_Net_Trade(req, open_orders, orderid)
+        Allocate_Net_Trade(order_store, state["crossed"], state["shares"], 
+                           net_trade, call["id"])
+        order_store.sync()
+        return "recovered" if sent else "aborted"
+    if not sent:
+        return "aborted"
+    if call.get("order") is None or call.get("state") is None:
+        return "recovered"
+    try:
+        root = order_store.load(call["order"])
+    except (KeyError, OSError):
+        return "recovered"
+    if store.order_status(root) != call["stage"] + ":" + call["status"]:
+        # the order was saved after the trade
+        return "recovered"
+    element = Get_Child_By_Name(root, call["stage"])
+    for name, value in call["state"].items():
+        element.set(name, value)
+    order_store.save(call["order"], root)
+    order_store.sync()
+    Log("journal : order %s restored to %s", call["order"], 
+        store.order_status(root))
+    return "recovered"
+
+def Recovery_Query(exchange, method, req):
+    """
+    Method to call the api once per recovery for a market (see Recover_Call).
+    It returns the "Data" of the response. Parameters:
+    exchange (req) - Dictionnary (method, TradePairId) -> "Data", filled here
+    method   (req) - api method called ("GetOpenOrders", "GetTradeHistory")
+    req      (req) - Dictionnary of parameters with the TradePairId
+    """
+    key = (method, req["TradePairId"])
+    if key not in exchange:
+        Output = api.query(method, req)
+        if not Output or not Output.get("Success"):
+            raise Exception(method + " not available")
+        exchange[key] = Output["Data"] or []
+    return exchange[key]
+
+def Find_Open_Trade(req, open_orders, claimed):
+    """
+    Method to find the open order of a trade sent: same type, rate and 
+    amount, not matched by another call (its OrderId is added to claimed).
+    It returns the open order, None if not found. Parameters:
+    req         (req) - Parameters of the SubmitTrade call
+    open_orders (req) - "Data" of GetOpenOrders for the market
+    claimed     (req) - Ids of the open orders and trades already matched
+    """
+    for item in open_orders:
+        key = ("order", item.get("OrderId"))
+        if key in claimed or item["Type"] != req["Type"]:
+            continue
+        if abs(float(item["Rate"]) - float(req["Rate"])) < 1e-8 and \
+                abs(float(item["Amount"]) - float(req["Amount"])) < 1e-8:
+            claimed.add(key)
+            return item
+    return None
+
+def Find_Trade(req, since, history, claimed):
+    """
+    Method to find the trades of the history filled by a trade sent after a
+    time: same type, at the limit price or better, not matched by another 
+    call. It returns True if a trade of the amount (or trades summing to the
+    amount) is found, False if none can be, and raises an exception when 
+    the trades found can't be told from the trades of other orders. The 
+    trades matched are added to claimed. Parameters:
+    req      (req) - Parameters of the SubmitTrade call
+    since    (req) - Time the trade was written in the journal (time.time())
+    history  (req) - "Data" of GetTradeHistory for the market
+    claimed  (req) - Ids of the open orders and trades already matched
+    """
+    # the clock of the exchange is one hour behind (one minute of margin)
+    start = ledger.stamp(datetime.datetime.fromtimestamp(since) + 
+                         datetime.timedelta(hours=-1, minutes=-1))
+    rate = float(req["Rate"])
+    amount = float(req["Amount"])
+    found = []
+    for item in history:
+        if item["Type"] != req["Type"] or \
+                ("trade", item.get("TradeId")) in claimed or \
+                ledger.stamp(item["TimeStamp"]) < start or \
+                float(item["Amount"]) > amount + 1e-8:
+            continue
+        if req["Type"] == "Buy" and float(item["Rate"]) <= rate + 1e-8:
+            found.append(item)
+        if req["Type"] == "Sell" and float(item["Rate"]) >= rate - 1e-8:
+            found.append(item)
+    if not found:
+        return False
+    exact = [item for item in found 
+             if abs(float(item["Amount"]) - amount) < 1e-8]
+    if len(exact) == 1:
+        found = exact
+    if abs(sum(float(item["Amount"]) for item in found) - amount) > 1e-8:
+        raise Exception("trade history ambiguous")
+    for item in found:
+        claimed.add(("trade", item.get("TradeId")))
+    return True
+
+def Sync_State():
+    """
+    Method to sync the orders saved during the tick to the disk, then to mark
+    their trades done in the journal. No parameters.
+    """
+    try:
+        Get_Store().sync()
+        Get_Journal().commit()
+    except Exception as e:
+        Log_Error("Sync : %s", e)
+
+def Flush_Trades():
+    """
+    Method to send the trades netted during the tick (see netting.py): one 
+    trade per market for the net amount of its orders, allocated back to the
+    orders (entry "quantity") as it is filled. The trades of the orders of 
+    the markets cancelled in the tick are settled with the open orders read 
+    before the cancel, their target sells are placed again. It returns the 
+    set of the ids of the orders modified (to load again). No parameters.
+    """
+    if not NETTING:
+        return set()
+    modified = set()
+    try:
+        order_store = Get_Store()
+        for pairid in DESK.pairs():
+            try:
+                modified.update(Flush_Pair(order_store, pairid))
+            except Exception as e:
+                Log_Error("Netting : %s %s", pairid, e)
+        if DESK.cancelled():
+            modified.update(Settle_Cancelled(order_store, DESK.cancelled()))
+        order_store.sync()
+    finally:
+        DESK.clear()
+    return modified
+
+def Flush_Pair(order_store, pairid):
+    """
+    Method to send the net trade of a market and to allocate it to the orders
+    (see Flush_Trades): the crossed amounts and the part filled at once. The
+    orders keep the rest of the net trade in the order book (see 
+    Check_Trades). The trade is written in the journal with the crossed 
+    amounts and the shares of the orders, to allocate them after a crash 
+    (see Recover_Call). It returns the ids of the orders allocated. 
+    Parameters:
+    order_store (req) - Store of the orders
+    pairid      (req) - TradePairId of the market
+    """
+    net = DESK.net(pairid)
+    item = Get_Trade_Pairs().get_by_id(pairid)
+    minimum = item.minimum if item else market.DEFAULT_MINIMUM
+    amount = float('{:.8f}'.format(net["amount"]))
+    crossed = DESK.allocate(pairid, 0.0)
+    shares = DESK.shares(pairid)
+    Log("netting : %s buy %.8f sell %.8f crossed %.8f", 
+        pairid, net["buy"], net["sell"], net["crossed"])
+    if net["type"] is None or amount*net["rate"] < minimum:
+        # nothing to send: only the crossed amounts change hands
+        return Allocate_Net_Trade(order_store, crossed, {}, None)
+    req = {'TradePairId':pairid, 'Type':net["type"], 
+           'Rate':net["rate"], 'Amount':amount}
+    trade_journal = Get_Journal()
+    call_id = trade_journal.intent("SubmitTrade", req, state={
+            "crossed": crossed, "shares": shares})
+    Output = api.query("SubmitTrade", req)
+    trade_journal.sent(call_id, Output)
+    Log("%s %s %.8f @ %.8f", net["type"], pairid, amount, net["rate"])
+    Log(Output)
+    Report_Trade(pairid, net["type"], net["rate"], amount, Output)
+    net_trade = None
+    if Output and Output.get("Success"):
+        orderid = (Output.get("Data") or {}).get("OrderId")
+        open_orders = None
+        if orderid is not None:
+            try:
+                open_orders = Get_Open_Orders(pairid)
+            except Exception as e:
+                Log_Error("Netting : %s %s", pairid, e)
+        net_trade = Get_Net_Trade(req, open_orders, orderid)
+    modified = Allocate_Net_Trade(order_store, crossed, shares, net_trade, 
+                                  call_id)
+    order_store.sync()
+    trade_journal.settle(call_id, "done")
+    return modified
+
+def Get_Net_Trade(req, open_orders, orderid=None):
+    """
+    Method to get the state of a net trade sent: a dictionnary with the id of
+    its rest in the order book ("orderid", None if filled), its "amount" and
+    the amount "filled". Parameters:
+    req         (req) - Parameters of the SubmitTrade call
+    open_orders (req) - Open orders of the market (None if unknown)
+    orderid     (opt) - OrderId of the trade (None: filled at once)
+    """
+    amount = float(req["Amount"])
+    for item in open_orders or []:
+        if orderid is not None and str(item.get("OrderId")) == str(orderid):
+            return {"orderid": str(item.get("OrderId")), "amount": amount,
+                    "filled": amount - float(item["Remaining"])}
+    if orderid is not None and open_orders is None:
+        # nothing filled until the open orders are read (see Check_Trades)
+        return {"orderid": str(orderid), "amount": amount, "filled": 0.0}
+    return {"orderid": None, "amount": amount, "filled": amount}
+
+def Allocate_Net_Trade(order_store, crossed, shares, net_trade, call_id=None):
+    """
+    Method to allocate a net trade to the orders of a market. It returns the
+    ids of the orders allocated. Parameters:
+    order_store (req) - Store of the orders
+    crossed     (req) - Dictionnary order id -> amount crossed (positive 
+                        bought, negative sold)
+    shares      (req) - Dictionnary order id -> share of the net trade
+    net_trade   (req) - State of the net trade (see Get_Net_Trade), None if 
+                        not sent
+    call_id     (opt) - Id of the trade in the journal
+    """
+    modified = set()
+    for order_id in set(crossed) | set(shares):
+        quantity = crossed.get(order_id, 0.0)
+        share = shares.get(order_id, 0.0)
+        if net_trade is not None:
+            quantity += share*net_trade["filled"]
+        else:
+            share = 0.0
+        try:
+            if Allocate_Order(order_store, order_id, quantity, call_id, 
+                              share, net_trade):
+                modified.add(order_id)
+        except Exception as e:
+            Log_Error("Netting : %s %s", order_id, e)
+    return modified
+
+def Allocate_Order(order_store, order_id, quantity, call_id=None, share=0.0,
+                   net_trade=None):
+    """
+    Method to add the amount allocated by a netted trade to the share of an 
+    order (entry "quantity"). The id of the trade is kept in the entry, so a
+    trade is allocated once. While the net trade is in the order book, the 
+    order keeps its id, its share, its amount and the amount already filled
+    (entry "netorder", "netshare", "netamount", "netfilled"). Parameters:
+    order_store (req) - Store of the orders
+    order_id    (req) - Id of the order in the store
+    quantity    (req) - Amount allocated (positive bought, negative sold)
+    call_id     (opt) - Id of the trade in the journal
+    share       (opt) - Share of the order in the net trade
+    net_trade   (opt) - State of the net trade (see Get_Net_Trade)
+    """
+    root = order_store.load(order_id)
+    entry = Get_Child_By_Name(root, "entry")
+    if call_id is not None and entry.get("netted") == call_id:
+        return False
+    held = float(entry.get("quantity") or 0.0)
+    entry.set("quantity", '{:.8f}'.format(max(0.0, held + quantity)))
+    if call_id is not None:
+        entry.set("netted", call_id)
+    if share and net_trade is not None and net_trade["orderid"] is not None:
+        entry.set("netorder", net_trade["orderid"])
+        entry.set("netshare", repr(share))
+        entry.set("netamount", '{:.8f}'.format(net_trade["amount"]))
+        entry.set("netfilled", '{:.8f}'.format(net_trade["filled"]))
+    order_store.save(order_id, root)
+    return True
+
+def Settle_Cancelled(order_store, pairids):
+    """
+    Method to settle the trades of the orders of the markets cancelled in the
+    tick (CancelTrade by TradePair cancels the trades of all their orders), 
+    with the open orders read just before the cancel (see Settle_Trades): 
+    the amounts filled are allocated, the target sells are placed again. It 
+    returns the ids of the orders modified. Parameters:
+    order_store (req) - Store of the orders
+    pairids     (req) - TradePairId of the markets cancelled
+    """
+    modified = set()
+    for order_id in order_store.list("work"):
+        try:
+            root = order_store.load(order_id)
+            header = Get_Child_By_Name(root, "header")
+            pairid = Get_Pair_Id(header.get("pair"))
+            if pairid not in pairids:
+                continue
+            entry = Get_Child_By_Name(root, "entry")
+            action = Get_Child_By_Name(root, "action")
+            if Settle_Trades(entry, action, DESK.snapshot(pairid), True, 
+                             DESK.sent_after_cancel(pairid)):
+                order_store.save(order_id, root)
+                modified.add(order_id)
+        except Exception as e:
+            Log_Error("Netting : %s %s", order_id, e)
+    return modified
+
+def Check_Trades(pairid, entry, action=None):
+    """
+    Method to update the share of an order (NETTING) with its trades in the 
+    order book: the rest of a net trade (entry "netorder") and the target 
+    sell (action "orderid"). If the market has been cancelled in the tick, 
+    the open orders read just before the cancel are used. It returns True if
+    the order is modified. Parameters:
+    pairid    (req) - TradePairId of the market
+    entry     (req) - Entry xml object of the order
+    action    (opt) - Action xml object of the order
+    """
+    if pairid in DESK.cancelled():
+        return Settle_Trades(entry, action, DESK.snapshot(pairid), True, 
+                             DESK.sent_after_cancel(pairid))
+    if entry.get("netorder") is None and \
+            (action is None or action.get("orderid") is None):
+        return False
+    return Settle_Trades(entry, action, Get_Open_Orders(pairid), False)
+
+def Settle_Trades(entry, action, open_orders, cancelled, after=()):
+    """
+    Method to update the share of an order (entry "quantity") with the open
+    orders of its market (see Check_Trades): a trade which has left the open
+    orders is filled, the amount filled of a trade still open is its amount
+    less its "Remaining". After a cancel, the trades are forgotten and the 
+    target sell still held goes back to the sell status (unless the 
+    stoploss process is launched), the trades sent after the cancel are 
+    left as they are. It returns True if the order is modified. Parameters:
+    entry       (req) - Entry xml object of the order
+    action      (req) - Action xml object of the order (or None)
+    open_orders (req) - Open orders of the market (None if unknown)
+    cancelled   (req) - True if the market has been cancelled in the tick
+    after       (opt) - OrderId of the trades sent after the cancel
+    """
+    remaining = None
+    if open_orders is not None:
+        remaining = dict((str(item.get("OrderId")), float(item["Remaining"]))
+                         for item in open_orders)
+    held = float(entry.get("quantity") or 0.0)
+    modified = False
+    orderid = entry.get("netorder")
+    if orderid is not None and orderid not in after:
+        filled = float(entry.get("netfilled"))
+        if remaining is None:
+            # unknown: nothing more is counted as filled
+            now_filled = filled
+        elif orderid in remaining:
+            now_filled = float(entry.get("netamount")) - remaining[orderid]
+        else:
+            now_filled = float(entry.get("netamount"))
+        held = max(0.0, held + float(entry.get("netshare"))*
+                                (now_filled - filled))
+        entry.set("netfilled", '{:.8f}'.format(now_filled))
+        if cancelled or (remaining is not None and orderid not in remaining):
+            for name in ("netorder", "netshare", "netamount", "netfilled"):
+                del entry.attrib[name]
+        modified = True
+    target = None if action is None else action.get("orderid")
+    if target is not None and target not in after:
+        if remaining is not None and target in remaining:
+            # the rest of the target sell is still held
+            held = min(held, remaining[target])
+        elif remaining is not None:
+            Log("target sell %s filled", target)
+            held = 0.0
+        if cancelled or (remaining is not None and target not in remaining):
+            del action.attrib["orderid"]
+            countdown = action.get("countdown")
+            if cancelled and held > 0.0 and action.get("status") == "active" \
+                    and (countdown is None or int(countdown) > 0):
+                Log("netting : target sell placed again")
+                action.set("status", "sell")
+        modified = True
+    if modified:
+        entry.set("quantity", '{:.8f}'.format(held))
+    return modified
+
 def Check_Buy_Orders(pair):
     """
     Method to check if buy orders are existing for a given pair. Parameters:
     pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
     """
-    Output = Get_Cache("GetMarket", [pair])
-    pairid = Output["Data"]["TradePairId"]
-    Output = api.query("GetOpenOrders", {'TradePairId':pairid})
+    pairid = Get_Pair_Id(pair)
     buy_orders = False
-    for order_item in Output["Data"]:
+    for order_item in Get_Open_Orders(pairid):
         if order_item["Type"] == "Buy":
             buy_orders = True
     return buy_orders
@@ -198,47 +1246,66 @@ def Execute_Entry(header, entry):
     stoploss = float(header.get("stoploss"))
     if entry.get("status") in (None, "") :
         entry.set("status", "init")
+    if NETTING:
+        # share of the net trades filled since the last tick
+        Check_Trades(Get_Pair_Id(pair), entry)
 
     if (entry.get("status") == "init"):
         Log("status - init")
-        Output = api.query("GetMarket", [pair])
-        pairid = Output["Data"]["TradePairId"]
-        refprice = float(Output["Data"]["AskPrice"])
-        Log("ref price: "+'{:.8f}'.format(refprice))
+        Market = Get_Market(pair)
+        pairid = Get_Pair_Id(pair)
+        refprice = float(Market["AskPrice"])
+        Log("ref price: %.8f", refprice)
         baseamount = float(header.get("amount"))
-        Log("base amount : "+'{:.8f}'.format(baseamount))
-        amount = baseamount/refprice
-        Log("amount : "+'{:.8f}'.format(amount))
-        currency = pair[:pair.index('_')]
-        Output = api.query("GetBalance", {'Currency':currency})
-        if (Output["Data"] == None):
-            already = float(0.0)
+        Log("base amount : %.8f", baseamount)
+        currency = Get_Currency(pair)
+        already = Get_Holding(currency, entry)
+        Log("already : %.8f", already)
+        # price and amount from the depth of the order book (at the ask
+        # price for the full amount if the order book is not available)
+        plan = Get_Entry_Plan(pair, baseamount - already*refprice)
+        if plan is None:
+            buyprice = refprice
+            avgprice = refprice
+            amount = baseamount/refprice - already
+            remaining = 0.0
         else:
-            already = float(Output["Data"][0]["Total"])
-        Log("already : "+'{:.8f}'.format(already))
-        amount = amount - already
+            buyprice = plan["price"]
+            avgprice = plan["vwap"]
+            amount = plan["amount"]
+            remaining = plan["remaining"]
+            Log("depth : %.8f @ %.8f (avg %.8f), remaining %.8f", 
+                amount, buyprice, avgprice, remaining)
+        Log("amount : %.8f", amount)
         minimumtradepair = Get_Minimum_Trade_Amount(pair)*(1-stoploss)
-        minimumamount = float('{:.8f}'.format(minimumtradepair/refprice))
-        Log("minimumamount: "+'{:.8f}'.format(minimumamount))
+        minimumamount = float('{:.8f}'.format(minimumtradepair/buyprice))
+        Log("minimumamount: %.8f", minimumamount)
         if(amount<minimumamount):
             entry.set("status", "ready")
             entry.set("message", "amount too small")
             Log("....amount too small")
         else: 
             tradetype = 'Buy'
-            Output = api.query("SubmitTrade", {'TradePairId':pairid, 
-                                               'Type':tradetype, 
-                                               'Rate':refprice, 
-                                               'Amount':amount})
-            Log ("Buy ID : "+ str(pairid) + "  " + "{:.8f}".format(amount)+ 
-                 " @ " + '{:.8f}'.format(refprice) + " = " + 
-                 "{:.8f}".format(baseamount))
+            amount = float('{:.8f}'.format(amount))
+            # average price of all the slices bought
+            if already > 0 and entry.get("price") is not None:
+                avgprice = ((already*float(entry.get("price")) + 
+                             amount*avgprice)/(already + amount))
+            state = {"price": '{:.8f}'.format(avgprice), 
+                     "remaining": '{:.8f}'.format(remaining), 
+                     "status": "sent", "countdown": str(DEFAULT_COUNTDOWN)}
+            Output = Submit_Trade(pairid, tradetype, buyprice, amount, state, 
+                                  netted=True)
+            Log("Buy ID : %s  %.8f @ %.8f = %.8f", 
+                pairid, amount, buyprice, baseamount)
             Log(Output)
-            entry.set("price", '{:.8f}'.format(refprice))
-            entry.set("status", "sent")
-            entry.set("countdown", str(DEFAULT_COUNTDOWN))
-            Log ("sent")
-            time.sleep(8)
+            for name, value in state.items():
+                entry.set(name, value)
+            Log("sent")
+            if Output.get("Netted"):
+                # sent at the end of the tick (see Flush_Trades)
+                return
+            Wait(8)
 
     if (entry.get("status") == "sent"):
         Log("status - sent")
@@ -248,34 +1315,54 @@ def Execute_Entry(header, entry):
             minimumtradepair = Get_Minimum_Trade_Amount(pair)*(1-stoploss)
             price = float(entry.get("price"))
             minimumamount = float('{:.8f}'.format(minimumtradepair/price))
-            Log("minimumamount: "+'{:.8f}'.format(minimumamount))
-            currency = pair[:pair.index('_')]
-            Output = api.query("GetBalance", {'Currency':currency})
-            if (Output["Data"] == None):
-                available = float(0.0)
-            else:
-                available = float(Output["Data"][0]["Available"])
-            Log("available: "+'{:.8f}'.format(available))
+            Log("minimumamount: %.8f", minimumamount)
+            currency = Get_Currency(pair)
+            # the buy order has left the order book: balances have changed
+            BALANCES.invalidate()
+            available = Get_Holding(currency, entry, "Available")
+            Log("available: %.8f", available)
             countdown = 0
             if(available>=minimumamount):
                 countdown = DEFAULT_COUNTDOWN
                 Log("filled")
-                entry.set("status", "ready")
-        Log("countdown : "+str(countdown))
+                remaining = float(entry.get("remaining") or 0.0)
+                if (remaining > minimumtradepair):
+                    # depth too thin: next slice at the next tick
+                    Log("next slice : %.8f", remaining)
+                    entry.set("status", "init")
+                else:
+                    entry.set("status", "ready")
+        Log("countdown : %s", countdown)
         if (countdown > 0):
             countdown = countdown - 1
             entry.set("countdown", str(countdown))
         else:
             Log("retry")
             pair = header.get("pair")
-            Output = Get_Cache("GetMarket", [pair])
-            pairid = Output["Data"]["TradePairId"]
-            Output = api.query("CancelTrade", {'Type':'TradePair', 
-                                               'TradePairId':pairid})
+            pairid = Get_Pair_Id(pair)
+            Output = Cancel_Trade(pairid)
             Log(Output)
             Log("Cancel Trade")
             entry.set("status", "init")
     
+def Get_Entry_Plan(pair, baseamount):
+    """
+    Method to get the price and amount of a buy from the depth of the order
+    book (see market.entry_plan), None if the order book is not available.
+    Parameters:
+    pair       (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
+    baseamount (req) - Amount to spend (in YYY, ie in BTC)
+    """
+    try:
+        Output = Get_Cache("GetMarketOrders", [pair, ORDER_BOOK_DEPTH])
+        if not Output or not Output.get("Success"):
+            return None
+        return market.entry_plan(Output["Data"]["Sell"], baseamount, 
+                                 MAX_SLIPPAGE)
+    except Exception as e:
+        Log_Error("Order book : %s", e)
+        return None
+
 def Execute_Action(header, entry, action):
     """
     Method to handle the action stage of an order. It creates the target sell
@@ -290,6 +1377,10 @@ def Execute_Action(header, entry, action):
     pair = header.get("pair")
     if action.get("status") in (None, "") :
         action.set("status", "init")
+    if NETTING and action.get("status") == "active":
+        # trades filled since the last tick, target sell cancelled with its
+        # market placed again (see Settle_Trades)
+        Check_Trades(Get_Pair_Id(pair), entry, action)
 
     if (action.get("status") == "init"):
         Log("status - init")
@@ -310,18 +1401,21 @@ def Execute_Action(header, entry, action):
         price = float(entry.get("price"))
         target = float(action.get("target"))
         stoploss = float(action.get("stoploss"))
-        Output = Get_Cache("GetMarket", [pair])
-        pairid = Output["Data"]["TradePairId"]
+        pairid = Get_Pair_Id(pair)
         tradetype = 'Sell'
-        currency = pair[:pair.index('_')]
-        Output = api.query("GetBalance", {'Currency':currency})
-        amount = float(Output["Data"][0]["Total"])
-        Log(tradetype + " " + pair + " " + '{:.8f}'.format(amount) + 
-            " at " + '{:.8f}'.format(target))
-        Output = api.query("SubmitTrade", {'TradePairId':pairid, 
-                                           'Type':tradetype, 
-                                           'Rate':target, 'Amount':amount})
-        time.sleep(15)
+        currency = Get_Currency(pair)
+        amount = Get_Holding(currency, entry)
+        Log("%s %s %.8f at %.8f", tradetype, pair, amount, target)
+        state = dict(action.attrib, status="active")
+        Output = Submit_Trade(pairid, tradetype, target, amount, state)
+        if NETTING and Output and Output.get("Success"):
+            # the id of the target sell, to see it filled (see Check_Trades)
+            orderid = (Output.get("Data") or {}).get("OrderId")
+            if orderid is None:
+                entry.set("quantity", '{:.8f}'.format(0.0))
+            else:
+                action.set("orderid", str(orderid))
+        Wait(15)
         has_buy_orders = Check_Buy_Orders(pair)
         if not has_buy_orders :
             action.set("status", "active")
@@ -329,54 +1423,51 @@ def Execute_Action(header, entry, action):
     if (action.get("status") == "active"):
         Log("status - active")
         pair = header.get("pair")
-        currency = pair[:pair.index('_')]        
-        Output = Get_Cache("GetMarket", [pair])            
-        pairid = Output["Data"]["TradePairId"]
-        refprice = float(Output["Data"]["LastPrice"])
-        bidprice = float(Output["Data"]["BidPrice"])
+        currency = Get_Currency(pair)
+        Market = Get_Market(pair)
+        pairid = Get_Pair_Id(pair)
+        refprice = float(Market["LastPrice"])
+        bidprice = float(Market["BidPrice"])
         price = float(entry.get("price"))
         target = float(action.get("target"))
         stoploss = float(action.get("stoploss"))
         spacer = max(0, min(22, int(22*(refprice-stoploss)/(price-stoploss))))
         spacer += max(0, min(17, int(17*(refprice-price)/(target-price))))
-        Log(" "*spacer + "| last:"+'{:.8f}'.format(refprice))
-        Log("| stoploss:" + '{:.8f}'.format(stoploss) + 
-            " | buy:"+'{:.8f}'.format(price) + 
-            " | target:"+'{:.8f}'.format(target)+" |")
+        Log("%s| last:%.8f", " "*spacer, refprice)
+        Log("| stoploss:%.8f | buy:%.8f | target:%.8f |", 
+            stoploss, price, target)
         if (refprice <= stoploss):
             if (action.get("countdown") == None):
                 action.set("countdown", str(DEFAULT_COUNTDOWN))
             countdown = int(action.get("countdown"))
-            Log("stoploss countdown:" + str(countdown))
+            Log("stoploss countdown:%s", countdown)
             if (countdown <= 0):
                 Log("stoploss process launched")
                 #check minimum trade
                 minimumtradepair = Get_Minimum_Trade_Amount(pair)
                 minimumamount = minimumtradepair/bidprice
                 minimumamount = float('{:.8f}'.format(minimumamount))
-                Output = api.query("GetBalance", {'Currency':currency})
-                amount = float(Output["Data"][0]["Total"])
-                available = float(Output["Data"][0]["Available"])
-                Log("bidprice*amount:"+'{:.8f}'.format(bidprice*amount))
-                Log("available:"+'{:.8f}'.format(available))
+                amount = Get_Holding(currency, entry)
+                available = Get_Holding(currency, entry, "Available")
+                Log("bidprice*amount:%.8f", bidprice*amount)
+                Log("available:%.8f", available)
                 if (bidprice*amount > minimumtradepair):
-                    Output = api.query("CancelTrade", {'Type':'TradePair', 
-                                                       'TradePairId':pairid})
+                    Output = Cancel_Trade(pairid)
                     Log(Output)
-                    time.sleep(7)
+                    Wait(7)
+                    if NETTING:
+                        Check_Trades(pairid, entry, action)
                 else:
                     Log("trade not canceled")
-                Output = api.query("GetBalance", {'Currency':currency})
-                available = float(Output["Data"][0]["Available"])
-                print ("available:"+'{:.8f}'.format(available))
+                available = Get_Holding(currency, entry, "Available")
+                Log("available:%.8f", available)
                 if (available>minimumamount):
-                    Output = api.query("SubmitTrade", {'TradePairId':pairid, 
-                                                       'Type':'Sell', 
-                                                       'Rate':bidprice, 
-                                                       'Amount':available})
+                    Output = Submit_Trade(pairid, 'Sell', bidprice, available,
+                                          netted=True)
                     Log("Exit trade sent")
                     Log(Output)
-                    time.sleep(15)
+                    if not Output.get("Netted"):
+                        Wait(15)
                 else:
                     Log("trade not submitted")
             else:
@@ -388,14 +1479,12 @@ def Execute_Action(header, entry, action):
         price = float(entry.get("price"))
         baseamount = float(header.get("amount"))
         amount = baseamount/price
-        Output = api.query("GetBalance", {'Currency':currency})
-        if (Output["Data"] != []):
-            total = float(Output["Data"][0]["Total"])
-            if (total==0.0):
-                    action.set("status", "ready")
-                    action.set("date", str(datetime.datetime.now()))
-            Log("check amount {:.8f}".format(total))
-        Log("           | {:.8f}".format(amount))
+        total = Get_Holding(currency, entry)
+        if (total==0.0):
+                action.set("status", "ready")
+                action.set("date", str(datetime.datetime.now()))
+        Log("check amount %.8f", total)
+        Log("           | %.8f", amount)
 
 def Execute_Audit(header, entry, action, audit):
     """
@@ -413,33 +1502,25 @@ def Execute_Audit(header, entry, action, audit):
     if action.get("date") != None :
         outdate = datetime.datetime.strptime(action.get("date"), 
                                              "%Y-%m-%d %H:%M:%S.%f")
-        Log("pending till "+str(outdate + datetime.timedelta(hours=1)))
+        Log("pending till %s", outdate + datetime.timedelta(hours=1))
     else:
         Log("no audit (no data)")
         outdate = nowdate
         audit.set("status", "ready")
     if(nowdate > (outdate + datetime.timedelta(hours=1)) ) : 
-        TotalBuy = 0.0
-        TotalSell = 0.0
-        TotalFees = 0.0
         RawPerf = 0.0
         NetPerf = 0.0
-        Output = api.query("GetTradeHistory", {'Market':pair, 'Count':25})
-        if (Output["Data"] != []):
-            for line in Output["Data"]:
-                linedate_str = str(line["TimeStamp"]).replace("T"," ")[:-2]+"0"
-                linedate = datetime.datetime.strptime(linedate_str,
-                                                      "%Y-%m-%d %H:%M:%S.%f")
-                linedate = linedate + datetime.timedelta(hours=1)
-                if (linedate > (indate + datetime.timedelta(hours=-1)) and 
-                    linedate < (outdate + datetime.timedelta(hours=1))) :
-                    if(line["Type"] == "Buy"):
-                        TotalBuy = TotalBuy + line["Total"]
-                        TotalFees = TotalFees + line["Fee"]
-                    if(line["Type"] == "Sell"):
-                        TotalSell = TotalSell + line["Total"]
-                        TotalFees = TotalFees + line["Fee"]
-    
+        trade_ledger = Get_Ledger()
+        if trade_ledger.sync() is None:
+            # audited at the next tick, with the trades synced
+            Log_Error("Audit : trade history not synced")
+        elif (trade_ledger.count(pair) > 0):
+            # the clock of the exchange is one hour behind
+            totals = trade_ledger.totals(
+                    pair, indate + datetime.timedelta(hours=-2), outdate)
+            TotalBuy = totals["Buy"]
+            TotalSell = totals["Sell"]
+            TotalFees = totals["Fees"]
             audit.set("Buy", '{:.8f}'.format(TotalBuy))
             audit.set("Sell", '{:.8f}'.format(TotalSell))
             audit.set("Fees", '{:.8f}'.format(TotalFees))
@@ -455,12 +1536,82 @@ def Execute_Audit(header, entry, action, audit):
             audit.set("NetPerf", '{:.8f}'.format(NetPerf))
             audit.set("status", "ready")
             
-def Log(message):
+def Wait(seconds):
+    """
+    Method to wait for the exchange to process a trade. In the async pipeline
+    the order runs in its own thread, only this order is paused. Parameters:
+    seconds  (req) - Time to wait (seconds)
+    """
+    if WAIT_FACTOR > 0:
+        time.sleep(seconds*WAIT_FACTOR)
+
+def Setup_Recorder():
+    """
+    Method to record the market data fetched (if RECORD_MARKETS) and to
+    downsample the old days of the records. No parameters.
+    """
+    if not RECORD_MARKETS or MARKETS.recorder is not None:
+        return
+    if recorder is None:
+        Log_Error("Recorder : NumPy is needed")
+        return
+    MARKETS.recorder = recorder.MarketRecorder(
+            os.path.join(DATA_PATH, RECORD_FOLDER))
+    try:
+        for day in MARKETS.recorder.compact(RECORD_DAYS, RECORD_PERIOD):
+            Log("market records of %s downsampled", day)
+    except OSError as e:
+        Log_Error("Recorder : %s", e)
+
+def Setup_Logs():
+    """
+    Method to send the logs in the logs folder too (if LOGS_ENABLED). 
+    No parameters.
+    """
+    if LOGS_ENABLED:
+        logger.Setup(os.path.join(DATA_PATH, "logs"))
+
+def Log_Spans():
+    """
+    Method to write in the log the time spent in the steps of the orders and
+    the api calls since the last report. No parameters.
+    """
+    for name, count, total, longest in logger.Span_Report(reset=True):
+        Log("time : %-20s %6d calls %9.3fs (max %.3fs)", 
+            name, count, total, longest)
+
+def Publish_Metrics(steps, elapsed):
+    """
+    Method to publish the metrics of a tick (see metrics.py): the orders by
+    stage and the duration of the tick. Parameters :
+    steps    (req) - Steps executed ("entry", "action", "audit", "done" or
+                     "error"), one per order
+    elapsed  (req) - Duration of the tick (seconds)
+    """
+    counts = dict((stage, 0) for stage in STAGES)
+    for step in steps:
+        counts[step] = counts.get(step, 0) + 1
+    metrics.PIPELINE_ORDERS.clear()
+    for stage, count in counts.items():
+        metrics.PIPELINE_ORDERS.set(count, stage)
+    metrics.TICK_SECONDS.observe(elapsed)
+
+def Log(message, *args):
+    """
+    Method to write in the log a the message passed in the parameters. The
+    message is formatted with the arguments only if it is written:
+    message  (req) - Message (string, with % formats for the arguments)
+    args     (opt) - Arguments of the message
+    """
+    logger.LOGGER.info(message, *args)
+
+def Log_Error(message, *args):
     """
-    Method to write in the log a the message passed in the parameters:
-    message  (req) - Message (string)
+    Method to write an error in the log (written in the file at once):
+    message  (req) - Message (string, with % formats for the arguments)
+    args     (opt) - Arguments of the message
     """
-    print(message)
+    logger.LOGGER.error("ERROR " + message, *args)
 
 def Get_Child_By_Name(root, name):
     """
@@ -479,7 +1630,7 @@ def Initialisation():
     Method to create the necessary resource folders for the pipeline to operate
     No parameters.
     """
-    folders = {"in":[],"work":[],"out":[],"logs":[],}
+    folders = {"in":[],"work":[],"bak":[],"out":[],"logs":[],}
     Create_Folder(DATA_PATH)
     for folder in folders.keys():
         Create_Folder(DATA_PATH, folder)
@@ -500,22 +1651,46 @@ def Get_Cache(method, req = None):
     """
     Method used to call the api or retrieve the data in cache if the api has 
     already been called with the same parameters. I had to create this method 
-    to fix some bugs caused by the api refusing too many calls. Parameters
+    to fix some bugs caused by the api refusing too many calls. The time the
+    data is kept depends on the method (see cache.TTL). Parameters
     are the same than those passed to the api
     method   (req) - api method called
     req      (opt) - List or dictionnary of parameters to pass to the api
     """
-    data = method
-    if req:
-     for param in req:
-         data += '|' + str(param)
-    if data in CACHE.keys():
-        Output = CACHE[data]
-    else:
+    Output = CACHE.get(method, req)
+    if Output is None:
         Output = api.query(method, req)
-        CACHE[data] = Output
+        CACHE.put(method, req, Output)
     return Output
 
+def Get_Market(pair):
+    """
+    Method to get the market data (same as the "Data" of GetMarket) of a pair
+    from the snapshot of all the markets fetched once per tick. Parameters:
+    pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
+    """
+    return MARKETS.get(pair)
+
+def Load_Cache():
+    """
+    Method to load the cache snapshot saved by the previous run (if the cache
+    is still empty). No parameters.
+    """
+    if not CACHE.entries:
+        count = CACHE.load(os.path.join(DATA_PATH, CACHE_FILE))
+        Log("cache : %s entries loaded", count)
+
+def Save_Cache():
+    """
+    Method to save the long living entries of the cache for the next run.
+    No parameters.
+    """
+    Log("cache : hits %s / misses %s", CACHE.hits, CACHE.misses)
+    try:
+        CACHE.save(os.path.join(DATA_PATH, CACHE_FILE))
+    except OSError as e:
+        Log_Error("Cache : %s", e)
+
 if __name__ == "__main__":
     Main()
 
@@ -0,0 +1,180 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Ratelimit (Api cryptopia)
+
+This module keeps the calls to the api under the limits of the exchange.
+The public and the private api have each their own token bucket. The trade
+methods (SubmitTrade, CancelTrade) get the tokens before the read calls
+waiting on the same bucket. When the exchange refuses a call, the rate of
+the bucket is divided by 2 and the bucket is paused for a while, then the
+rate goes back up step by step with the accepted calls.
+
+Classes:
+
+    TokenBucket : Token bucket with priority and adaptive rate
+        parameters :
+            rate (req) : number of calls per second
+            capacity (opt) : maximum burst of calls - default : rate
+
+    Limiter : Buckets of the public and private api
+        parameters :
+            public_rate (opt) : calls/s on the public api - default :
+                                PUBLIC_RATE
+            private_rate (opt) : calls/s on the private api - default :
+                                 PRIVATE_RATE
+
+Methods :
+
+    is_refused (response) : Tell if the response is a refusal of the exchange
+                            for too many calls
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import time
+import threading
+
+# calls per second allowed on the public and private api
+PUBLIC_RATE = 6.0
+PRIVATE_RATE = 2.0
+# methods served before the other calls waiting on the same bucket
+PRIORITY_SET = set(["SubmitTrade", "CancelTrade"])
+# pause (seconds) of a bucket after a refusal, doubled at each new refusal
+PENALTY = 2.0
+MAX_PENALTY = 60.0
+# share of the nominal rate recovered at each accepted call
+RECOVERY = 0.05
+# phrases of the error messages of a refusal for too many calls (the other
+# refusals, ie a trade rejected, are not sent again)
+REFUSED_WORDS = ("too many requests", "too many calls", "rate limit exceeded",
+                 "request limit", "throttled")
+
+class RateLimitError(Exception):
+    """The exchange refused the call because of too many calls"""
+    pass
+
+class TokenBucket(object):
+    """Token bucket with priority and adaptive rate.
+    Arguments:
+        rate: number of calls per second
+        capacity: maximum burst of calls (default rate)
+    """
+    def __init__(self, rate, capacity=None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+        self.penalty = PENALTY
+        self.priority_waiting = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, priority=False):
+        """Wait for a token. The calls with priority are served first.
+        Arguments:
+            priority: True for the trade methods
+        """
+        with self.condition:
+            if priority:
+                self.priority_waiting += 1
+            try:
+                while True:
+                    if priority or not self.priority_waiting:
+                        delay = self._take()
+                        if delay <= 0:
+                            return
+                    else:
+                        delay = None
+                    self.condition.wait(delay)
+            finally:
+                if priority:
+                    self.priority_waiting -= 1
+                    self.condition.notify_all()
+
+    def refused(self):
+        """The exchange refused a call: slow down and pause the bucket"""
+        with self.condition:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.paused_until = time.monotonic() + self.penalty
+            self.penalty = min(MAX_PENALTY, self.penalty * 2)
+            self.tokens = 0.0
+            return self.paused_until
+
+    def accepted(self):
+        """The exchange accepted a call: speed up again step by step"""
+        with self.condition:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate * RECOVERY)
+            else:
+                self.penalty = PENALTY
+
+    def _take(self):
+        # return 0 if a token was taken, the seconds to wait otherwise
+        now = time.monotonic()
+        if now < self.paused_until:
+            self.stamp = now
+            return self.paused_until - now
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0
+        return (1.0 - self.tokens) / self.rate
+
+class Limiter(object):
+    """Buckets of the public and private api.
+    Arguments:
+        public_rate: calls per second on the public api (default PUBLIC_RATE)
+        private_rate: calls per second on the private api (default
+                      PRIVATE_RATE)
+    """
+    def __init__(self, public_rate=None, private_rate=None):
+        self.public = TokenBucket(public_rate or PUBLIC_RATE)
+        self.private = TokenBucket(private_rate or PRIVATE_RATE)
+
+    def bucket(self, private):
+        """Return the bucket of the public or private api"""
+        return self.private if private else self.public
+
+    def acquire(self, method, private):
+        """Wait for the right to call the method
+        Arguments:
+            method: method of the api
+            private: True if the method is in the private api
+        """
+        self.bucket(private).acquire(method in PRIORITY_SET)
+
+    def refused(self, private):
+        """Report a refusal of the exchange"""
+        return self.bucket(private).refused()
+
+    def accepted(self, private):
+        """Report an accepted call"""
+        self.bucket(private).accepted()
+
+def is_refused(response):
+    """Tell if a response is a refusal of the exchange for too many calls
+    Arguments:
+        response: JSON response of the api
+    """
+    if not isinstance(response, dict) or response.get("Success", True):
+        return False
+    message = str(response.get("Error") or response.get("Message") or "")
+    message = message.lower()
+    for word in REFUSED_WORDS:
+        if word in message:
+            return True
+    return False
+
+# #######################################################79####################
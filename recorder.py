@@ -0,0 +1,238 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Recorder (Cryptopia)
+
+This module records the market data fetched by the pipeline (GetMarkets,
+GetMarket) instead of throwing it away at each tick. Each snapshot adds a
+row per TradePairId (time, bid, ask, last, volume) to fixed-width binary
+column files, one folder per day:
+
+    <folder>/2018-12-03/time.f8 pairid.i4 bid.f8 ask.f8 last.f8 volume.f8
+
+An append is a write at the end of each column file (the first append of a
+day cuts the columns to their common length, after a write cut by a crash).
+The readers open the columns with memory mapping (no copy, no parsing) and
+select a range of time with a binary search (the rows are appended in time
+order). The old days can be downsampled (one row per pair and period) to
+bound the size.
+
+Classes:
+
+    MarketRecorder : Columns of the market snapshots
+        parameters :
+            folder (req) : folder of the day partitions
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import time
+import shutil
+import datetime
+import threading
+
+import numpy as np
+
+# columns of the rows: name -> dtype (the file extension)
+COLUMNS = (("time", "f8"), ("pairid", "i4"), ("bid", "f8"), ("ask", "f8"),
+           ("last", "f8"), ("volume", "f8"))
+# fields of the market data of the columns
+FIELDS = (("bid", "BidPrice"), ("ask", "AskPrice"), ("last", "LastPrice"),
+          ("volume", "Volume"))
+# marker of the downsampled partitions
+DOWNSAMPLED = "downsampled"
+
+def _day(stamp):
+    return datetime.datetime.fromtimestamp(
+            stamp, datetime.timezone.utc).strftime("%Y-%m-%d")
+
+class MarketRecorder(object):
+    """Columns of the market snapshots, partitioned by day (UTC).
+    Arguments:
+        folder: folder of the day partitions
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.rows = 0
+        # days whose columns are aligned (see repair)
+        self.repaired = set()
+
+    def path(self, day, name):
+        """Return the path of a column file of a day"""
+        return os.path.join(self.folder, day,
+                            name + "." + dict(COLUMNS)[name])
+
+    def days(self):
+        """Return the days recorded ("2018-12-03"), oldest first"""
+        if not os.path.exists(self.folder):
+            return []
+        return sorted(name for name in os.listdir(self.folder)
+                      if os.path.isdir(os.path.join(self.folder, name)) and
+                      not name.endswith((".tmp", ".old")))
+
+    def record(self, data, stamp=None):
+        """Append a snapshot of markets. Return the number of rows added
+        Arguments:
+            data: list of market data ("Data" of GetMarkets, or a list with
+                  the "Data" of GetMarket)
+            stamp: time of the snapshot (default now)
+        """
+        rows = [item for item in data or [] if "TradePairId" in item]
+        if not rows:
+            return 0
+        stamp = time.time() if stamp is None else stamp
+        columns = {"time": np.full(len(rows), stamp),
+                   "pairid": np.array([item["TradePairId"] for item in rows])}
+        for name, field in FIELDS:
+            columns[name] = np.array([item.get(field) or 0.0
+                                      for item in rows])
+        day = _day(stamp)
+        with self.lock:
+            folder = os.path.join(self.folder, day)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            if day not in self.repaired:
+                self.repair(day)
+            for name, dtype in COLUMNS:
+                with open(self.path(day, name), "ab") as f:
+                    f.write(columns[name].astype(dtype).tobytes())
+            self.rows += len(rows)
+        return len(rows)
+
+    def repair(self, day):
+        """Cut the columns of a day to the rows fully written in all of them
+        (a write cut by a crash), so the next appends stay aligned. The
+        caller holds the lock. Return the number of rows
+        Arguments:
+            day: day of the partition ("2018-12-03")
+        """
+        sizes = {}
+        for name, dtype in COLUMNS:
+            file_path = self.path(day, name)
+            size = 0
+            if os.path.exists(file_path):
+                size = os.path.getsize(file_path)
+            sizes[name] = size
+        rows = min(size//np.dtype(dict(COLUMNS)[name]).itemsize
+                   for name, size in sizes.items())
+        for name, dtype in COLUMNS:
+            size = rows*np.dtype(dtype).itemsize
+            if sizes[name] > size:
+                with open(self.path(day, name), "r+b") as f:
+                    f.truncate(size)
+        self.repaired.add(day)
+        return rows
+
+    def open(self, day):
+        """Return the columns of a day as read only memory mapped arrays
+        (dictionnary name -> array), all cut to the rows fully written
+        Arguments:
+            day: day of the partition ("2018-12-03")
+        """
+        columns = {}
+        for name, dtype in COLUMNS:
+            file_path = self.path(day, name)
+            rows = 0
+            if os.path.exists(file_path):
+                # a write cut by a crash can leave a partial row at the end
+                rows = os.path.getsize(file_path)//np.dtype(dtype).itemsize
+            if not rows:
+                columns[name] = np.empty(0, dtype)
+            else:
+                columns[name] = np.memmap(file_path, dtype=dtype, mode="r",
+                                          shape=(rows,))
+        # a write cut by a crash leaves the columns with different lengths
+        size = min(len(column) for column in columns.values())
+        return dict((name, column[:size]) for name, column in columns.items())
+
+    def query(self, start, end, pairid=None):
+        """Return the rows between two times (start included, end excluded)
+        as a dictionnary name -> array. Without pairid, the arrays of a
+        single day are views on the files (no copy)
+        Arguments:
+            start, end: times (time.time())
+            pairid: TradePairId to select (default all)
+        """
+        parts = []
+        for day in self.days():
+            if day < _day(start) or day > _day(end):
+                continue
+            columns = self.open(day)
+            times = columns["time"]
+            first = np.searchsorted(times, start, side="left")
+            last = np.searchsorted(times, end, side="left")
+            part = dict((name, column[first:last])
+                        for name, column in columns.items())
+            if pairid is not None:
+                selected = part["pairid"] == pairid
+                part = dict((name, column[selected])
+                            for name, column in part.items())
+            parts.append(part)
+        if not parts:
+            return dict((name, np.empty(0, dtype)) for name, dtype in COLUMNS)
+        if len(parts) == 1:
+            return parts[0]
+        return dict((name, np.concatenate([part[name] for part in parts]))
+                    for name, dtype in COLUMNS)
+
+    def downsample(self, day, seconds):
+        """Keep one row (the last) per pair and period of a day. The day is
+        written again in a new folder, then swapped. Return the number of rows
+        kept
+        Arguments:
+            day: day of the partition ("2018-12-03")
+            seconds: length of the periods
+        """
+        with self.lock:
+            columns = self.open(day)
+            buckets = np.floor(columns["time"]/seconds)
+            # last row of each (pair, period), in time order
+            keys = np.stack([buckets, columns["pairid"]], axis=1)[::-1]
+            _, index = np.unique(keys, axis=0, return_index=True)
+            kept = np.sort(len(keys) - 1 - index)
+            folder = os.path.join(self.folder, day)
+            temp_folder = folder + ".tmp"
+            if os.path.exists(temp_folder):
+                shutil.rmtree(temp_folder)
+            os.makedirs(temp_folder)
+            for name, dtype in COLUMNS:
+                with open(os.path.join(temp_folder, name + "." + dtype),
+                          "wb") as f:
+                    f.write(np.ascontiguousarray(
+                            columns[name][kept]).tobytes())
+            open(os.path.join(temp_folder, DOWNSAMPLED), "w").close()
+            del columns
+            old_folder = folder + ".old"
+            os.rename(folder, old_folder)
+            os.rename(temp_folder, folder)
+            shutil.rmtree(old_folder)
+        return len(kept)
+
+    def compact(self, days=7, seconds=300):
+        """Downsample the days older than a number of days (once per day).
+        Return the days downsampled
+        Arguments:
+            days: days kept at full resolution
+            seconds: length of the periods of the old days
+        """
+        limit = _day(time.time() - days*86400)
+        done = []
+        for day in self.days():
+            if day >= limit:
+                continue
+            if os.path.exists(os.path.join(self.folder, day, DOWNSAMPLED)):
+                continue
+            self.downsample(day, seconds)
+            done.append(day)
+        return done
+
+# #######################################################79####################
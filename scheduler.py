@@ -0,0 +1,318 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Scheduler (Cryptopia)
+
+This module runs the pipeline as a long running process instead of calling
+Execute_Pipeline on a regular basis (ie: every minute). The orders are kept
+in memory, each one has its own next due time depending on its stage:
+- entry "sent" is checked often (ENTRY_DELAY),
+- an active order near or under its stoploss is checked fast
+  (STOPLOSS_DELAY), a quiet one far from it rarely (QUIET_DELAY),
+- a running stoploss countdown steps every COUNTDOWN_DELAY (the countdown
+  of DEFAULT_COUNTDOWN steps lasts as long as with a run every minute),
+- the audit is done one hour after the action date.
+The process sleeps until the next order is due, new orders are fed in the
+pipeline every FEED_DELAY seconds. Run as a script, the metrics are served
+on http://127.0.0.1:METRICS_PORT/metrics.
+With a price feed (see feed.py), the prices are watched in a thread: an
+active order is due at once when the price crosses its stoploss or its
+target, and checked rarely (QUIET_DELAY) otherwise. If the watch stops (end
+of the feed, error), the orders go back to their usual delays.
+
+Methods :
+
+    Run_Scheduler : Run the pipeline until stopped
+        parameters :
+            stop (opt) : threading.Event to set to stop the scheduler
+            metrics_port (opt) : port of the metrics endpoint - default :
+                                 None (no endpoint)
+            price_feed (opt) : price feed watched (see feed.py) - default :
+                               None (no watch)
+
+    Next_Due : Time the next execution of an order is due
+        parameters :
+            root (req) : xml root object of the order
+            now (req) : current time (time.time())
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import time
+import heapq
+import asyncio
+import datetime
+import threading
+
+import feed
+import logger
+import metrics
+import operation
+import store
+try:
+    import evaluator
+except ImportError:
+    # no NumPy: no price feed watched
+    evaluator = None
+
+# delays (seconds) before the next execution of an order, by stage
+ENTRY_DELAY = 30
+SELL_DELAY = 10
+ACTIVE_DELAY = 60
+STOPLOSS_DELAY = 15
+COUNTDOWN_DELAY = 60
+QUIET_DELAY = 300
+AUDIT_DELAY = 600
+ERROR_DELAY = 60
+# position of the price between the stoploss (0) and the buy price (1):
+# quiet over QUIET_RATIO, urgent under URGENT_RATIO
+QUIET_RATIO = 1.0
+URGENT_RATIO = 0.25
+# delay (seconds) between two feeds of the pipeline with the new orders
+FEED_DELAY = 60
+# longest sleep (seconds), to stay responsive to the stop event
+MAX_SLEEP = 60
+# port of the metrics endpoint when run as a script
+METRICS_PORT = metrics.PORT
+# prices watched with a polling feed when run as a script (see feed.py)
+WATCH_PRICES = False
+
+def Run_Scheduler(stop=None, metrics_port=None, price_feed=None):
+    """
+    Method to run the pipeline until the stop event is set. Parameters :
+    stop         (opt) - threading.Event to set to stop the scheduler
+    metrics_port (opt) - Port of the metrics endpoint (see metrics.py), no
+                         endpoint if None
+    price_feed   (opt) - Price feed watched (see feed.py), the active orders
+                         are executed when a threshold is crossed
+    """
+    stop = stop or threading.Event()
+    server = None
+    if metrics_port:
+        server = metrics.start_server(metrics_port)
+    watch = None
+    wake = stop
+    if price_feed is not None and evaluator is not None:
+        watch = evaluator.ActiveOrders()
+        wake = threading.Event()
+        urgent = set()
+        lock = threading.Lock()
+        def trigger(order_ids):
+            with lock:
+                urgent.update(order_ids)
+            wake.set()
+        watcher = threading.Thread(target=Watch_Prices, name="feed",
+                                   args=(price_feed, watch, trigger, stop, 
+                                         wake))
+        watcher.daemon = True
+        watcher.start()
+    operation.Setup_Logs()
+    operation.Setup_Recorder()
+    operation.Load_Cache()
+    # each order has its own due time, the active orders are not kept
+    operation.Clear_Active_Orders()
+    operation.Log("scheduler started")
+    orders = {}
+    # order id -> due time (the older times left in the queue are skipped)
+    dues = {}
+    queue = []
+    next_feed = 0.0
+    while not stop.is_set():
+        now = time.time()
+        if now >= next_feed:
+            operation.Feed_Pipeline()
+            for order_id in operation.Get_Store().list("work"):
+                if order_id not in orders:
+                    orders[order_id] = None
+                    dues[order_id] = now
+                    heapq.heappush(queue, (now, order_id))
+            operation.Save_Cache()
+            operation.Log_Spans()
+            logger.Flush()
+            next_feed = now + FEED_DELAY
+        if watch is not None and not watcher.is_alive():
+            operation.Log_Error("Feed : prices not watched any more")
+            # the orders waiting for the feed are checked as usual
+            watch = None
+            for order_id in orders:
+                dues[order_id] = now
+                heapq.heappush(queue, (now, order_id))
+        if watch is not None:
+            wake.clear()
+            with lock:
+                triggered = urgent & set(orders)
+                urgent.clear()
+            for order_id in triggered:
+                dues[order_id] = now
+                heapq.heappush(queue, (now, order_id))
+        while queue and dues.get(queue[0][1]) != queue[0][0]:
+            heapq.heappop(queue)
+        if queue and queue[0][0] <= now:
+            # the balances are loaded once for all the orders due now
+            operation.BALANCES.invalidate()
+            operation.Recover_Journal()
+        steps = []
+        start = time.perf_counter()
+        while queue and queue[0][0] <= now and not stop.is_set():
+            due, order_id = heapq.heappop(queue)
+            if dues.get(order_id) != due:
+                continue
+            due = Run_Order(orders, order_id, steps)
+            if watch is not None:
+                due = Watch_Order(watch, orders, order_id, due)
+            if due is None:
+                del orders[order_id]
+                del dues[order_id]
+            else:
+                dues[order_id] = due
+                heapq.heappush(queue, (due, order_id))
+        if steps:
+            # the orders allocated a netted trade are loaded again
+            for order_id in operation.Flush_Trades():
+                if order_id in orders:
+                    orders[order_id] = None
+            operation.Sync_State()
+            operation.Publish_Metrics(steps, time.perf_counter() - start)
+        wake_time = next_feed
+        if queue:
+            wake_time = min(wake_time, queue[0][0])
+        wake.wait(max(0.0, min(MAX_SLEEP, wake_time - time.time())))
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    operation.Save_Cache()
+    operation.Log("scheduler stopped")
+    logger.Flush()
+
+def Run_Order(orders, order_id, steps=None):
+    """
+    Method to execute an order kept in memory. It returns the time the next
+    execution is due, None if the order has left the pipeline. Parameters :
+    orders   (req) - Dictionnary order id -> xml root object (None = to load)
+    order_id (req) - Id of the order
+    steps    (opt) - List where the step executed is added (for the metrics)
+    """
+    if steps is None:
+        steps = []
+    operation.Log("Order %s -----------------------------start", order_id)
+    try:
+        if orders[order_id] is None:
+            orders[order_id] = operation.Get_Store().load(order_id)
+        root = orders[order_id]
+        step = operation.Execute_Order(order_id, root)
+        steps.append(step or "done")
+        if step is None:
+            return None
+        due = Next_Due(root, time.time())
+    except Exception as e:
+        steps.append("error")
+        operation.Log_Error("Pipline : %s", e)
+        # the order is loaded again from the store at the next execution
+        orders[order_id] = None
+        due = time.time() + ERROR_DELAY
+    operation.Log("Order %s -----------------------------done", order_id)
+    return due
+
+def Watch_Prices(price_feed, watch, trigger, stop, wake):
+    """
+    Method run in the thread watching the prices (see feed.watch) until the 
+    stop event is set, then it wakes the scheduler up. Parameters :
+    price_feed (req) - Price feed (see feed.py)
+    watch      (req) - Active orders watched (evaluator.ActiveOrders)
+    trigger    (req) - Function called with the ids of the orders to execute
+    stop       (req) - threading.Event stopping the watch
+    wake       (req) - threading.Event waking the scheduler up
+    """
+    try:
+        asyncio.run(feed.watch(price_feed, watch, trigger, stop))
+    except Exception as e:
+        operation.Log_Error("Feed : %s", e)
+    finally:
+        wake.set()
+
+def Watch_Order(watch, orders, order_id, due):
+    """
+    Method to update the active orders watched after the execution of an 
+    order. It returns the time the next execution is due: an active order 
+    without stoploss countdown waits for the price feed (QUIET_DELAY). 
+    Parameters :
+    watch    (req) - Active orders watched (evaluator.ActiveOrders)
+    orders   (req) - Dictionnary order id -> xml root object (None = to load)
+    order_id (req) - Id of the order
+    due      (req) - Time the next execution is due (see Run_Order)
+    """
+    root = orders.get(order_id)
+    if due is None or root is None:
+        watch.remove(order_id)
+        return due
+    watch.update(order_id, root)
+    if order_id in watch and root.find("action").get("countdown") is None:
+        return max(due, time.time() + QUIET_DELAY)
+    return due
+
+def Next_Due(root, now):
+    """
+    Method to calculate the time the next execution of an order is due,
+    depending on its stage. Parameters :
+    root     (req) - XML root object of the order
+    now      (req) - Current time (time.time())
+    """
+    status = store.order_status(root)
+    if status == "done":
+        return now
+    step, state = status.split(":")
+    if step == "entry":
+        return now + ENTRY_DELAY
+    if step == "action":
+        if state == "active":
+            return now + Active_Delay(root)
+        return now + SELL_DELAY
+    action = root.find("action")
+    if action.get("date") is None:
+        return now + SELL_DELAY
+    outdate = datetime.datetime.strptime(action.get("date"),
+                                         "%Y-%m-%d %H:%M:%S.%f")
+    outdate = outdate + datetime.timedelta(hours=1, seconds=1)
+    # no trade history yet: try again later
+    return max(now + AUDIT_DELAY, time.mktime(outdate.timetuple()))
+
+def Active_Delay(root):
+    """
+    Method to calculate the delay before the next check of an active order:
+    fast near the stoploss, slow when the price is over the buy price, one 
+    step of the stoploss countdown per COUNTDOWN_DELAY. Parameters :
+    root     (req) - XML root object of the order
+    """
+    action = root.find("action")
+    if action.get("countdown") is not None:
+        return COUNTDOWN_DELAY
+    try:
+        pair = root.find("header").get("pair")
+        refprice = float(operation.Get_Market(pair)["LastPrice"])
+        price = float(root.find("entry").get("price"))
+        stoploss = float(action.get("stoploss"))
+    except (TypeError, ValueError, KeyError):
+        return ACTIVE_DELAY
+    if price <= stoploss:
+        return ACTIVE_DELAY
+    ratio = (refprice-stoploss)/(price-stoploss)
+    if ratio > QUIET_RATIO:
+        return QUIET_DELAY
+    if ratio < URGENT_RATIO:
+        return STOPLOSS_DELAY
+    return ACTIVE_DELAY
+
+if __name__ == "__main__":
+    operation.Initialisation()
+    Run_Scheduler(metrics_port=METRICS_PORT, 
+                  price_feed=feed.PollingFeed(operation.MARKETS) 
+                  if WATCH_PRICES else None)
+
+# #######################################################79####################
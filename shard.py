@@ -0,0 +1,180 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Shard (Cryptopia)
+
+This module executes the pipeline on a pool of worker processes. The orders
+are partitioned by pair: all the orders of a pair go to the same shard and
+are executed one after the other, so two workers never submit or cancel
+trades on the same TradePairId at the same time (CancelTrade cancels all the
+trades of the pair, the trades of a pair are netted in a single worker).
+Each worker has its own api client, cache, market snapshot and balance book,
+the rate limits are shared out between them.
+The coordinator feeds the pipeline, dispatches the shards and writes the
+logs of each order once its shard is done.
+
+Methods :
+
+    Execute_Pipeline_Sharded : Execute all orders in the pipeline on a pool
+                               of processes
+        parameters :
+            processes (opt) : number of worker processes - default :
+                              PROCESSES
+            shards (opt) : number of shards - default : processes
+
+    Shard_Of : Shard of a pair
+        parameters :
+            pair (req) : market pair ("XMR_BTC")
+            shards (req) : number of shards
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import io
+import zlib
+import time
+import platform
+import datetime
+import contextlib
+import concurrent.futures
+
+import api
+import balance
+import cache
+import logger
+import market
+import netting
+import operation
+import ratelimit
+
+# number of worker processes
+PROCESSES = 4
+
+def Execute_Pipeline_Sharded(processes=None, shards=None):
+    """
+    Method to execute all orders in the pipeline on a pool of processes. It
+    returns the list of the results of the orders (see Run_Shard).
+    Parameters :
+    processes (opt) - Number of worker processes (default=PROCESSES)
+    shards    (opt) - Number of shards (default=processes)
+    """
+    processes = processes or PROCESSES
+    shards = shards or processes
+    operation.Setup_Logs()
+    operation.Load_Cache()
+    # the workers don't keep the active orders up to date
+    operation.Clear_Active_Orders()
+    operation.Log(platform.node())
+    operation.Log(str(datetime.datetime.now()))
+    operation.Log("-----------------------------")
+    operation.Feed_Pipeline()
+    operation.Recover_Journal()
+    order_store = operation.Get_Store()
+    partition = {}
+    for order_id in order_store.list("work"):
+        try:
+            pair = order_store.get_pair(order_id)
+        except Exception as e:
+            operation.Log_Error("Pipline : %s", e)
+            continue
+        partition.setdefault(Shard_Of(pair, shards), []).append(order_id)
+    operation.Log("shards : %s / processes : %s", len(partition), processes)
+    results = []
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=Init_Worker,
+            initargs=(order_store, processes)) as pool:
+        futures = [pool.submit(Run_Shard, ids)
+                   for ids in partition.values()]
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                shard_results = future.result()
+            except Exception as e:
+                operation.Log_Error("Shard : %s", e)
+                continue
+            for result in shard_results:
+                operation.Log("Order %s", result["order_id"])
+                operation.Log("-----------------------------start")
+                for line in result["log"]:
+                    operation.Log(line)
+                operation.Log("-----------------------------done")
+            results.extend(shard_results)
+    operation.Publish_Metrics(["error" if result["error"] else
+                               result["step"] or "done"
+                               for result in results],
+                              time.perf_counter() - start)
+    operation.Save_Cache()
+    operation.Log(str(datetime.datetime.now()))
+    logger.Flush()
+    return results
+
+def Shard_Of(pair, shards):
+    """
+    Method to get the shard of a pair, the same in every process (the built-in
+    hash of the strings changes from a process to another). Parameters :
+    pair     (req) - Market pair, string in format XXX_YYY ("XMR_BTC")
+    shards   (req) - Number of shards
+    """
+    return zlib.crc32(pair.encode("UTF-8")) % shards
+
+def Init_Worker(order_store, processes):
+    """
+    Method run at the start of a worker process: the worker gets its own api
+    client, cache, market snapshot, balance book, trade ledger and journal,
+    and its share of the rate limits. Parameters :
+    order_store (req) - Store of the orders
+    processes   (req) - Number of worker processes
+    """
+    # the coordinator writes the log file, from the logs of the shards
+    logger.Reset()
+    api.set_client(api.Client(limiter=ratelimit.Limiter(
+            ratelimit.PUBLIC_RATE/processes,
+            ratelimit.PRIVATE_RATE/processes)))
+    api.EXECUTOR = None
+    operation.Set_Store(order_store)
+    operation.CACHE = cache.Cache()
+    operation.MARKETS = market.MarketSnapshot()
+    operation.BALANCES = balance.BalanceBook()
+    operation.PAIRS = None
+    operation.LEDGER = None
+    operation.JOURNAL = None
+    operation.DESK = netting.NettingDesk()
+    with contextlib.redirect_stdout(io.StringIO()):
+        operation.Load_Cache()
+
+def Run_Shard(order_ids):
+    """
+    Method executing the orders of a shard in a worker process. It returns a
+    list of dictionnaries with the order_id, the step executed (or None), the
+    error (or None) and the lines logged. Parameters :
+    order_ids (req) - Ids of the orders of the shard
+    """
+    results = []
+    operation.BALANCES.invalidate()
+    for order_id in order_ids:
+        result = {"order_id": order_id, "step": None, "error": None}
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                result["step"] = operation.Execute_Order(order_id)
+            except Exception as e:
+                result["error"] = str(e)
+                operation.Log_Error("Pipline : %s", e)
+        result["log"] = output.getvalue().splitlines()
+        results.append(result)
+    operation.Flush_Trades()
+    operation.Sync_State()
+    return results
+
+if __name__ == "__main__":
+    operation.Initialisation()
+    Execute_Pipeline_Sharded()
+
+# #######################################################79####################
@@ -0,0 +1,484 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Simulator (Api cryptopia)
+
+This module is a simulated exchange running in the process, to exercise the
+pipeline without the live exchange (tests, load tests, benchmarks). It is a
+transport of the api (see api.set_transport): query works the same way, the
+calls are answered by the simulator instead of the exchange.
+
+All the methods of the public and private api are implemented:
+- the markets have a price (or a recorded price series to replay), the bid
+  and ask are set around the price with a spread, GetMarketOrders returns a
+  synthetic order book around them,
+- SubmitTrade fills at once a buy at or above the ask (a sell at or below the
+  bid), otherwise the trade rests in the open orders and fills when the
+  price crosses its rate (tick),
+- the balances hold the funds of the open orders, the fees are charged on
+  the base currency, the trades are kept for GetTradeHistory.
+A latency can be added to each call, and refusals for too many calls can be
+raised (random or over a calls per second limit).
+
+Classes:
+
+    SimulatedExchange : Simulated exchange, transport of the api
+        parameters :
+            prices (req) : dictionnary pair ("XMR_BTC") -> price or list of
+                           prices (series replayed by tick)
+            balances (opt) : dictionnary symbol -> amount
+            fee (opt) : fee ratio of the trades - default : FEE
+            spread (opt) : spread ratio between bid and ask - default : SPREAD
+            latency (opt) : seconds added to each call - default : 0
+            error_rate (opt) : ratio of the calls refused - default : 0
+            rate_limit (opt) : calls per second over which the calls are
+                               refused - default : None (no limit)
+            auto_tick (opt) : advance the prices at each GetMarkets call
+                              default : False
+            seed (opt) : seed of the random generator
+
+Methods :
+
+    load_series (file_path) : Read a recorded price series (json list of
+                              prices or of GetMarket "Data" objects)
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import hmac
+import time
+import json
+import base64
+import random
+import hashlib
+import datetime
+import threading
+import collections
+import urllib.parse
+
+import api
+from ratelimit import RateLimitError
+
+BASE_URL = "sim://cryptopia/api/"
+# fee ratio of the trades and spread ratio between the bid and the ask
+FEE = 0.002
+SPREAD = 0.002
+# minimum base trade of the trade pairs
+MINIMUM_BASE_TRADE = 0.0005
+# levels and volume (in base currency) of each side of the order books
+DEPTH = 10
+DEPTH_VOLUME = 0.01
+# first TradePairId of the markets
+FIRST_PAIR_ID = 100
+
+def load_series(file_path):
+    """Read a recorded price series: a json list of prices or of GetMarket
+    "Data" objects (the LastPrice is used)
+    Arguments:
+        file_path: path of the json file
+    """
+    with open(file_path) as f:
+        data = json.load(f)
+    series = []
+    for item in data:
+        if isinstance(item, dict):
+            item = item.get("Data", item)["LastPrice"]
+        series.append(float(item))
+    return series
+
+class SimulatedExchange(object):
+    """Simulated exchange, transport of the api (see the module help)"""
+
+    def __init__(self, prices, balances=None, fee=None, spread=None,
+                 latency=0.0, error_rate=0.0, rate_limit=None,
+                 auto_tick=False, seed=None):
+        self.base_url = BASE_URL
+        self.fee = FEE if fee is None else fee
+        self.spread = SPREAD if spread is None else spread
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.auto_tick = auto_tick
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls = collections.Counter()
+        self.stamps = collections.deque()
+        self.markets = {}
+        self.by_id = {}
+        for index, pair in enumerate(sorted(prices)):
+            series = prices[pair]
+            if not isinstance(series, (list, tuple)):
+                series = [series]
+            symbol, base_symbol = pair.split("_")
+            market = {"pair": pair, "pairid": FIRST_PAIR_ID + index,
+                      "label": symbol + "/" + base_symbol, "symbol": symbol,
+                      "base_symbol": base_symbol,
+                      "series": [float(price) for price in series],
+                      "index": 0, "volume": 0.0, "base_volume": 0.0}
+            self.markets[pair] = market
+            self.by_id[market["pairid"]] = market
+        self.balances = collections.defaultdict(lambda: {"Total": 0.0,
+                                                         "Held": 0.0})
+        for symbol, amount in (balances or {}).items():
+            self.balances[symbol]["Total"] = float(amount)
+        self.orders = collections.OrderedDict()
+        self.trades = []
+        self.next_id = 1
+        # credentials of the client (see install), None: not checked
+        self.key = None
+        self.hmac_key = None
+
+    # ------------------------------------------------------- transport
+    def get(self, url):
+        """GET call of the api, return the JSON response"""
+        parts = url[len(self.base_url):].split("/")
+        return self.call(parts[0], parts[1:])
+
+    def post(self, url, data, headers):
+        """POST call of the api, return the JSON response. The call must be
+        signed with the credentials of the client (see install)"""
+        message = self.check_authorization(url, data, headers)
+        if message is not None:
+            return self.error(message)
+        return self.call(url[len(self.base_url):], json.loads(data or "{}"))
+
+    def check_authorization(self, url, data, headers):
+        """Return the error of the authorization of a private call, None if
+        it is signed with the API key and secret of the client"""
+        if self.key is None:
+            return None
+        try:
+            scheme, value = headers["Authorization"].split(" ", 1)
+            key, signature, nonce = value.split(":")
+        except (KeyError, ValueError, AttributeError):
+            return "Authorization missing"
+        if scheme != "amx" or key != self.key:
+            return "Invalid API key"
+        content = base64.b64encode(hashlib.md5(
+                (data or "").encode("UTF-8")).digest()).decode("UTF-8")
+        message = (key + "POST" + urllib.parse.quote_plus(url).lower() +
+                   nonce + content)
+        expected = base64.b64encode(hmac.new(
+                self.hmac_key, message.encode("UTF-8"),
+                hashlib.sha256).digest()).decode("UTF-8")
+        if not hmac.compare_digest(signature, expected):
+            return "Invalid signature"
+        return None
+
+    def close(self):
+        pass
+
+    def install(self):
+        """Make the simulator the transport of the api. Credentials are set
+        if the client has none, the private calls must be signed with the
+        credentials of the client (see check_authorization)"""
+        client = api.get_client()
+        if client.key is None:
+            client.set_credentials("simulator", base64.b64encode(
+                    b"simulator").decode("UTF-8"))
+        self.key = client.key
+        self.hmac_key = client.hmac_key
+        api.set_transport(self)
+        return self
+
+    def call(self, method, req):
+        """Answer a call of the api"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[method] += 1
+            self.check_limit()
+            handler = getattr(self, "do_" + method, None)
+            if handler is None:
+                return self.error("Unknown method " + method)
+            try:
+                return {"Success": True, "Error": None, "Message": None,
+                        "Data": handler(req)}
+            except (KeyError, ValueError, IndexError) as e:
+                return self.error(str(e))
+
+    def check_limit(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise RateLimitError("simulated refusal")
+        if self.rate_limit:
+            now = time.monotonic()
+            self.stamps.append(now)
+            while self.stamps and self.stamps[0] < now - 1.0:
+                self.stamps.popleft()
+            if len(self.stamps) > self.rate_limit:
+                raise RateLimitError("simulated rate limit")
+
+    def error(self, message):
+        return {"Success": False, "Error": message, "Message": None,
+                "Data": None}
+
+    # ------------------------------------------------------- prices
+    def tick(self, steps=1):
+        """Advance the price series of all the markets and fill the open
+        orders crossed by the new prices"""
+        with self.lock:
+            for market in self.markets.values():
+                market["index"] = min(len(market["series"]) - 1,
+                                      market["index"] + steps)
+            self.match()
+
+    def set_price(self, pair, price):
+        """Set the price of a market and fill the open orders crossed"""
+        with self.lock:
+            market = self.markets[pair]
+            market["series"][market["index"]] = float(price)
+            self.match()
+
+    def price(self, market):
+        return market["series"][market["index"]]
+
+    def bid(self, market):
+        return round(self.price(market) * (1 - self.spread / 2), 8)
+
+    def ask(self, market):
+        return round(self.price(market) * (1 + self.spread / 2), 8)
+
+    def market(self, req):
+        # market from a pair, a label or a TradePairId
+        if isinstance(req, int) or str(req).isdigit():
+            return self.by_id[int(req)]
+        return self.markets[str(req).replace("/", "_")]
+
+    def market_data(self, market):
+        series = market["series"][:market["index"] + 1][-1440:]
+        price = self.price(market)
+        return {"TradePairId": market["pairid"], "Label": market["label"],
+                "AskPrice": self.ask(market), "BidPrice": self.bid(market),
+                "Low": min(series), "High": max(series),
+                "Volume": market["volume"], "LastPrice": price,
+                "BuyVolume": 0.0, "SellVolume": 0.0,
+                "Change": round(100 * (price / series[0] - 1), 2),
+                "Open": series[0], "Close": price,
+                "BaseVolume": market["base_volume"],
+                "BuyBaseVolume": 0.0, "SellBaseVolume": 0.0}
+
+    # ------------------------------------------------------- trades
+    def available(self, symbol):
+        balance = self.balances[symbol]
+        return balance["Total"] - balance["Held"]
+
+    def fill(self, market, tradetype, rate, amount):
+        """Execute a trade: move the funds, charge the fee, keep history"""
+        total = round(rate * amount, 8)
+        fee = round(total * self.fee, 8)
+        symbol = self.balances[market["symbol"]]
+        base = self.balances[market["base_symbol"]]
+        if tradetype == "Buy":
+            symbol["Total"] += amount
+            base["Total"] -= total + fee
+        else:
+            symbol["Total"] -= amount
+            base["Total"] += total - fee
+        market["volume"] += amount
+        market["base_volume"] += total
+        # exchange clock, one hour behind (the audit adds one hour)
+        stamp = datetime.datetime.now() - datetime.timedelta(hours=1)
+        trade = {"TradeId": len(self.trades) + 1,
+                 "TradePairId": market["pairid"], "Market": market["label"],
+                 "Type": tradetype, "Rate": rate, "Amount": amount,
+                 "Total": total, "Fee": fee,
+                 "TimeStamp": stamp.strftime("%Y-%m-%dT%H:%M:%S.%f") + "0"}
+        self.trades.append(trade)
+        return trade["TradeId"]
+
+    def match(self):
+        """Fill the open orders crossed by the current prices"""
+        for order_id, order in list(self.orders.items()):
+            market = order["market"]
+            if order["Type"] == "Buy" and order["Rate"] < self.ask(market):
+                continue
+            if order["Type"] == "Sell" and order["Rate"] > self.bid(market):
+                continue
+            self.release(order)
+            self.fill(market, order["Type"], order["Rate"], order["Amount"])
+            del self.orders[order_id]
+
+    def hold(self, order):
+        if order["Type"] == "Buy":
+            amount = order["Rate"] * order["Amount"] * (1 + self.fee)
+            self.balances[order["market"]["base_symbol"]]["Held"] += amount
+        else:
+            self.balances[order["market"]["symbol"]]["Held"] += \
+                    order["Amount"]
+
+    def release(self, order):
+        if order["Type"] == "Buy":
+            amount = order["Rate"] * order["Amount"] * (1 + self.fee)
+            self.balances[order["market"]["base_symbol"]]["Held"] -= amount
+        else:
+            self.balances[order["market"]["symbol"]]["Held"] -= \
+                    order["Amount"]
+
+    # ------------------------------------------------------- public api
+    def do_GetCurrencies(self, req):
+        symbols = set()
+        for market in self.markets.values():
+            symbols.add(market["symbol"])
+            symbols.add(market["base_symbol"])
+        return [{"Id": index + 1, "Name": symbol, "Symbol": symbol,
+                 "Algorithm": None, "WithdrawFee": 0.0,
+                 "MinWithdraw": 0.0, "MinBaseTrade": MINIMUM_BASE_TRADE,
+                 "IsTipEnabled": False, "Status": "OK"}
+                for index, symbol in enumerate(sorted(symbols))]
+
+    def do_GetTradePairs(self, req):
+        return [{"Id": market["pairid"], "Label": market["label"],
+                 "Currency": market["symbol"], "Symbol": market["symbol"],
+                 "BaseCurrency": market["base_symbol"],
+                 "BaseSymbol": market["base_symbol"], "Status": "OK",
+                 "TradeFee": self.fee * 100, "MinimumTrade": 0.00000001,
+                 "MaximumTrade": 100000000.0,
+                 "MinimumBaseTrade": MINIMUM_BASE_TRADE,
+                 "MaximumBaseTrade": 100000000.0,
+                 "MinimumPrice": 0.00000001, "MaximumPrice": 100000000.0}
+                for market in self.markets.values()]
+
+    def do_GetMarkets(self, req):
+        if self.auto_tick:
+            self.tick()
+        base = req[0] if req else None
+        return [self.market_data(market) for market in self.markets.values()
+                if base is None or market["base_symbol"] == base]
+
+    def do_GetMarket(self, req):
+        return self.market_data(self.market(req[0]))
+
+    def do_GetMarketHistory(self, req):
+        market = self.market(req[0])
+        return [dict(trade, Label=trade["Market"]) for trade in self.trades
+                if trade["TradePairId"] == market["pairid"]][::-1]
+
+    def do_GetMarketOrders(self, req):
+        market = self.market(req[0])
+        count = int(req[1]) if len(req) > 1 else DEPTH
+        orders = {"Buy": [], "Sell": []}
+        for level in range(count):
+            step = 0.001*level
+            for side, price in (("Buy", self.bid(market) * (1 - step)),
+                                ("Sell", self.ask(market) * (1 + step))):
+                price = round(price, 8)
+                volume = round(DEPTH_VOLUME / price, 8)
+                orders[side].append({"TradePairId": market["pairid"],
+                                     "Label": market["label"],
+                                     "Price": price, "Volume": volume,
+                                     "Total": round(price * volume, 8)})
+        return orders
+
+    # ------------------------------------------------------- private api
+    def do_GetBalance(self, req):
+        currency = req.get("Currency") if req else None
+        symbols = set(self.balances)
+        for market in self.markets.values():
+            symbols.add(market["symbol"])
+            symbols.add(market["base_symbol"])
+        result = []
+        for index, symbol in enumerate(sorted(symbols)):
+            if currency is not None and symbol != currency:
+                continue
+            balance = self.balances[symbol]
+            result.append({"CurrencyId": index + 1, "Symbol": symbol,
+                           "Total": round(balance["Total"], 8),
+                           "Available": round(self.available(symbol), 8),
+                           "Unconfirmed": 0.0,
+                           "HeldForTrades": round(balance["Held"], 8),
+                           "PendingWithdraw": 0.0, "Address": None,
+                           "Status": "OK", "StatusMessage": None,
+                           "BaseAddress": None})
+        return result
+
+    def do_GetDepositAddress(self, req):
+        return {"Currency": req["Currency"], "Address": "sim-address",
+                "BaseAddress": None}
+
+    def do_GetOpenOrders(self, req):
+        market = None
+        if req.get("TradePairId") is not None:
+            market = self.market(req["TradePairId"])
+        elif req.get("Market") is not None:
+            market = self.market(req["Market"])
+        return [{"OrderId": order_id, "TradePairId": order["market"]["pairid"],
+                 "Market": order["market"]["label"], "Type": order["Type"],
+                 "Rate": order["Rate"], "Amount": order["Amount"],
+                 "Total": round(order["Rate"] * order["Amount"], 8),
+                 "Remaining": order["Amount"], "TimeStamp": order["TimeStamp"]}
+                for order_id, order in self.orders.items()
+                if market is None or order["market"] is market]
+
+    def do_GetTradeHistory(self, req):
+        trades = self.trades
+        if req.get("TradePairId") is not None:
+            pairid = self.market(req["TradePairId"])["pairid"]
+            trades = [trade for trade in trades
+                      if trade["TradePairId"] == pairid]
+        elif req.get("Market") is not None:
+            pairid = self.market(req["Market"])["pairid"]
+            trades = [trade for trade in trades
+                      if trade["TradePairId"] == pairid]
+        count = int(req.get("Count") or 100)
+        return [dict(trade) for trade in trades[::-1][:count]]
+
+    def do_GetTransactions(self, req):
+        return []
+
+    def do_SubmitTrade(self, req):
+        market = self.market(req["TradePairId"])
+        tradetype = req["Type"]
+        rate = round(float(req["Rate"]), 8)
+        amount = round(float(req["Amount"]), 8)
+        if tradetype not in ("Buy", "Sell") or rate <= 0 or amount <= 0:
+            raise ValueError("Invalid trade")
+        if rate * amount < MINIMUM_BASE_TRADE:
+            raise ValueError("Minimum trade is " +
+                             '{:.8f}'.format(MINIMUM_BASE_TRADE))
+        if tradetype == "Buy":
+            needed = rate * amount * (1 + self.fee)
+            if self.available(market["base_symbol"]) < needed - 0.00000001:
+                raise ValueError("Insufficient Funds")
+            if rate >= self.ask(market):
+                trade_id = self.fill(market, "Buy", self.ask(market), amount)
+                return {"OrderId": None, "FilledOrders": [trade_id]}
+        else:
+            if self.available(market["symbol"]) < amount - 0.00000001:
+                raise ValueError("Insufficient Funds")
+            if rate <= self.bid(market):
+                trade_id = self.fill(market, "Sell", self.bid(market), amount)
+                return {"OrderId": None, "FilledOrders": [trade_id]}
+        order_id = self.next_id
+        self.next_id += 1
+        order = {"market": market, "Type": tradetype, "Rate": rate,
+                 "Amount": amount,
+                 "TimeStamp": datetime.datetime.now().isoformat()}
+        self.orders[order_id] = order
+        self.hold(order)
+        return {"OrderId": order_id, "FilledOrders": []}
+
+    def do_CancelTrade(self, req):
+        canceltype = req.get("Type", "Trade")
+        cancelled = []
+        for order_id, order in list(self.orders.items()):
+            if canceltype == "Trade" and order_id != req.get("OrderId"):
+                continue
+            if canceltype == "TradePair" and \
+                    order["market"]["pairid"] != req.get("TradePairId"):
+                continue
+            self.release(order)
+            del self.orders[order_id]
+            cancelled.append(order_id)
+        return cancelled
+
+    def do_SubmitTip(self, req):
+        raise ValueError("Tips are not simulated")
+
+# #######################################################79####################
@@ -0,0 +1,493 @@
+# ###############################################79############################
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+""" Module Store (Cryptopia)
+
+This module keeps the orders of the pipeline. An order is an xml tree with
+the header, entry, action and audit elements (see operation.Create_Order),
+it goes through the stages "in" (created), "work" (in the pipeline) and
+"bak" (out of the pipeline).
+
+Two stores share the same interface (OrderStore):
+- XmlOrderStore : one xml file per order in the data/<stage> folders,
+  written atomically (temp file renamed), synced to the disk by sync once
+  per tick. The orders created in bulk (create_many) are written in a
+  single batch file in "in", split in the "work" folder when fed
+- SqliteOrderStore : a SQLite database (WAL mode), the attributes of the
+  header/entry/action/audit elements are kept in columns, the stage, the
+  pair and the status of the order are indexed.
+
+Classes:
+
+    OrderStore : Interface of the order stores
+
+    XmlOrderStore : Orders kept as xml files
+        parameters :
+            data_path (req) : folder of the stage subfolders
+
+    SqliteOrderStore : Orders kept in a SQLite database
+        parameters :
+            file_path (req) : path of the database file
+
+Methods :
+
+    import_xml (store, data_path) : Copy the orders of the xml files of the
+                                    data_path folders into a store
+
+    order_status (root) : Current step and status of an order
+                          ie: "entry:sent", "action:active", "done"
+
+"""
+# #############79##############################################################
+#                                      #
+__author__ = "jxtrbtk"                 #
+__contact__ = "bYhO-bOwA-dIcA"         #
+__email__ = "j.t[4t]free.fr"           #
+__version__ = "1.0.0"                  #
+#                                      #
+# ##################################79#########################################
+
+import os
+import json
+import uuid
+import sqlite3
+import threading
+import xml.etree.ElementTree as etree
+
+STAGES = ("in", "work", "bak")
+PARTS = ("header", "entry", "action", "audit")
+STEPS = ("entry", "action", "audit")
+# extension of the batch files of XmlOrderStore.create_many
+BATCH_EXTENSION = ".batch"
+
+def order_status(root):
+    """Return the current step and status of an order, ie: "entry:sent",
+    "action:active" or "done" when all the steps are ready
+    Arguments:
+        root: xml root element of the order
+    """
+    for step in STEPS:
+        element = root.find(step)
+        if element is not None and element.get("status") != "ready":
+            return step + ":" + (element.get("status") or "init")
+    return "done"
+
+class OrderStore(object):
+    """Interface of the order stores. The orders are identified by an id
+    (string), they are exchanged as xml root elements."""
+
+    def create(self, root):
+        """Add a new order in the "in" stage, return its id"""
+        raise NotImplementedError
+
+    def create_many(self, roots):
+        """Add new orders in the "in" stage at once, return their ids"""
+        return [self.create(root) for root in roots]
+
+    def list(self, stage):
+        """Return the ids of the orders of a stage ("in", "work", "bak")"""
+        raise NotImplementedError
+
+    def load(self, order_id):
+        """Return the xml root element of an order"""
+        raise NotImplementedError
+
+    def save(self, order_id, root, stage=None):
+        """Save an order, and move it to another stage if stage is given, in
+        a single transaction"""
+        raise NotImplementedError
+
+    def move(self, order_id, stage):
+        """Move an order to another stage"""
+        raise NotImplementedError
+
+    def feed(self, order_id):
+        """Move a new order from "in" to "work", return its id in "work" """
+        self.move(order_id, "work")
+        return order_id
+
+    def feed_batches(self):
+        """Move the orders created by create_many to "work" at once, return
+        their ids (the orders still listed in "in" are fed one by one)"""
+        return []
+
+    def get_pair(self, order_id):
+        """Return the pair of an order"""
+        return self.load(order_id).find("header").get("pair")
+
+    def find(self, stage=None, status=None, pair=None):
+        """Return the ids of the orders matching the stage, the status (see
+        order_status) and the pair given"""
+        result = []
+        for item_stage in STAGES:
+            if stage is not None and item_stage != stage:
+                continue
+            for order_id in self.list(item_stage):
+                root = self.load(order_id)
+                if pair is not None and \
+                        root.find("header").get("pair") != pair:
+                    continue
+                if status is not None and order_status(root) != status:
+                    continue
+                result.append(order_id)
+        return result
+
+    def sync(self):
+        """Make the orders saved durable (synced to the disk), called once
+        per tick"""
+        pass
+
+    def close(self):
+        """Release the resources of the store"""
+        pass
+
+class XmlOrderStore(OrderStore):
+    """Orders kept as xml files, one file <id>.xml per order in the
+    <data_path>/<stage> folders.
+    Arguments:
+        data_path: folder of the stage subfolders
+    """
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.lock = threading.Lock()
+        self.dirty = set()
+
+    def __getstate__(self):
+        # sent to another process: the files to sync stay behind
+        return {"data_path": self.data_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["data_path"])
+
+    def path(self, order_id, stage):
+        """Return the path of the file of an order"""
+        return os.path.join(self.data_path, stage, order_id + ".xml")
+
+    def write(self, root, file_path):
+        """Write an order in a file: a temp file renamed, so the file has
+        either the old or the new order, never a part of it"""
+        temp_path = file_path + ".tmp"
+        etree.ElementTree(root).write(temp_path)
+        os.replace(temp_path, file_path)
+        with self.lock:
+            self.dirty.add(file_path)
+
+    def sync(self):
+        with self.lock:
+            paths = self.dirty
+            self.dirty = set()
+        folders = set()
+        for file_path in paths:
+            if not os.path.exists(file_path):
+                # moved since, its folder is synced
+                continue
+            fd = os.open(file_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            folders.add(os.path.dirname(file_path))
+        if paths:
+            folders.update(os.path.join(self.data_path, stage)
+                           for stage in STAGES)
+        for folder in folders:
+            if not os.path.exists(folder):
+                continue
+            try:
+                fd = os.open(folder, os.O_RDONLY)
+            except OSError:
+                # no directory sync on this platform
+                continue
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    def create(self, root):
+        order_id = str(uuid.uuid4())
+        self.write(root, self.path(order_id, "in"))
+        return order_id
+
+    def create_many(self, roots):
+        # a single file <batch id>.batch in "in": <orders><order id=...>
+        batch = etree.Element("orders")
+        order_ids = []
+        for root in roots:
+            order_id = str(uuid.uuid4())
+            root.set("id", order_id)
+            batch.append(root)
+            order_ids.append(order_id)
+        if order_ids:
+            folder = os.path.join(self.data_path, "in")
+            if not os.path.exists(folder):
+                os.mkdir(folder)
+            self.write(batch, os.path.join(folder, str(uuid.uuid4()) +
+                                           BATCH_EXTENSION))
+        return order_ids
+
+    def feed_batches(self):
+        folder = os.path.join(self.data_path, "in")
+        if not os.path.exists(folder):
+            return []
+        order_ids = []
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(BATCH_EXTENSION):
+                continue
+            file_path = os.path.join(folder, name)
+            for root in etree.parse(file_path).getroot():
+                order_id = root.attrib.pop("id")
+                file_order = self.path(order_id, "work")
+                # already fed if the feed of the batch was cut
+                if not os.path.exists(file_order):
+                    self.write(root, file_order)
+                order_ids.append(order_id)
+            os.remove(file_path)
+        return order_ids
+
+    def list(self, stage):
+        folder = os.path.join(self.data_path, stage)
+        if not os.path.exists(folder):
+            return []
+        return [name[:-4] for name in os.listdir(folder)
+                if name.endswith(".xml")]
+
+    def load(self, order_id):
+        file_path = self.path(order_id, "work")
+        if not os.path.exists(file_path):
+            file_path = self.path(order_id, self.stage(order_id))
+        return etree.parse(file_path).getroot()
+
+    def save(self, order_id, root, stage=None):
+        self.write(root, self.path(order_id, "work"))
+        if stage is not None and stage != "work":
+            self.move(order_id, stage)
+
+    def move(self, order_id, stage):
+        folder = os.path.join(self.data_path, stage)
+        if not os.path.exists(folder):
+            os.mkdir(folder)
+        os.rename(self.path(order_id, self.stage(order_id)),
+                  self.path(order_id, stage))
+        with self.lock:
+            self.dirty.add(self.path(order_id, stage))
+
+    def feed(self, order_id):
+        # a new name, in case the file was dropped by hand in "in"
+        new_id = str(uuid.uuid4())
+        os.rename(self.path(order_id, "in"), self.path(new_id, "work"))
+        with self.lock:
+            self.dirty.add(self.path(new_id, "work"))
+        return new_id
+
+    def stage(self, order_id):
+        """Return the stage of an order"""
+        for stage in STAGES:
+            if os.path.exists(self.path(order_id, stage)):
+                return stage
+        raise KeyError(order_id)
+
+class SqliteOrderStore(OrderStore):
+    """Orders kept in a SQLite database (WAL mode). The attributes of the
+    header/entry/action/audit elements are kept as JSON in a column each.
+    Each thread (and process) uses its own connection.
+    Arguments:
+        file_path: path of the database file
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.local = threading.local()
+        self.connect().close()
+        self.local.connection = None
+
+    def __getstate__(self):
+        # sent to another process: the connections stay behind
+        return {"file_path": self.file_path}
+
+    def __setstate__(self, state):
+        self.file_path = state["file_path"]
+        self.local = threading.local()
+
+    def connect(self):
+        """Return the connection of the current thread, open it if needed"""
+        connection = getattr(self.local, "connection", None)
+        if connection is not None and self.local.pid == os.getpid():
+            return connection
+        connection = sqlite3.connect(self.file_path, timeout=30,
+                                     isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""CREATE TABLE IF NOT EXISTS orders (
+                id TEXT PRIMARY KEY, stage TEXT, pair TEXT, status TEXT,
+                date TEXT, header TEXT, entry TEXT, action TEXT, audit TEXT)
+                """)
+        connection.execute("""CREATE INDEX IF NOT EXISTS orders_status
+                ON orders (stage, status)""")
+        connection.execute("""CREATE INDEX IF NOT EXISTS orders_pair
+                ON orders (pair, stage)""")
+        self.local.connection = connection
+        self.local.pid = os.getpid()
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def sync(self):
+        # synchronous=NORMAL: the commits are synced by the checkpoints
+        self.connect().execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def row(self, root):
+        """Return the columns of an order"""
+        columns = {}
+        for part in PARTS:
+            element = root.find(part)
+            columns[part] = json.dumps(dict(element.attrib)
+                                       if element is not None else {})
+        header = root.find("header")
+        columns["pair"] = header.get("pair")
+        columns["date"] = header.get("date")
+        columns["status"] = order_status(root)
+        return columns
+
+    def root(self, row):
+        """Return the xml root element of the columns of an order"""
+        root = etree.Element("order")
+        for part, data in zip(PARTS, row):
+            etree.SubElement(root, part, json.loads(data or "{}"))
+        return root
+
+    def create(self, root):
+        order_id = str(uuid.uuid4())
+        self.insert(order_id, root, "in")
+        return order_id
+
+    def create_many(self, roots):
+        rows = []
+        for root in roots:
+            columns = self.row(root)
+            rows.append((str(uuid.uuid4()), "in", columns["pair"],
+                         columns["status"], columns["date"],
+                         columns["header"], columns["entry"],
+                         columns["action"], columns["audit"]))
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                    """INSERT INTO orders (id, stage, pair, status, date,
+                    header, entry, action, audit)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+        return [row[0] for row in rows]
+
+    def insert(self, order_id, root, stage):
+        """Add an order with the given id in a stage"""
+        columns = self.row(root)
+        self.connect().execute(
+                """INSERT INTO orders (id, stage, pair, status, date,
+                header, entry, action, audit)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (order_id, stage, columns["pair"], columns["status"],
+                 columns["date"], columns["header"], columns["entry"],
+                 columns["action"], columns["audit"]))
+
+    def list(self, stage):
+        cursor = self.connect().execute(
+                "SELECT id FROM orders WHERE stage = ? ORDER BY date",
+                (stage,))
+        return [item[0] for item in cursor]
+
+    def load(self, order_id):
+        cursor = self.connect().execute(
+                """SELECT header, entry, action, audit FROM orders
+                WHERE id = ?""", (order_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(order_id)
+        return self.root(row)
+
+    def save(self, order_id, root, stage=None):
+        columns = self.row(root)
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                    """UPDATE orders SET status = ?, header = ?, entry = ?,
+                    action = ?, audit = ?, stage = COALESCE(?, stage)
+                    WHERE id = ?""",
+                    (columns["status"], columns["header"], columns["entry"],
+                     columns["action"], columns["audit"], stage, order_id))
+
+    def move(self, order_id, stage):
+        self.connect().execute("UPDATE orders SET stage = ? WHERE id = ?",
+                               (stage, order_id))
+
+    def feed_batches(self):
+        # all the new orders in a single transaction
+        connection = self.connect()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            order_ids = [item[0] for item in connection.execute(
+                    "SELECT id FROM orders WHERE stage = 'in'")]
+            connection.execute(
+                    "UPDATE orders SET stage = 'work' WHERE stage = 'in'")
+        return order_ids
+
+    def get_pair(self, order_id):
+        cursor = self.connect().execute(
+                "SELECT pair FROM orders WHERE id = ?", (order_id,))
+        row = cursor.fetchone()
+        if row is None:
+            raise KeyError(order_id)
+        return row[0]
+
+    def find(self, stage=None, status=None, pair=None):
+        sql = "SELECT id FROM orders WHERE 1=1"
+        args = []
+        for column, value in (("stage", stage), ("status", status),
+                              ("pair", pair)):
+            if value is not None:
+                sql += " AND " + column + " = ?"
+                args.append(value)
+        return [item[0] for item in self.connect().execute(sql, args)]
+
+def import_xml(store, data_path, remove=False):
+    """Copy the orders of the xml files of the data_path/<stage> folders into
+    a store (one-shot migration). The orders already in the store are skipped.
+    The batch files (see XmlOrderStore.create_many) are expanded, the other
+    files (ie: temp files of a write cut by a crash) are ignored.
+    Return the number of orders imported.
+    Arguments:
+        store: SqliteOrderStore receiving the orders
+        data_path: folder of the stage subfolders of the xml files
+        remove: delete the xml files imported (default False)
+    """
+    count = 0
+    for stage in STAGES:
+        folder = os.path.join(data_path, stage)
+        if not os.path.exists(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            file_path = os.path.join(folder, name)
+            if name.endswith(".xml"):
+                orders = [(name[:-4], etree.parse(file_path).getroot())]
+            elif name.endswith(BATCH_EXTENSION):
+                orders = [(root.attrib.pop("id"), root)
+                          for root in etree.parse(file_path).getroot()]
+            else:
+                continue
+            for order_id, root in orders:
+                try:
+                    store.load(order_id)
+                    continue
+                except KeyError:
+                    pass
+                store.insert(order_id, root, stage)
+                count += 1
+            if remove:
+                os.remove(file_path)
+    return count
+
+# #######################################################79####################